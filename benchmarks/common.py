@@ -0,0 +1,54 @@
+"""
+    Shared setup for the benchmarks. They run against the in-memory Datastore
+    (so no emulator is needed) using the models from gcloudc.tests, e.g.
+
+        python benchmarks/entity_transform.py
+
+    DJANGO_SETTINGS_MODULE defaults to test_settings. Every database is
+    switched to IN_MEMORY, whatever the settings say.
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+    import django
+    from django.conf import settings
+
+    django.setup()
+
+    for database in settings.DATABASES.values():
+        database["IN_MEMORY"] = True
+
+
+def best_of(function, repeat=3, setup=None):
+    """
+        Returns the fastest of `repeat` calls to function, in seconds. If setup
+        is passed it's called before each run (untimed) and its result is passed
+        to function.
+    """
+    timings = []
+    for i in range(repeat):
+        argument = setup() if setup else None
+
+        start = time.perf_counter()
+        function(argument) if setup else function()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def report(name, seconds, count=None):
+    line = "{:<50} {:>8.3f}s".format(name, seconds)
+    if count:
+        line += " ({:.1f}us each)".format(seconds / count * 1000000)
+    print(line)
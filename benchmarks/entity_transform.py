@@ -0,0 +1,59 @@
+"""
+    Times how long a SelectCommand takes to turn the entities returned by the
+    Datastore into results (EntityTransformer), for 50k TestUser entities.
+"""
+
+import datetime
+
+from common import (
+    best_of,
+    report,
+    setup,
+)
+
+ENTITY_COUNT = 50000
+
+
+def main():
+    setup()
+
+    from django.db import connection
+    from google.cloud.datastore.entity import Entity
+    from google.cloud.datastore.key import Key
+
+    from gcloudc.db.backends.datastore.commands import EntityTransformer
+    from gcloudc.tests.models import TestUser
+
+    command, params = TestUser.objects.all().query.get_compiler(connection=connection).as_sql()
+    table = TestUser._meta.db_table
+    now = datetime.datetime(2020, 1, 1, 12, 0)
+
+    def make_entities():
+        entities = []
+        for i in range(ENTITY_COUNT):
+            entity = Entity(Key(table, i + 1, project="test"))
+            entity.update({
+                "username": "user{}".format(i),
+                "first_name": b"First",
+                "second_name": "Second",
+                "email": "user{}@example.com".format(i),
+                "field2": "",
+                "last_login": now,
+            })
+            entities.append(entity)
+        return entities
+
+    def transform(entities):
+        transformer = EntityTransformer(command.query)
+        for entity in entities:
+            transformer(entity)
+
+    report(
+        "Transform {} entities".format(ENTITY_COUNT),
+        best_of(transform, setup=make_entities),
+        ENTITY_COUNT,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+    Times prefetch_related() of a RelatedListField, for 1k parents which each
+    have 20 related ids (drawn from 2k related instances, so they overlap).
+"""
+
+import random
+
+from common import (
+    best_of,
+    report,
+    setup,
+)
+
+PARENT_COUNT = 1000
+RELATED_PER_PARENT = 20
+RELATED_COUNT = 2000
+
+
+def main():
+    setup()
+
+    from gcloudc.db.backends.datastore import caching
+    from gcloudc.tests.models import (
+        ISModel,
+        ISOther,
+    )
+
+    other_ids = [ISOther.objects.create(name=str(i)).pk for i in range(RELATED_COUNT)]
+
+    rng = random.Random(0)
+    for i in range(PARENT_COUNT):
+        ISModel.objects.create(related_list_ids=rng.sample(other_ids, RELATED_PER_PARENT))
+
+    def prefetch(unused):
+        parents = list(ISModel.objects.prefetch_related("related_list"))
+        for parent in parents:
+            list(parent.related_list.all())
+
+    report(
+        "Prefetch {} x {} related".format(PARENT_COUNT, RELATED_PER_PARENT),
+        best_of(prefetch, setup=caching.reset_context),
+        PARENT_COUNT,
+    )
+
+
+if __name__ == "__main__":
+    main()
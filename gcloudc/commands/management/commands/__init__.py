@@ -1,14 +1,18 @@
 import json
 import logging
 import os
+import shutil
 import subprocess
+import tempfile
 import time
-from datetime import datetime
 from urllib.error import (
     HTTPError,
     URLError,
 )
-from urllib.request import urlopen
+from urllib.request import (
+    Request,
+    urlopen,
+)
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -21,12 +25,24 @@ _REQUIRED_COMPONENTS = set(["beta", "cloud-datastore-emulator", "core"])
 _BASE_COMMAND = "gcloud beta emulators datastore start --user-output-enabled=false --consistency=1.0 --quiet --project=test".split()  # noqa
 _DEFAULT_PORT = 9090
 
+_DATASTORE_ENGINE = "gcloudc.db.backends.datastore"
+
+# The result of the components check is cached until the SDK is updated
+_COMPONENTS_CACHE_FILE = os.path.join(tempfile.gettempdir(), "gcloudc_components.json")
+
+# Readiness is polled quickly at first, backing off to this interval
+_MIN_POLL_INTERVAL = 0.01
+_MAX_POLL_INTERVAL = 0.08
+
 logger = logging.getLogger(__name__)
 
 
 class CloudDatastoreRunner:
     USE_MEMORY_DATASTORE_BY_DEFAULT = False
 
+    # Whether to clear the data of an emulator we attach to
+    RESET_ATTACHED_DATASTORE = False
+
     def __init__(self, *args, **kwargs):
         self._process = None
         super().__init__(*args, **kwargs)
@@ -41,18 +57,82 @@ class CloudDatastoreRunner:
             dest="use_memory_datastore",
             default=self.USE_MEMORY_DATASTORE_BY_DEFAULT,
         )
+        parser.add_argument(
+            "--attach",
+            action="store_true",
+            dest="attach",
+            default=False,
+            help="Use the Cloud Datastore Emulator already running on the port, if there is one",
+        )
+        parser.add_argument(
+            "--keep-datastore",
+            action="store_true",
+            dest="keep_datastore",
+            default=False,
+            help=(
+                "Leave the Cloud Datastore Emulator running when the command exits, so later runs "
+                "can attach to it (implies --attach)"
+            ),
+        )
 
     def execute(self, *args, **kwargs):
         try:
-            if kwargs.get("datastore", True) and os.environ.get(DJANGO_AUTORELOAD_ENV) != "true":
-                self._check_gcloud_components()
-                self._start_emulator(**kwargs)
+            if (
+                kwargs.get("datastore", True)
+                and os.environ.get(DJANGO_AUTORELOAD_ENV) != "true"
+                and self._uses_emulator()
+            ):
+                port = kwargs.get("port", _DEFAULT_PORT)
+                attach = kwargs.get("attach") or kwargs.get("keep_datastore")
+
+                if attach and self._datastore_is_running(port):
+                    self._attach_to_emulator(port)
+                else:
+                    self._check_gcloud_components()
+                    self._start_emulator(**kwargs)
 
             super().execute(*args, **kwargs)
         finally:
             self._stop_emulator()
 
+    def _uses_emulator(self):
+        """
+            The emulator isn't needed if every Datastore database is in-memory
+        """
+        return any(
+            database.get("ENGINE") == _DATASTORE_ENGINE and not database.get("IN_MEMORY")
+            for database in settings.DATABASES.values()
+        )
+
+    def _sdk_version(self):
+        """
+            Returns a string which changes whenever the SDK is updated or components
+            are installed, or None if we can't tell. This avoids running the (slow)
+            gcloud command to find out.
+        """
+        gcloud = shutil.which("gcloud")
+        if not gcloud:
+            return None
+
+        sdk_root = os.path.dirname(os.path.dirname(os.path.realpath(gcloud)))
+
+        try:
+            with open(os.path.join(sdk_root, "VERSION")) as f:
+                version = f.read().strip()
+            return "{}:{}".format(version, os.stat(os.path.join(sdk_root, ".install")).st_mtime)
+        except OSError:
+            return None
+
     def _check_gcloud_components(self):
+        sdk_version = self._sdk_version()
+        if sdk_version:
+            try:
+                with open(_COMPONENTS_CACHE_FILE) as f:
+                    if json.load(f).get("sdk_version") == sdk_version:
+                        return
+            except (OSError, ValueError):
+                pass
+
         finished_process = subprocess.run(_COMPONENTS_LIST_COMMAND, stdout=subprocess.PIPE, encoding="utf-8")
         installed_components = set(
             [cp["id"] for cp in json.loads(finished_process.stdout) if cp["current_version_string"] is not None]
@@ -66,6 +146,13 @@ class CloudDatastoreRunner:
                 )
             )
 
+        if sdk_version:
+            try:
+                with open(_COMPONENTS_CACHE_FILE, "w") as f:
+                    json.dump({"sdk_version": sdk_version}, f)
+            except OSError:
+                logger.warning("Unable to cache the Google Cloud SDK components check")
+
     def _datastore_filename(self):
         BASE_DIR = getattr(settings, "BASE_DIR", None)
 
@@ -85,55 +172,78 @@ class CloudDatastoreRunner:
 
         return args
 
+    def _datastore_url(self, port, path=""):
+        return "http://127.0.0.1:%s/%s" % (port, path)
+
+    def _datastore_is_running(self, port):
+        try:
+            response = urlopen(self._datastore_url(port), timeout=1)
+        except (HTTPError, URLError, OSError):
+            return False
+        return response.status == 200
+
+    def _set_environment(self, port):
+        os.environ["DATASTORE_EMULATOR_HOST"] = "127.0.0.1:%s" % port
+        os.environ["DATASTORE_PROJECT_ID"] = "test"
+
     def _wait_for_datastore(self, **kwargs):
         TIMEOUT = 60.0
 
-        start = datetime.now()
+        start = time.time()
+        interval = _MIN_POLL_INTERVAL
 
         logger.info("Waiting for Cloud Datastore Emulator...")
-        time.sleep(1)
 
-        failures = 0
-        while True:
-            try:
-                response = urlopen("http://127.0.0.1:%s/" % kwargs["port"])
-            except (HTTPError, URLError):
-                failures += 1
-                time.sleep(1)
-                if failures > 5:
-                    # Only start logging if this becomes persistent
-                    logger.exception(
-                        "Error connecting to the Cloud Datastore Emulator. Retrying...")
-                continue
-
-            if response.status == 200:
-                # Give things a second to really boot
-                time.sleep(2)
-                break
-
-            if (datetime.now() - start).total_seconds() > TIMEOUT:
+        while not self._datastore_is_running(kwargs["port"]):
+            if self._process and self._process.poll() is not None:
+                raise RuntimeError("The Cloud Datastore Emulator exited unexpectedly. Please check the logs.")
+
+            if (time.time() - start) > TIMEOUT:
                 raise RuntimeError("Unable to start Cloud Datastore Emulator. Please check the logs.")
 
-            time.sleep(1)
+            time.sleep(interval)
+            interval = min(interval * 2, _MAX_POLL_INTERVAL)
+
+    def _attach_to_emulator(self, port):
+        logger.info("Using the Cloud Datastore Emulator already running on port %s", port)
+
+        self._set_environment(port)
+
+        if self.RESET_ATTACHED_DATASTORE:
+            # Clear out anything left behind by a previous run
+            urlopen(Request(self._datastore_url(port, "reset"), data=b"", method="POST"), timeout=10)
 
     def _start_emulator(self, **kwargs):
         logger.info("Starting Cloud Datastore Emulator")
 
-        os.environ["DATASTORE_EMULATOR_HOST"] = "127.0.0.1:%s" % kwargs["port"]
-        os.environ["DATASTORE_PROJECT_ID"] = "test"
+        self._set_environment(kwargs["port"])
 
         # The Cloud Datastore emulator regularly runs out of heap space
         # so set a higher max
         os.environ["JDK_JAVA_OPTIONS"] = "-Xms512M -Xmx1024M"
 
+        keep_running = kwargs.get("keep_datastore", False)
+
         env = os.environ.copy()
-        self._process = subprocess.Popen(_BASE_COMMAND + self._get_args(**kwargs), env=env)
+        self._process = subprocess.Popen(
+            _BASE_COMMAND + self._get_args(**kwargs),
+            env=env,
+            # Run a long-lived emulator in its own session so it isn't sent our Ctrl+C
+            start_new_session=keep_running,
+        )
 
         self._wait_for_datastore(**kwargs)
 
+        if keep_running:
+            logger.info(
+                "The Cloud Datastore Emulator will keep running, stop it with: curl -X POST %s",
+                self._datastore_url(kwargs["port"], "shutdown"),
+            )
+            self._process = None
+
     def _stop_emulator(self):
-        logger.info("Stopping Cloud Datastore Emulator")
         if self._process:
+            logger.info("Stopping Cloud Datastore Emulator")
             self._process.terminate()
             self._process.wait()
             self._process = None
@@ -0,0 +1,22 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from gcloudc.db.models.fields.computed import (
+    COLLATION_CACHE_FILE,
+    build_collation_cache,
+)
+
+
+class Command(BaseCommand):
+    help = "Parses the collation table used by ComputedCollationField, so instances don't need to"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", dest="output", default=COLLATION_CACHE_FILE)
+
+    def handle(self, *args, **options):
+        if not build_collation_cache(options["output"]):
+            raise CommandError("Unable to write the collation cache to {}".format(options["output"]))
+
+        self.stdout.write("Wrote the collation cache to {}".format(options["output"]))
@@ -10,6 +10,7 @@ BaseCommand = locate_command("test")
 
 class Command(CloudDatastoreRunner, BaseCommand):
     USE_MEMORY_DATASTORE_BY_DEFAULT = True
+    RESET_ATTACHED_DATASTORE = True
 
     def _datastore_filename(self):
         print("Creating temporary test database...")
@@ -0,0 +1 @@
+from .transaction import batch  # noqa
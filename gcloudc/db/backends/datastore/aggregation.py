@@ -0,0 +1,96 @@
+"""
+    The Datastore API we use has no server-side aggregation, so aggregate()
+    queries are evaluated by streaming the values of each aggregated column
+    (using a projection query where possible, or a keys-only query for a count)
+    and accumulating the results as they arrive, rather than loading the
+    instances into memory.
+"""
+
+import decimal
+
+from .utils import ensure_datetime
+
+# The column used for Count("*") and aggregates of the primary key
+KEY_COLUMN = "__key__"
+
+DATETIME_TYPES = ("DateTimeField", "DateField", "TimeField")
+
+
+def prepare_value(field, value):
+    """
+        Converts a value returned from the Datastore into something which can be
+        summed or compared
+    """
+    if value is None or field is None:
+        return value
+
+    internal_type = field.get_internal_type()
+    if internal_type == "DecimalField":
+        # Decimals are stored as strings
+        return decimal.Decimal(value)
+    elif internal_type in DATETIME_TYPES and isinstance(value, int):
+        # Projection queries return datetimes as integers
+        return ensure_datetime(value)
+    return value
+
+
+def id_sort_value(id_or_name):
+    """
+        Orders the ids of keys of the same kind like the Datastore does (and
+        query_utils.key_sort_value), with integer ids before names
+    """
+    return (isinstance(id_or_name, str), id_or_name)
+
+
+class Accumulator(object):
+    """
+        Accumulates the result of a single aggregate function (one of
+        query.VALID_ANNOTATIONS) as values are added. Min and max compare
+        the values by sort_key, if it's passed.
+    """
+
+    def __init__(self, function, distinct=False, sort_key=None):
+        self.function = function
+        self.seen = set() if distinct else None
+        self.sort_key = sort_key
+
+        self.count = 0
+        self.total = None
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        # Like SQL, aggregates ignore NULL
+        if value is None:
+            return
+
+        if self.seen is not None:
+            if value in self.seen:
+                return
+            self.seen.add(value)
+
+        self.count += 1
+
+        if self.function in ("SUM", "AVG"):
+            self.total = value if self.total is None else self.total + value
+        elif self.function == "MIN":
+            if self.minimum is None or self._sort_value(value) < self._sort_value(self.minimum):
+                self.minimum = value
+        elif self.function == "MAX":
+            if self.maximum is None or self._sort_value(value) > self._sort_value(self.maximum):
+                self.maximum = value
+
+    def _sort_value(self, value):
+        return self.sort_key(value) if self.sort_key else value
+
+    def result(self):
+        if self.function == "COUNT":
+            return self.count
+        elif self.function == "SUM":
+            return self.total
+        elif self.function == "AVG":
+            return self.total / self.count if self.count else None
+        elif self.function == "MIN":
+            return self.minimum
+        elif self.function == "MAX":
+            return self.maximum
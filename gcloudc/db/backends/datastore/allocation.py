@@ -0,0 +1,90 @@
+"""
+    The Datastore API won't generate IDs for new entities until a transaction
+    commits, which is too late for Django which needs the pk straight away.
+
+    So instead we allocate blocks of IDs for each kind with allocate_ids() and hand
+    them out locally, topping up the block in the background before it runs out.
+"""
+
+import collections
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 100
+
+BLOCK_SIZE = getattr(settings, "GCLOUDC_ID_ALLOCATION_BLOCK_SIZE", DEFAULT_BLOCK_SIZE)
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+class IdAllocator(object):
+    """
+        Hands out IDs for a single kind (in a single namespace) from blocks
+        reserved with allocate_ids(). This is thread-safe.
+
+        Allocators are shared between connections (and so threads), so they don't
+        keep hold of a client. The RPCs are made with the client of the connection
+        which asked for an ID, and so are instrumented as that connection's.
+    """
+
+    def __init__(self, kind, namespace, block_size=BLOCK_SIZE):
+        self.kind = kind
+        self.namespace = namespace
+        self.block_size = block_size
+
+        # Once we're down to this many IDs we start allocating the next block
+        self.low_water_mark = block_size // 4
+
+        self._ids = collections.deque()
+        self._lock = threading.Lock()
+        self._refill_thread = None
+
+    def _allocate(self, client):
+        incomplete_key = client.key(self.kind, namespace=self.namespace)
+        return [x.id for x in client.allocate_ids(incomplete_key, self.block_size)]
+
+    def _refill(self, client):
+        try:
+            ids = self._allocate(client)
+        except Exception:
+            # We'll try again (synchronously) when we run out
+            logger.exception("Unable to allocate IDs for %s", self.kind)
+            ids = []
+
+        with self._lock:
+            self._ids.extend(ids)
+            self._refill_thread = None
+
+    def next_id(self, client):
+        with self._lock:
+            if len(self._ids) <= self.low_water_mark and self._refill_thread is None and self._ids:
+                self._refill_thread = threading.Thread(target=self._refill, args=(client,))
+                self._refill_thread.daemon = True
+                self._refill_thread.start()
+
+            if self._ids:
+                return self._ids.popleft()
+
+        # We've run out, so we need to wait for a new block
+        ids = self._allocate(client)
+        with self._lock:
+            self._ids.extend(ids[1:])
+        return ids[0]
+
+
+def get_id_allocator(project, kind, namespace):
+    """
+        Returns the (shared) IdAllocator for the kind
+    """
+    cache_key = (project, namespace, kind)
+
+    allocator = _allocators.get(cache_key)
+    if allocator is None:
+        with _allocators_lock:
+            allocator = _allocators.setdefault(cache_key, IdAllocator(kind, namespace))
+    return allocator
@@ -1,6 +1,7 @@
 import datetime
 import decimal
 import logging
+import operator
 import os
 import uuid
 import warnings
@@ -29,8 +30,14 @@ from google.cloud import (
     datastore,
     environment_vars,
 )
+from google.cloud.datastore.entity import Entity
+from google.cloud.datastore.key import Key
 
 from . import dbapi as Database
+from . import (
+    flushing,
+    memory,
+)
 from .commands import (
     DeleteCommand,
     FlushCommand,
@@ -40,6 +47,14 @@ from .commands import (
     coerce_unicode,
 )
 from .indexing import load_special_indexes
+from .instrumentation import (
+    Instrumentation,
+    instrument_client,
+)
+from .querylog import (
+    QueryLog,
+    query_log_enabled,
+)
 from .utils import (
     decimal_to_string,
     ensure_datetime,
@@ -56,17 +71,22 @@ class Connection(object):
     def __init__(self, wrapper, params):
         self.creation = wrapper.creation
         self.ops = wrapper.ops
-        self.queries = []
+        self.queries = QueryLog(enabled=query_log_enabled())
         self.settings_dict = params
         self.namespace = wrapper.namespace
 
-        self.gclient = datastore.Client(
-            namespace=wrapper.namespace,
-            project=params["PROJECT"],
-            # avoid a bug in the google client - it tries to authenticate even when the emulator is enabled
-            # see https://github.com/googleapis/google-cloud-python/issues/5738
-            _http=requests.Session if os.environ.get(environment_vars.GCD_HOST) else None,
-        )
+        if params.get("IN_MEMORY"):
+            self.gclient = memory.Client(namespace=wrapper.namespace, project=params["PROJECT"])
+        else:
+            self.gclient = datastore.Client(
+                namespace=wrapper.namespace,
+                project=params["PROJECT"],
+                # avoid a bug in the google client - it tries to authenticate even when the emulator is enabled
+                # see https://github.com/googleapis/google-cloud-python/issues/5738
+                _http=requests.Session if os.environ.get(environment_vars.GCD_HOST) else None,
+            )
+
+        instrument_client(self.gclient, Instrumentation(wrapper.alias, self.queries))
 
     def acquire_constraint_markers(self, markers):
         pass
@@ -84,6 +104,30 @@ class Connection(object):
         pass
 
 
+def _row_getter(columns):
+    """
+        Returns a function which reads a tuple of the given columns from a result
+    """
+    columns = tuple(columns)
+    if not columns:
+        return lambda result: ()
+
+    getter = operator.itemgetter(*columns)
+    single_column = len(columns) == 1
+
+    def get_row(result):
+        try:
+            row = getter(result)
+        except KeyError:
+            # Entities don't have to have every property, so fall back to a slower
+            # lookup which fills in None for any missing columns
+            return tuple([result.get(x) for x in columns])
+
+        return (row,) if single_column else row
+
+    return get_row
+
+
 class Cursor(object):
     """ Dummy cursor class """
 
@@ -94,12 +138,28 @@ class Cursor(object):
         self.rowcount = -1
         self.last_select_command = None
         self.last_delete_command = None
+        self._get_row = None
+        self._log_entry = None
 
     def execute(self, sql, *params):
+        log = self.connection.queries
+        if not log.enabled:
+            self._log_entry = None
+            return self._execute(sql)
+
+        self._log_entry = log.add(sql)
+        with log.recording(self._log_entry):
+            self._execute(sql)
+
+    def _execute(self, sql):
         if isinstance(sql, SelectCommand):
             # Also catches subclasses of SelectCommand (e.g Update)
             self.last_select_command = sql
             self.rowcount = self.last_select_command.execute() or -1
+
+            # Extra select values are prepended to the resulting row
+            query = sql.query
+            self._get_row = _row_getter([col for col, select in query.extra_selects] + list(query.init_list))
         elif isinstance(sql, FlushCommand):
             sql.execute()
         elif isinstance(sql, UpdateCommand):
@@ -107,7 +167,6 @@ class Cursor(object):
         elif isinstance(sql, DeleteCommand):
             self.rowcount = sql.execute()
         elif isinstance(sql, InsertCommand):
-            self.connection.queries.append(sql)
             self.returned_ids = sql.execute()
         else:
             raise Database.CouldBeSupportedError(
@@ -121,25 +180,25 @@ class Cursor(object):
         return row
 
     def fetchone(self, delete_flag=False):
+        if self._log_entry is None:
+            return self._fetchone()
+
+        # Selects fetch lazily, so the time (and RPCs) spent fetching count too
+        with self.connection.queries.recording(self._log_entry):
+            return self._fetchone()
+
+    def _fetchone(self):
         try:
             result = next(self.last_select_command.results)
 
             if isinstance(result, int):
                 return (result,)
 
-            query = self.last_select_command.query
-
-            row = []
-
-            # Prepend extra select values to the resulting row
-            for col, select in query.extra_selects:
-                row.append(result.get(col))
-
-            for col in self.last_select_command.query.init_list:
-                row.append(result.get(col))
+            if isinstance(result, tuple):
+                # The results of an aggregate query
+                return result
 
-            self.returned_ids.append(result.key.id_or_name)
-            return row
+            return self._get_row(result)
         except StopIteration:
             return None
 
@@ -147,15 +206,22 @@ class Cursor(object):
         if not self.last_select_command.results:
             return []
 
+        if self._log_entry is None:
+            return self._fetchmany(size)
+
+        with self.connection.queries.recording(self._log_entry):
+            return self._fetchmany(size)
+
+    def _fetchmany(self, size):
         result = []
         for i in range(size):
-            entity = self.fetchone(delete_flag)
-            if entity is None:
+            row = self._fetchone()
+            if row is None:
                 break
 
             # Python DB API suggests a list of tuples, and returning
             # a list-of-lists breaks some tests
-            result.append(tuple(entity))
+            result.append(row)
 
         return result
 
@@ -177,6 +243,7 @@ _BULK_BATCH_SIZE_SETTING = "BULK_BATCH_SIZE"
 
 class DatabaseOperations(BaseDatabaseOperations):
     compiler_module = "gcloudc.db.backends.datastore.compiler"
+    explain_prefix = "EXPLAIN"  # Not sent anywhere, see SQLCompiler.explain_query
 
     # Datastore will store all integers as 64bit long values
     integer_field_ranges = {
@@ -279,16 +346,27 @@ class DatabaseOperations(BaseDatabaseOperations):
         return value
 
     def sql_flush(self, style, tables, seqs, allow_cascade=False):
-        additional_djangaeidx_tables = [
+        written = flushing.written_kinds(self.connection)
+
+        if flushing.can_reset(self.connection):
+            if written is not None and not written:
+                return []
+
+            return [FlushCommand(tables, self.connection, reset=True)]
+
+        if written is None:
+            # We don't know what's in this namespace yet, so flush everything that exists
+            written = self.connection.introspection.table_names()
+            flushing.start_tracking(self.connection, written)
+
+        # Only the tables (and their special index tables) which might contain entities
+        to_flush = [
             x
-            for x in self.connection.introspection.table_names()
-            if [y for y in tables if x.startswith("_djangae_idx_{}".format(y))]
+            for x in sorted(written)
+            if x in tables or [y for y in tables if x.startswith("_djangae_idx_{}".format(y))]
         ]
 
-        return [
-            FlushCommand(table, self.connection)
-            for table in tables + additional_djangaeidx_tables
-        ]
+        return [FlushCommand(to_flush, self.connection)] if to_flush else []
 
     def prep_lookup_key(self, model, value, field):
         if isinstance(value, six.string_types):
@@ -468,6 +546,10 @@ class DatabaseClient(BaseDatabaseClient):
     pass
 
 
+# The most entities the emulator will write or delete in a single call
+CLONE_BATCH_SIZE = 500
+
+
 class DatabaseCreation(BaseDatabaseCreation):
     data_types = {
         "AutoField": "key",
@@ -503,6 +585,8 @@ class DatabaseCreation(BaseDatabaseCreation):
 
     def __init__(self, *args, **kwargs):
         self.testbed = None
+        # Maps the names of the databases cloned for parallel test workers to their namespace
+        self._clone_namespaces = {}
         super(DatabaseCreation, self).__init__(*args, **kwargs)
 
     def sql_create_model(self, model, *args, **kwargs):
@@ -518,11 +602,99 @@ class DatabaseCreation(BaseDatabaseCreation):
         pass
 
     def _destroy_test_db(self, name, verbosity):
-        pass
+        # Only the clones used by parallel test workers are removed, as they
+        # share the Datastore with the main test database
+        namespace = self._clone_namespaces.pop(name, None)
+        if namespace is not None:
+            self._delete_namespace(namespace)
+
+    def test_db_signature(self):
+        # Databases in different namespaces are separate, even on the same Datastore
+        return super().test_db_signature() + (self.connection.settings_dict.get("PROJECT"), self.connection.namespace)
+
+    def _clone_namespace(self, suffix):
+        namespace = self.connection.settings_dict.get("NAMESPACE")
+        return "{}_worker{}".format(namespace, suffix) if namespace else "worker{}".format(suffix)
+
+    def get_test_db_clone_settings(self, suffix):
+        """
+            Each parallel test worker uses its own namespace, so they can all
+            share the same Datastore (emulator) without interfering
+        """
+        settings_dict = super().get_test_db_clone_settings(suffix)
+        settings_dict["NAMESPACE"] = self._clone_namespace(suffix)
+        return settings_dict
+
+    def _namespace_kinds(self, namespace):
+        query = self.connection.connection.gclient.query(kind="__kind__", namespace=namespace)
+        query.keys_only()
+        # Skip the Datastore's own kinds (e.g. statistics)
+        return [x.key.id_or_name for x in query.fetch() if not x.key.id_or_name.startswith("__")]
+
+    def _delete_namespace(self, namespace):
+        client = self.connection.connection.gclient
+        for kind in self._namespace_kinds(namespace):
+            query = client.query(kind=kind, namespace=namespace)
+            query.keys_only()
+
+            keys = [x.key for x in query.fetch(limit=CLONE_BATCH_SIZE)]
+            while keys:
+                client.delete_multi(keys)
+                keys = [x.key for x in query.fetch(limit=CLONE_BATCH_SIZE)]
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        """
+            Copies everything in the test database's namespace into the worker's
+            namespace, any keys stored in properties are moved across too
+        """
+        self.connection.ensure_connection()
+        client = self.connection.connection.gclient
+
+        source = self.connection.namespace
+        settings_dict = self.get_test_db_clone_settings(suffix)
+        target = settings_dict["NAMESPACE"]
+        self._clone_namespaces[settings_dict["NAME"]] = target
+
+        if keepdb:
+            return
+
+        # Whatever was left behind by a previous run (on a kept emulator)
+        self._delete_namespace(target)
+
+        def move_key(key):
+            return client.key(*key.flat_path, namespace=target)
+
+        def move_value(value):
+            if isinstance(value, Key) and value.namespace == source:
+                return move_key(value)
+            elif isinstance(value, list):
+                return [move_value(x) for x in value]
+            return value
+
+        copied = []
+        for kind in self._namespace_kinds(source):
+            for entity in client.query(kind=kind, namespace=source).fetch():
+                clone = Entity(move_key(entity.key), exclude_from_indexes=list(entity.exclude_from_indexes))
+                clone.update({k: move_value(v) for k, v in entity.items()})
+                copied.append(clone)
+
+        for i in range(0, len(copied), CLONE_BATCH_SIZE):
+            client.put_multi(copied[i:i + CLONE_BATCH_SIZE])
+
+        # Make sure IDs allocated in the worker don't collide with the copied ones
+        keys = [x.key for x in copied if isinstance(x.key.id_or_name, int)]
+        if keys:
+            client.reserve_ids_multi(keys)
 
 
 class DatabaseIntrospection(BaseDatabaseIntrospection):
     def get_table_list(self, cursor):
+        # Once we're tracking what's written, that's good enough for Django
+        # to decide what to flush, and saves a query before every flush
+        written = flushing.written_kinds(self.connection)
+        if written is not None:
+            return [TableInfo(x, "t") for x in sorted(written)]
+
         query = cursor.connection.gclient.query(kind="__kind__")
         query.keys_only()
         kinds = [entity.key.id_or_name for entity in query.fetch()]
@@ -569,6 +741,8 @@ class DatabaseFeatures(BaseDatabaseFeatures):
     uses_savepoints = False
     allows_auto_pk_0 = False
     has_native_duration_field = False
+    can_clone_databases = True
+    supported_explain_formats = {"TEXT", "JSON"}
 
 
 class DatabaseWrapper(BaseDatabaseWrapper):
@@ -618,9 +792,13 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             self.validation = BaseDatabaseValidation(self)
 
         self.gcloud_project = self.settings_dict["PROJECT"]
-        self.namespace = self.settings_dict.get("NAMESPACE") or None
         self.autocommit = True
 
+    @property
+    def namespace(self):
+        # Parallel test workers switch namespace by updating the settings
+        return self.settings_dict.get("NAMESPACE") or None
+
     def is_usable(self):
         return True
 
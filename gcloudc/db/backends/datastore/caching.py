@@ -4,7 +4,10 @@ import threading
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
-from . import utils
+from . import (
+    stats,
+    utils,
+)
 from .context import (
     ContextCache,
     key_or_entity_compare,
@@ -152,6 +155,7 @@ def get_from_cache_by_key(key):
     if context.context_enabled:
         # It's safe to hit the context cache, because a new one was pushed on the stack at the start of the transaction
         ret = context.stack.top.get_entity_by_key(key)
+        stats.record_cache_lookup(ret is not None)
 
     return ret
 
@@ -170,6 +174,7 @@ def get_from_cache(unique_identifier, namespace):
     if context.context_enabled:
         # It's safe to hit the context cache, because a new one was pushed on the stack at the start of the transaction
         ret = context.stack.top.get_entity(cache_key)
+        stats.record_cache_lookup(ret is not None)
 
     return ret
 
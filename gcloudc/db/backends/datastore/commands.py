@@ -1,12 +1,16 @@
 import copy
 import decimal
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import django
 from django.db import (
     DatabaseError,
     IntegrityError,
+    connections,
 )
 from django.utils import six
 from django.utils.encoding import (
@@ -19,8 +23,12 @@ from google.cloud.datastore.query import Query
 
 from . import (
     POLYMODEL_CLASS_ATTRIBUTE,
+    aggregation,
     caching,
+    dataloader,
+    flushing,
     meta_queries,
+    querystats,
     transaction,
     utils,
 )
@@ -48,11 +56,14 @@ from .utils import (
     ensure_datetime,
     get_datastore_key,
     get_field_from_column,
+    has_concrete_children,
     has_concrete_parents,
 )
 
 logger = logging.getLogger(__name__)
 
+MAX_CONCURRENT_FLUSHES = 8
+
 OPERATORS_MAP = {
     "exact": "=",
     "gt": ">",
@@ -176,133 +187,127 @@ def can_perform_datastore_get(normalized_query):
     return True
 
 
-class EntityTransforms:
-    @staticmethod
-    def convert_key_to_entity(result):
-        class FakeEntity(dict):
-            def __init__(self, key):
-                self._key = key
-
-            @property
-            def key(self):
-                return self._key
+class KeyEntity(dict):
+    """
+        Stands in for an entity when we only have its key (e.g. from a keys_only query)
+    """
 
-        return FakeEntity(result)
+    def __init__(self, key):
+        self._key = key
 
-    @staticmethod
-    def rename_pk_field(model, concrete_model, result):
-        if result is None:
-            return result
+    @property
+    def key(self):
+        return self._key
 
-        value = result.key.id_or_name
-        result[model._meta.pk.column] = value
-        result[concrete_model._meta.pk.column] = value
-        return result
 
-    @staticmethod
-    def process_extra_selects(query, result):
-        """
-            We handle extra selects by generating the new columns from
-            each result. We can handle simple boolean logic and operators.
-        """
-        if result is None:
-            return result
+EXTRA_SELECT_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S")
 
-        extra_selects = query.extra_selects
-        model_fields = query.model._meta.fields
-
-        DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S")
-
-        def process_arg(arg):
-            if arg.startswith("'") and arg.endswith("'"):
-                # String literal
-                arg = arg.strip("'")
-                # Check to see if this is a date
-                for date in DATE_FORMATS:
-                    try:
-                        value = datetime.strptime(arg, date)
-                        return value
-                    except ValueError:
-                        continue
-                return arg
-            elif arg in [x.column for x in model_fields]:
-                # Column value
-                return result.get(arg)
-
-            # Handle NULL
-            if arg.lower() == "null":
-                return None
-            elif arg.lower() == "true":
-                return True
-            elif arg.lower() == "false":
-                return False
 
-            # See if it's an integer
+def _parse_extra_select_arg(arg, columns):
+    """
+        Returns a tuple of (is_column, value) for an argument to an extra select. If
+        is_column is True then value is the column to read from each result,
+        otherwise it is the literal value of the argument.
+    """
+    if arg.startswith("'") and arg.endswith("'"):
+        # String literal
+        arg = arg.strip("'")
+        # Check to see if this is a date
+        for date in EXTRA_SELECT_DATE_FORMATS:
             try:
-                arg = int(arg)
-            except (TypeError, ValueError):
-                pass
-
-            # Just a plain old literal
-            return arg
+                return False, datetime.strptime(arg, date)
+            except ValueError:
+                continue
+        return False, arg
+    elif arg in columns:
+        # Column value
+        return True, arg
+
+    # Handle NULL
+    if arg.lower() == "null":
+        return False, None
+    elif arg.lower() == "true":
+        return False, True
+    elif arg.lower() == "false":
+        return False, False
+
+    # See if it's an integer
+    try:
+        arg = int(arg)
+    except (TypeError, ValueError):
+        pass
+
+    # Just a plain old literal
+    return False, arg
+
+
+class EntityTransformer(object):
+    """
+        Turns the entities (or keys) returned by a query into the results of
+        a SelectCommand.
 
-        for col, select in extra_selects:
-            result[col] = select[0](*[process_arg(x) for x in select[1]])
+        Everything which only depends on the query (the columns which need converting,
+        the pk columns, the parsed extra select arguments and the excluded keys) is worked
+        out up front, so each entity is then transformed in a single pass. Calling the
+        transformer returns None if the entity should be skipped.
+    """
 
-        return result
+    def __init__(self, query, excluded_pks=()):
+        opts = query.model._meta
+        columns = [x.column for x in opts.fields]
 
-    @staticmethod
-    def convert_datetime_fields(query, result):
-        if result is None:
-            return result
+        self.excluded_pks = frozenset(excluded_pks)
 
-        fields = [
-            x for x in query.model._meta.fields if x.get_internal_type() in ("DateTimeField", "DateField", "TimeField")
-        ]
+        self.datetime_columns = tuple(
+            x.column for x in opts.fields if x.get_internal_type() in ("DateTimeField", "DateField", "TimeField")
+        )
 
-        for field in fields:
-            column = field.column
-            if isinstance(result, dict):  # sometimes it's a key!
-                value = result.get(column)
-            else:
-                value = None
+        # String values returned from projection queries return as 'str' not 'unicode'
+        # See https://github.com/potatolondon/djangae/issues/1026
+        # FIXME: This was the case on App Engine, probably not on Cloud Datastore. When
+        # all original Djangae tests pass, let's remove this and see if they still pass!
+        self.char_columns = tuple(x.column for x in opts.fields if x.get_internal_type() in ("CharField",))
 
-            if value is not None:
-                result[column] = ensure_datetime(value)
+        self.pk_columns = tuple(set([opts.pk.column, query.concrete_model._meta.pk.column]))
 
-        return result
+        # We handle extra selects by generating the new columns from
+        # each result. We can handle simple boolean logic and operators.
+        self.extra_selects = tuple(
+            (col, select[0], tuple(_parse_extra_select_arg(x, columns) for x in select[1]))
+            for col, select in query.extra_selects
+        )
 
-    @staticmethod
-    def fix_projected_values_type(query, result):
-        """
-            String values returned from projection queries return as 'str' not 'unicode'
-            See https://github.com/potatolondon/djangae/issues/1026
+    def __call__(self, entity):
+        if entity is None:
+            return None
 
-            FIXME: This was the case on App Engine, probably not on Cloud Datastore. When
-            all original Djangae tests pass, let's remove this function and see if they still pass!
-        """
+        # If this is a keys only query, we need to generate a fake entity
+        # for each key in the result set
+        if isinstance(entity, Key):
+            entity = KeyEntity(entity)
 
-        if result is None:
+        key = entity.key
+        if key in self.excluded_pks:
             return None
 
-        fields = [x for x in query.model._meta.fields if x.get_internal_type() in ("CharField",)]
-
-        for field in fields:
-            col = field.column
-            if col in result and isinstance(result[col], bytes):
-                result[col] = str(result[col], "utf-8")
+        for column in self.datetime_columns:
+            value = entity.get(column)
+            if value is not None:
+                entity[column] = ensure_datetime(value)
 
-        return result
+        for column in self.char_columns:
+            value = entity.get(column)
+            if isinstance(value, bytes):
+                entity[column] = str(value, "utf-8")
 
-    @staticmethod
-    def ignore_excluded_pks(excluded_pks, result):
-        if result is None:
-            return result
+        value = key.id_or_name
+        for column in self.pk_columns:
+            entity[column] = value
 
-        if result.key in excluded_pks:
-            return None
+        for col, function, args in self.extra_selects:
+            entity[col] = function(*[entity.get(value) if is_column else value for is_column, value in args])
 
-        return result
+        return entity
 
 
 class SelectCommand(object):
@@ -460,6 +465,67 @@ class SelectCommand(object):
         else:
             return meta_queries.AsyncMultiQuery(queries, ordering)
 
+    def _build_aggregate_query(self, column):
+        """
+            Builds a query which only returns what's needed to aggregate the column. That's a
+            projection on the column where possible, or just the keys for a count.
+        """
+        columns, keys_only = self.query.columns, self.keys_only
+
+        self.query.columns = None
+        self.keys_only = False
+        try:
+            if column == aggregation.KEY_COLUMN:
+                # MultiQuery doesn't support keys_only
+                self.keys_only = not (self.query.where and len(self.query.where.children) > 1)
+            elif self.query.can_project_column(column):
+                self.query.columns = set([column])
+
+            return self._build_query()
+        finally:
+            self.query.columns, self.keys_only = columns, keys_only
+
+    def _fetch_aggregates(self, excluded_pks, limit, offset):
+        """
+            Streams the values of each aggregated column, and returns a row of the
+            aggregate results in the order they were requested.
+
+            Each column is fetched with a single (possibly multi-branch) query, the branches
+            of an OR query are merged and de-duplicated by key before the values are
+            accumulated, so an entity matching several branches is only counted once.
+        """
+        accumulators = []
+        accumulators_by_column = OrderedDict()
+
+        for column, function, source_column, distinct in self.query.aggregates:
+            # Aggregates of the primary key use the ids of the keys
+            sort_key = aggregation.id_sort_value if source_column == aggregation.KEY_COLUMN else None
+            accumulator = aggregation.Accumulator(function, distinct, sort_key=sort_key)
+            accumulators.append(accumulator)
+            accumulators_by_column.setdefault(source_column, []).append(accumulator)
+
+        for column, column_accumulators in accumulators_by_column.items():
+            field = None if column == aggregation.KEY_COLUMN else get_field_from_column(self.query.model, column)
+
+            query = self._build_aggregate_query(column)
+            for entity in query.fetch(limit=limit, offset=offset):
+                if entity is None:
+                    continue
+
+                key = entity if isinstance(entity, Key) else entity.key
+                if key in excluded_pks:
+                    continue
+
+                if field is None:
+                    value = key.id_or_name
+                else:
+                    value = aggregation.prepare_value(field, entity.get(column))
+
+                for accumulator in column_accumulators:
+                    accumulator.add(value)
+
+        return tuple(x.result() for x in accumulators)
+
     def _fetch_results(self, query):
         # If we're manually excluding PKs, and we've specified a limit to the results
         # we need to make sure that we grab more than we were asked for otherwise we could filter
@@ -506,8 +572,10 @@ class SelectCommand(object):
                 self.results = [len(list(query.fetch(limit=limit, offset=offset)))]
                 self.results_returned = 1
             return
-        elif self.query.kind == "AVERAGE":
-            raise ValueError("AVERAGE not yet supported")
+        elif self.query.kind == "AGGREGATE":
+            self.results = [self._fetch_aggregates(excluded_pks, limit, offset)]
+            self.results_returned = 1
+            return
 
         # Ensure that the results returned is reset
         self.results_returned = 0
@@ -531,17 +599,10 @@ class SelectCommand(object):
             seen.add(key)
             return result
 
-        for entity in query.fetch(limit=limit, offset=offset):
-            # If this is a keys only query, we need to generate a fake entity
-            # for each key in the result set
-            if isinstance(entity, Key):
-                entity = EntityTransforms.convert_key_to_entity(entity)
+        transform = EntityTransformer(self.query, excluded_pks)
 
-            entity = EntityTransforms.ignore_excluded_pks(excluded_pks, entity)
-            entity = EntityTransforms.convert_datetime_fields(self.query, entity)
-            entity = EntityTransforms.fix_projected_values_type(self.query, entity)
-            entity = EntityTransforms.rename_pk_field(self.query.model, self.query.concrete_model, entity)
-            entity = EntityTransforms.process_extra_selects(self.query, entity)
+        for entity in query.fetch(limit=limit, offset=offset):
+            entity = transform(entity)
 
             if self.query.distinct and self.query.extra_selects:
                 entity = dedupe(entity)
@@ -553,9 +614,15 @@ class SelectCommand(object):
             if limit and self.results_returned >= (limit - excluded_pk_count):
                 break
 
+        # So that accessing the foreign keys of the results takes a single lookup for each kind
+        dataloader.prime_related(self.query.model, self.results, using=self.connection)
+
     def execute(self):
+        start = time.perf_counter()
         self.gae_query = self._build_query()
         self._fetch_results(self.gae_query)
+        querystats.record_select(self, time.perf_counter() - start)
+
         self.results = iter(self.results)
         return self.results_returned
 
@@ -578,17 +645,18 @@ class FlushCommand(object):
         which are then executed by cursor.execute()
 
         We instead return a list of FlushCommands which are called by
-        our cursor.execute
+        our cursor.execute. A FlushCommand can flush several tables,
+        which are flushed concurrently, or reset the whole emulator.
     """
 
-    def __init__(self, table, connection):
+    def __init__(self, table, connection, reset=False):
         self.connection = connection.alias
-        self.table = table
+        self.tables = [table] if isinstance(table, str) else list(table)
         self.namespace = connection.namespace
+        self.reset = reset
 
-    def execute(self):
-        table = self.table
-        query = transaction._rpc(self.connection).query(kind=table, namespace=self.namespace)
+    def _flush_table(self, rpc, table):
+        query = rpc.query(kind=table, namespace=self.namespace)
         query.keys_only()
 
         # The local datastore emulator explodes if you try to delete more than 500
@@ -597,21 +665,47 @@ class FlushCommand(object):
 
         results = [x.key for x in query.fetch(limit=limit)]
         while results:
-            transaction._rpc(self.connection).delete(results)
+            rpc.delete(results)
             results = [x.key for x in query.fetch(limit=limit)]
 
+    def execute(self):
+        wrapper = connections[self.connection]
 
-def reserve_id(connection, kind, id_or_name, namespace):
-    if not isinstance(id_or_name, int):
-        # Nothing to do if the ID is a string, no-need to reserve that
-        return
+        if self.reset:
+            flushing.reset(wrapper)
+            return
 
-    gclient = connection.connection.gclient
-    gclient.reserve_ids_sequential(gclient.key(kind, id_or_name, namespace=namespace), 1)
+        rpc = transaction._rpc(self.connection)
+        if len(self.tables) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(self.tables), MAX_CONCURRENT_FLUSHES)) as executor:
+                # Calling result() re-raises any exception from the RPCs
+                for future in [executor.submit(self._flush_table, rpc, table) for table in self.tables]:
+                    future.result()
+        else:
+            for table in self.tables:
+                self._flush_table(rpc, table)
+
+        flushing.mark_flushed(wrapper, self.tables)
+
+
+def reserve_ids(connection, keys):
+    """
+        Tells the Datastore about any integer IDs we're specifying
+        intentionally, in a single RPC, so it won't allocate them
+    """
+    # Nothing to do if the ID is a string, no-need to reserve that
+    keys = [x for x in keys if isinstance(x.id_or_name, int)]
+
+    if keys:
+        connection.connection.gclient.reserve_ids_multi(keys)
 
 
 def perform_unique_checks(model, rpc, primary, test_fn):
+    # Queries don't see the writes buffered by a batch, so they're checked separately
+    batch = rpc if isinstance(rpc, transaction.BatchTransaction) else None
+
     combinations = _unique_combinations(model, ignore_pk=True)
+    claimed = []
     for combination in combinations:
         query = rpc.query(kind=primary.kind)
 
@@ -626,10 +720,22 @@ def perform_unique_checks(model, rpc, primary, test_fn):
 
         # only perform the query if there are filters on it
         if len(query.filters):
-            res = list(query.fetch(1))
-            if test_fn(res):
+            if batch:
+                # Anything written or deleted in the batch supersedes what's stored
+                res = [x for x in query.fetch() if not batch.is_buffered(x.key)][:1]
+                unique_values = (primary.kind, tuple(query.filters))
+                conflict = batch.conflicting_key(unique_values, primary.key)
+                claimed.append(unique_values)
+            else:
+                res = list(query.fetch(1))
+                conflict = None
+
+            if conflict or test_fn(res):
                 raise IntegrityError(CONSTRAINT_VIOLATION_MSG.format(model._meta.db_table, ", ".join(combination)))
 
+    if batch:
+        batch.claim_unique_values(primary.key, claimed)
+
 
 class BulkInsertError(IntegrityError, NotSupportedError):
     pass
@@ -701,7 +807,7 @@ class InsertCommand(object):
             for primary, descendents in entities:
                 if primary.key.is_partial:
                     primary.key = primary.key.completed_key(
-                        rpc._generate_id()
+                        rpc._generate_id(primary.key.kind)
                     )
 
                 # thanks to cloud firestore in datastore mode strong consistency
@@ -728,6 +834,8 @@ class InsertCommand(object):
 
         @transaction.atomic()
         def insert_chunk(keys, entities):
+            keys_to_reserve = []
+
             for key in keys:
                 # sanity check the key isn't already taken
                 if check_existence and key is not None:
@@ -739,8 +847,10 @@ class InsertCommand(object):
                     if isinstance(id_or_name, str) and id_or_name.startswith("__"):
                         raise NotSupportedError("Datastore ids cannot start with __. Id was {}".format(id_or_name))
 
-                    # notify App Engine of any keys we're specifying intentionally
-                    reserve_id(self.connection, key.kind, key.id_or_name, self.namespace)
+                    keys_to_reserve.append(key)
+
+            # notify the Datastore of any keys we're specifying intentionally
+            reserve_ids(self.connection, keys_to_reserve)
 
             results = perform_insert(entities)
 
@@ -813,13 +923,36 @@ class DeleteCommand(object):
             500, each entity in the batch has its polymodel fields wiped out
             (if necessary) and then we do either a put() or delete() all inside a transaction.
 
+            If the model isn't part of a polymodel hierarchy then nothing can need wiping,
+            so we skip fetching the entities and delete the keys straight away.
+
             Oh, and we wipe out memcache in an independent transaction.
 
             Things to improve:
 
             - Check the entity matches the query still (there's a fixme there)
         """
-        from .indexing import indexers_for_model
+        from .indexing import cleanup_indexers_for_model
+
+        cleanup_indexers = cleanup_indexers_for_model(self.model)
+
+        def index_keys_to_delete(client, keys):
+            """
+                Returns the keys of any special index entities to delete along
+                with the entities with the given keys
+            """
+            result = []
+
+            # Where the indexer knows the keys of its descendents we delete them with
+            # everything else, otherwise the indexer cleans up after itself
+            for column, indexer in cleanup_indexers:
+                for key in keys:
+                    index_keys = indexer.cleanup_keys(self.model, column, key)
+                    if index_keys is None:
+                        indexer.cleanup(client, key)
+                    else:
+                        result.extend(index_keys)
+            return result
 
         @transaction.atomic()
         def delete_batch(key_slice):
@@ -833,9 +966,7 @@ class DeleteCommand(object):
             entities_to_update = []
             updated_keys = []
 
-            # get() expects Key objects, not just dicts with id keys
-            keys_in_slice = [get_datastore_key(self.connection, self.model, key_id) for key_id in key_slice]
-            entities = transaction._rpc(self.connection.alias).get(keys_in_slice)
+            entities = transaction._rpc(self.connection.alias).get(key_slice)
             for entity in entities:
 
                 # make sure the entity still exists
@@ -857,37 +988,59 @@ class DeleteCommand(object):
 
             client = transaction._rpc(self.connection.alias)
 
-            for entity in entities_to_delete:
-                client.delete(entity.key)
+            keys_to_delete = [entity.key for entity in entities_to_delete]
+            keys_to_delete.extend(index_keys_to_delete(client, keys_to_delete))
+
+            if keys_to_delete:
+                client.delete(keys_to_delete)
 
             for entity in entities_to_update:
                 client.put(entity)
 
-            # Clean up any special indexes that need to be removed
-            for indexer in indexers_for_model(self.model):
-                for entity in entities_to_delete:
-                    indexer.cleanup(client, entity.key)
-
             # Remove any cache keys
             remove_entities_from_cache_by_key(updated_keys, self.namespace)
 
             return len(updated_keys)
 
+        @transaction.atomic()
+        def delete_keys(key_slice):
+            """
+                Deletes the entities (and any special index entities) by key
+                without fetching them first.
+
+                Any memcache references are also removed.
+            """
+            client = transaction._rpc(self.connection.alias)
+            client.delete(key_slice + index_keys_to_delete(client, key_slice))
+
+            # Remove any cache keys
+            remove_entities_from_cache_by_key(key_slice, self.namespace)
+
+            return len(key_slice)
+
         # grab the result of the keys only query (see __init__)
         self.select.execute()
-        key_ids = [x[self.model._meta.pk.name] for x in self.select.results]
+        keys = [x.key for x in self.select.results]
 
         # for now we can only process 500 entities
         # otherwise we need to handle rollback of independent transactions
         # and race conditions between items being deleted and restored...
         max_batch_size = transaction.TRANSACTION_ENTITY_LIMIT
 
-        if len(key_ids) > max_batch_size:
+        if len(keys) > max_batch_size:
             raise BulkDeleteError(
                 "Bulk deletes for {} can only delete {} instances per batch".format(self.model, max_batch_size)
             )
 
-        return delete_batch(key_ids)
+        if not keys:
+            return 0
+
+        if has_concrete_parents(self.model) or has_concrete_children(self.model):
+            # The entities might have polymodel fields which need wiping out rather
+            # than being deleted, so we need to fetch them
+            return delete_batch(keys)
+
+        return delete_keys(keys)
 
     def lower(self):
         """
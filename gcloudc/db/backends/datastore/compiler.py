@@ -4,9 +4,11 @@ from django.db.models.expressions import (
     Value,
 )
 from django.db.models.sql import compiler
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.db.models.sql.query import get_order_dir
 
 # GCLOUDC
+from . import explain
 from .commands import (
     DeleteCommand,
     InsertCommand,
@@ -39,6 +41,38 @@ class SQLCompiler(compiler.SQLCompiler):
         select = SelectCommand(self.connection, self.query)
         return (select, tuple())
 
+    def explain_query(self):
+        """
+            Describes how the query would be run, rather than running it
+        """
+        # Validates the format and options
+        self.connection.ops.explain_query_prefix(self.query.explain_format, **self.query.explain_options)
+
+        try:
+            select, params = self.as_sql()
+        except EmptyResultSet:
+            plan = explain.explain_empty(self.query.model)
+        else:
+            plan = explain.explain_select(select)
+
+        for line in plan.format(self.query.explain_format):
+            yield line
+
+    def get_converters(self, expressions):
+        from gcloudc.db.models.fields.json import JSONField
+
+        converters = super(SQLCompiler, self).get_converters(expressions)
+
+        if self.query.values_select:
+            # Lazy JSONFields are decoded when the attribute is accessed, but values() and
+            # values_list() don't create instances so they need decoding straight away
+            for i, (field_converters, expression) in converters.items():
+                field = getattr(expression, "target", None)
+                if isinstance(field, JSONField) and field.lazy:
+                    field_converters.append(field.decode_raw_value)
+
+        return converters
+
     def get_select(self):
         self.query.select_related = False  # Make sure select_related is disabled for all queries
         return super(SQLCompiler, self).get_select()
@@ -0,0 +1,152 @@
+"""
+    An opt-in, request-scoped loader which coalesces lookups by primary key.
+
+    Inside a dataloader() block the targets of the foreign keys of everything a select
+    returns are queued up automatically, and you can queue up any other instances you're
+    going to need with prime(). The first time an instance of a kind is looked up by key
+    (e.g. by accessing a ForeignKey in a template), everything queued for the kind is fetched
+    with a single get_multi and added to the context cache, so that the lookups which follow
+    are served from the cache. The context cache only holds the entities of models with
+    unique fields, so lookups of other models aren't coalesced.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.db import connections
+
+from gcloudc.context_decorator import ContextDecorator
+
+from . import (
+    caching,
+    transaction,
+)
+from .utils import (
+    get_datastore_key,
+    get_top_concrete_parent,
+)
+
+# Can pass 1000 keys to a datastore.Get
+MAX_KEYS_PER_GET = 1000
+
+_local = threading.local()
+
+
+class DataLoader(object):
+    def __init__(self, using):
+        self.using = using
+
+        # {kind: OrderedDict({key: model})}
+        self.pending = {}
+
+    def prime(self, model, pks):
+        connection = connections[self.using]
+        model = get_top_concrete_parent(model)
+
+        pending = self.pending.setdefault(model._meta.db_table, OrderedDict())
+        for pk in pks:
+            if pk is not None:
+                pending[get_datastore_key(connection, model, pk)] = model
+
+    def prime_related(self, model, results):
+        for field in model._meta.concrete_fields:
+            if field.many_to_one or field.one_to_one:
+                self.prime(field.related_model, [x.get(field.column) for x in results])
+
+    def load_pending(self, kind):
+        """
+            Fetches everything that has been queued for the kind (that isn't
+            already cached) and adds it to the context cache
+        """
+        if transaction.in_atomic_block(self.using):
+            # Nothing read inside a transaction is cached, so leave things queued until afterwards
+            return
+
+        pending = self.pending.pop(kind, None)
+        if not pending:
+            return
+
+        keys = [x for x in pending if caching.get_from_cache_by_key(x) is None]
+        if not keys:
+            return
+
+        model = next(iter(pending.values()))
+        namespace = connections[self.using].namespace
+        client = transaction._rpc(self.using)
+
+        for i in range(0, len(keys), MAX_KEYS_PER_GET):
+            entities = [x for x in client.get(keys[i:i + MAX_KEYS_PER_GET]) if x is not None]
+            if entities:
+                caching.add_entities_to_cache(model, entities, caching.CachingSituation.DATASTORE_GET, namespace)
+
+
+def _loaders():
+    if not hasattr(_local, "loaders"):
+        _local.loaders = []
+    return _local.loaders
+
+
+def active_dataloader(using="default"):
+    """
+        Returns the innermost active DataLoader for the connection, or None
+    """
+    for loader in reversed(_loaders()):
+        if loader.using == using:
+            return loader
+    return None
+
+
+def prime(model, pks, using="default"):
+    """
+        Queues the instances of model with the given pks to be fetched together. Does
+        nothing outside of a dataloader() block.
+    """
+    loader = active_dataloader(using)
+    if loader:
+        loader.prime(model, pks)
+
+
+def prime_related(model, results, using="default"):
+    """
+        Queues the targets of the foreign keys (and one-to-ones) of the entities returned
+        by a select on model. Does nothing outside of a dataloader() block.
+    """
+    loader = active_dataloader(using)
+    if loader and results:
+        loader.prime_related(model, results)
+
+
+def load_pending(kind, using="default"):
+    loader = active_dataloader(using)
+    if loader:
+        loader.load_pending(kind)
+
+
+class DataLoaderDecorator(ContextDecorator):
+    VALID_ARGUMENTS = ("using",)
+
+    @classmethod
+    def _do_enter(cls, state, decorator_args):
+        state.loader = DataLoader(decorator_args.get("using") or "default")
+        _loaders().append(state.loader)
+        return state.loader
+
+    @classmethod
+    def _do_exit(cls, state, decorator_args, exception):
+        _loaders().remove(state.loader)
+
+
+dataloader = DataLoaderDecorator
+
+
+class DataLoaderMiddleware(object):
+    """
+        Enables a dataloader for the default connection for the duration of each request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with dataloader():
+            return self.get_response(request)
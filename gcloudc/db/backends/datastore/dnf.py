@@ -1,5 +1,4 @@
 import copy
-from functools import cmp_to_key
 from itertools import product
 
 from django.conf import settings
@@ -8,7 +7,7 @@ from django.db.models.sql.datastructures import EmptyResultSet
 from google.cloud.datastore.key import Key
 
 from .query import WhereNode
-from .query_utils import compare_keys
+from .query_utils import key_sort_value
 
 # Maximum number of subqueries in a multiquery
 DEFAULT_MAX_ALLOWABLE_QUERIES = 100
@@ -128,15 +127,17 @@ def normalize_query(query):
         preprocess_node(where, negated)
 
         rewalk = False
+
+        # Build the new children in a single pass, removing promoted children one at a time
+        # is quadratic (and comparing nodes is expensive) for large pk__in filters
+        children = []
         for child in where.children:
             if where.connector == "AND" and child.children and child.connector == "AND" and not child.negated:
-                where.children.remove(child)
-                where.children.extend(child.children)
+                children.extend(child.children)
                 rewalk = True
             elif child.connector == "AND" and len(child.children) == 1 and not child.negated:
                 # Promote leaf nodes if they are the only child under an AND. Just for consistency
-                where.children.remove(child)
-                where.children.extend(child.children)
+                children.extend(child.children)
                 rewalk = True
             elif len(child.children) > 1 and child.connector == "AND" and child.negated:
                 new_grandchildren = []
@@ -147,9 +148,13 @@ def normalize_query(query):
                     new_grandchildren.append(new_node)
                 child.children = new_grandchildren
                 child.connector = "OR"
+                children.append(child)
                 rewalk = True
             else:
                 walk_tree(child, negated)
+                children.append(child)
+
+        where.children = children
 
         if rewalk:
             walk_tree(where, original_negated)
@@ -289,7 +294,7 @@ def normalize_query(query):
 
                     cmp_kwargs = {}
                     if isinstance(seen[key].value, Key) or isinstance(node.value, Key):
-                        cmp_kwargs["key"] = cmp_to_key(compare_keys)
+                        cmp_kwargs["key"] = key_sort_value
 
                     if node.operator in ('<', '<='):
                         seen[key].value = min(seen[key].value, node.value, **cmp_kwargs)
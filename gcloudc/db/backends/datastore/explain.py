@@ -0,0 +1,205 @@
+"""
+    Explains how a select will be run, without running it. This is what
+    QuerySet.explain() returns, e.g.
+
+        print(MyModel.objects.filter(name__in=["A", "B"]).explain())
+
+    The plan has the meta-query chosen to run it, the branches of the normalized
+    (DNF) where and their filters, the special indexes they rely on, the work
+    done in memory after fetching, and an estimate of the RPCs needed. The
+    estimate assumes an empty context cache, and counts a single RPC for each
+    query even though large result sets are fetched in several batches.
+"""
+
+import json
+import math
+
+from . import meta_queries
+from .formatting import (
+    _quote_string,
+    generate_sql_representation,
+)
+
+# The columns which indexers (see indexing.py) store their values in
+SPECIAL_INDEX_PREFIXES = ("_idx_", "_djangae_idx_")
+
+# The number of keys which QueryByKeys looks up in a single RPC
+MAX_KEYS_PER_LOOKUP = 1000
+
+PLAIN_QUERY = "Query"
+
+
+class QueryPlan(object):
+    def __init__(self, table, path, sql=None):
+        self.table = table
+        self.path = path  # The meta-query, or PLAIN_QUERY for a single datastore query
+        self.sql = sql
+        self.kind = "SELECT"
+        self.branches = []  # A list of filter lists, one for each branch of the where
+        self.ordering = []
+        self.projection = []
+        self.keys_only = False
+        self.excluded_pks = 0
+        self.in_memory = []  # Descriptions of the steps done after fetching
+        self.estimated_rpcs = 0
+
+    @property
+    def special_indexes(self):
+        return sorted(set(
+            column for branch in self.branches for column, operator, value in branch
+            if column.startswith(SPECIAL_INDEX_PREFIXES)
+        ))
+
+    @property
+    def full_scan(self):
+        """
+            True if the query has no filters, so reads every entity of the kind
+            (up to its limit)
+        """
+        return self.path == PLAIN_QUERY and not self.branches
+
+    def as_dict(self):
+        return {
+            "table": self.table,
+            "kind": self.kind,
+            "path": self.path,
+            "sql": self.sql,
+            "branches": [
+                ["{} {} {}".format(column, operator, _quote_string(value)) for column, operator, value in branch]
+                for branch in self.branches
+            ],
+            "special_indexes": self.special_indexes,
+            "ordering": self.ordering,
+            "projection": self.projection,
+            "keys_only": self.keys_only,
+            "excluded_pks": self.excluded_pks,
+            "in_memory": self.in_memory,
+            "full_scan": self.full_scan,
+            "estimated_rpcs": self.estimated_rpcs,
+        }
+
+    def format(self, format=None):
+        """
+            Returns the plan as a list of lines, format can be "text" (the default) or "json"
+        """
+        plan = self.as_dict()
+        if format and format.upper() == "JSON":
+            return [json.dumps(plan, indent=2)]
+
+        lines = [
+            "{} on {} using {}".format(plan["kind"], plan["table"], plan["path"]),
+        ]
+        if plan["sql"]:
+            lines.append("  SQL: {}".format(plan["sql"]))
+
+        lines.append("  Branches: {}".format(len(plan["branches"])))
+        for i, branch in enumerate(plan["branches"]):
+            lines.append("    {}: {}".format(i + 1, " AND ".join(branch) or "(no filters)"))
+
+        for name in ("special_indexes", "ordering", "projection"):
+            if plan[name]:
+                lines.append("  {}: {}".format(name.replace("_", " ").capitalize(), ", ".join(plan[name])))
+
+        if plan["keys_only"]:
+            lines.append("  Keys only")
+        if plan["full_scan"]:
+            lines.append("  Full scan of {}".format(plan["table"]))
+        if plan["excluded_pks"]:
+            lines.append("  Excluded keys: {}".format(plan["excluded_pks"]))
+
+        for step in plan["in_memory"]:
+            lines.append("  In memory: {}".format(step))
+
+        lines.append("  Estimated RPCs: {}".format(plan["estimated_rpcs"]))
+        return lines
+
+
+def _branches(query):
+    if query.where is None:
+        return []
+
+    branches = []
+    for and_branch in query.where.children:
+        filters = [and_branch] if and_branch.is_leaf else and_branch.children
+        branches.append([(x.column, x.operator, x.value) for x in filters])
+    return branches
+
+
+def _has_filters_besides_key(branches):
+    return any(column != "__key__" for branch in branches for column, operator, value in branch)
+
+
+def _estimate_query_by_keys(plan, gae_query):
+    if plan.projection and gae_query.can_multi_query:
+        # Each key becomes an ancestor query
+        plan.estimated_rpcs = gae_query.query_count
+        if gae_query.query_count > 1:
+            plan.in_memory.append("merge {} ancestor queries by ordering".format(gae_query.query_count))
+        return
+
+    plan.estimated_rpcs = int(math.ceil(len(gae_query.queries_by_key) / float(MAX_KEYS_PER_LOOKUP)))
+    if _has_filters_besides_key(plan.branches):
+        plan.in_memory.append("apply the filters besides __key__ to the looked up entities")
+
+
+def explain_select(command):
+    """
+        Returns the QueryPlan for a SelectCommand
+    """
+    query = command.query
+    gae_query = command._build_query()
+
+    if isinstance(gae_query, (meta_queries.QueryByKeys, meta_queries.UniqueQuery, meta_queries.AsyncMultiQuery)):
+        path = type(gae_query).__name__
+    else:
+        path = PLAIN_QUERY
+
+    plan = QueryPlan(query.model._meta.db_table, path, str(generate_sql_representation(command)))
+    plan.kind = query.kind
+    plan.branches = _branches(query)
+    plan.ordering = list(query.order_by or [])
+    plan.projection = command._exclude_pk(query.columns) or []
+    plan.keys_only = command.keys_only
+    plan.excluded_pks = len(query.excluded_pks)
+
+    has_offset = bool(query.low_mark)
+
+    if path == "QueryByKeys":
+        _estimate_query_by_keys(plan, gae_query)
+        if plan.ordering:
+            plan.in_memory.append("sort by {}".format(", ".join(plan.ordering)))
+        if has_offset:
+            plan.in_memory.append("skip the offset")
+    elif path == "AsyncMultiQuery":
+        plan.estimated_rpcs = len(gae_query._queries)
+        plan.in_memory.append("merge {} branches by ordering and remove duplicates".format(len(gae_query._queries)))
+        if has_offset:
+            plan.in_memory.append("skip the offset (each branch fetches offset + limit results)")
+    else:
+        # A plain query, or a UniqueQuery which runs one if the context cache misses
+        plan.estimated_rpcs = 1
+
+    if query.excluded_pks:
+        if plan.kind == "COUNT":
+            plan.in_memory.append("count the keys which aren't excluded")
+        else:
+            plan.in_memory.append(
+                "remove {} excluded keys (the limit is raised to allow for them)".format(len(query.excluded_pks))
+            )
+
+    if plan.kind == "AGGREGATE":
+        plan.in_memory.append("aggregate the fetched values")
+
+    if query.extra_selects:
+        plan.in_memory.append("compute the extra selects")
+        if query.distinct:
+            plan.in_memory.append("remove duplicates")
+
+    return plan
+
+
+def explain_empty(model):
+    """
+        Returns the QueryPlan for a select which can't match anything, so isn't run
+    """
+    return QueryPlan(model._meta.db_table, "NoOpQuery")
@@ -0,0 +1,105 @@
+"""
+    Django flushes the database after every TransactionTestCase (which is every
+    test, as the Datastore can't roll back), and flushing a kind means querying
+    for its keys and deleting them, even if the test never touched it.
+
+    So we keep track of which kinds might contain entities in each namespace,
+    starting from the kinds which exist when it's first flushed, and then adding
+    the kinds that are written to. Later flushes only need to touch those.
+"""
+
+import os
+import threading
+
+import requests
+from django.conf import settings
+from google.cloud import environment_vars
+
+from . import memory
+
+# Set this to False if something other than the backend in this process writes
+# to the Datastore you're flushing (e.g. a server under test)
+FLUSH_WRITTEN_KINDS_ONLY = getattr(settings, "GCLOUDC_FLUSH_WRITTEN_KINDS_ONLY", True)
+
+# Resetting the emulator (or in-memory Datastore) is a single call, but it wipes
+# every namespace in the project, not just the database being flushed
+FLUSH_WITH_RESET = getattr(settings, "GCLOUDC_FLUSH_WITH_RESET", False)
+
+# Maps (project, namespace) to the kinds which might contain entities. A namespace
+# isn't in here until it's been flushed, as until then we don't know what it contains.
+_written_kinds = {}
+_written_kinds_lock = threading.Lock()
+
+
+def _tracking_key(connection):
+    return (connection.settings_dict.get("PROJECT"), connection.namespace or None)
+
+
+def mark_written(connection, kinds):
+    """
+        Records that entities of the kinds have been written, connection
+        can be a DatabaseWrapper or its underlying connection
+    """
+    with _written_kinds_lock:
+        written = _written_kinds.get(_tracking_key(connection))
+        if written is not None:
+            written.update(kinds)
+
+
+def written_kinds(connection):
+    """
+        Returns the kinds which might contain entities, or None if we don't know
+        because the namespace hasn't been flushed before
+    """
+    if not FLUSH_WRITTEN_KINDS_ONLY:
+        return None
+
+    with _written_kinds_lock:
+        written = _written_kinds.get(_tracking_key(connection))
+        return None if written is None else set(written)
+
+
+def start_tracking(connection, existing_kinds):
+    """
+        Called by a flush which doesn't know what the namespace contains, with
+        the kinds that it found. This happens before the kinds are flushed, so
+        nothing written in the meantime is missed.
+    """
+    with _written_kinds_lock:
+        _written_kinds.setdefault(_tracking_key(connection), set()).update(existing_kinds)
+
+
+def mark_flushed(connection, kinds):
+    with _written_kinds_lock:
+        written = _written_kinds.get(_tracking_key(connection))
+        if written is not None:
+            written.difference_update(kinds)
+
+
+def can_reset(connection):
+    if not FLUSH_WITH_RESET:
+        return False
+
+    return bool(connection.settings_dict.get("IN_MEMORY") or os.environ.get(environment_vars.GCD_HOST))
+
+
+def reset(connection):
+    """
+        Wipes the emulator (or in-memory Datastore), which empties every namespace
+        in the project
+    """
+    project = connection.settings_dict.get("PROJECT")
+
+    if connection.settings_dict.get("IN_MEMORY"):
+        memory.reset(project)
+    else:
+        response = requests.post("http://{}/reset".format(os.environ[environment_vars.GCD_HOST]))
+        response.raise_for_status()
+
+    with _written_kinds_lock:
+        for key, written in _written_kinds.items():
+            if key[0] == project:
+                written.clear()
+
+        # We know this namespace is empty now, even if it hasn't been flushed before
+        _written_kinds.setdefault(_tracking_key(connection), set())
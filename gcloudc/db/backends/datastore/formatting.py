@@ -104,6 +104,12 @@ def _generate_select_sql(command, representation):
         else ", ".join(sorted(representation["columns"]))  # Just to make the output predictable
     )
 
+    if representation.get("aggregates"):
+        columns = ", ".join([
+            "%s(%s%s) AS %s" % (function, "DISTINCT " if distinct else "", source_column, column)
+            for column, function, source_column, distinct in representation["aggregates"]
+        ])
+
     ordering = [
         ("%s %s" % (x.lstrip("-"), "DESC" if x.startswith("-") else "")).strip() for x in representation["order_by"]
     ]
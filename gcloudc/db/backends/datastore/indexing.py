@@ -4,6 +4,7 @@ import logging
 import os
 import re
 import sys
+from collections import OrderedDict
 from itertools import chain
 
 import django
@@ -11,14 +12,21 @@ import yaml
 from django.apps import apps
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import (
+    NotSupportedError,
+    models,
+)
 from django.utils import six
 from google.cloud.datastore.entity import Entity
+from google.cloud.datastore.key import Key
 
 from gcloudc.core.validators import MaxBytesValidator
 
 from . import transaction
-from .utils import get_top_concrete_parent
+from .utils import (
+    clear_entity_serializers,
+    get_top_concrete_parent,
+)
 
 logger = logging.getLogger(__name__)
 _project_special_indexes = {}
@@ -31,6 +39,10 @@ MAX_COLUMNS_PER_SPECIAL_INDEX = getattr(settings, "DJANGAE_MAX_COLUMNS_PER_SPECI
 CHARACTERS_PER_COLUMN = [31, 44, 54, 63, 71, 79, 85, 91, 97, 103]
 STRIP_PERCENTS = django.VERSION < (1, 10)
 
+# The most instances a trigram __contains lookup can match. The matches become a
+# __key__ IN filter on the parent query, so this bounds the memory and lookups needed
+TRIGRAM_CONTAINS_MAX_RESULTS = getattr(settings, "DJANGAE_TRIGRAM_CONTAINS_MAX_RESULTS", 1000)
+
 
 def _get_project_index_file(connection):
     project_index_file = os.path.join(connection.settings_dict["INDEXES_FILE"])
@@ -120,6 +132,8 @@ def load_special_indexes(connection):
             # Mark this file for reloading, store the current modified time
             files_to_reload[file_path] = mtime
 
+    reloading = bool(files_to_reload)
+
     # First, reload the project index file,
     if project_index_file in files_to_reload:
         mtime = files_to_reload[project_index_file]
@@ -140,6 +154,10 @@ def load_special_indexes(connection):
             for field_name, values in indexes.items():
                 _app_special_indexes.setdefault(model, {}).setdefault(field_name, []).extend(values)
 
+    if reloading:
+        # Any cached serializers may have the wrong indexers now
+        clear_entity_serializers()
+
     _indexes_loaded = True
     logger.debug("Loaded special indexes for %d models", len(_merged_indexes()))
 
@@ -212,6 +230,7 @@ def add_special_index(connection, model_class, field_name, indexer, operator, va
     _project_special_indexes.setdefault(_get_table_from_model(model_class), {}).setdefault(field_name, []).append(
         str(index_type)
     )
+    clear_entity_serializers()
 
     write_special_indexes(connection)
 
@@ -255,6 +274,16 @@ class Indexer(object):
         """
         pass
 
+    def cleanup_keys(self, model, column, datastore_key):
+        """
+            Returns the keys of the descendent entities to delete along with
+            the instance with the given key. These are deleted in the same batch as
+            the instance, so no queries are necessary.
+
+            Return None (the default) to have cleanup() called instead.
+        """
+        return None
+
     def handles(self, field, operator):
         """
             When given a field instance and an operator (e.g. gt, month__gt etc.)
@@ -270,6 +299,18 @@ class Indexer(object):
     def prep_value_for_database(self, value, index, **kwargs):
         raise NotImplementedError()
 
+    def prep_values_for_database(self, value, indexes, **kwargs):
+        """
+            Prepares the value of a field for all of its indexes which use this indexer,
+            yielding (index, values, unindex) for each. Override this if the indexes can
+            share work, e.g. decoding the value once rather than once per index.
+        """
+        for index in indexes:
+            try:
+                yield index, self.prep_value_for_database(value, index, **kwargs), False
+            except IgnoreForIndexing as e:
+                yield index, e.processed_value, True
+
     def prep_value_for_query(self, value, **kwargs):
         raise NotImplementedError()
 
@@ -584,6 +625,10 @@ class ContainsIndexer(StringIndexerMixin, Indexer):
     def _generate_kind_name(self, model, column):
         return "_djangae_idx_{}_{}".format(get_top_concrete_parent(model)._meta.db_table, column)
 
+    def cleanup_keys(self, model, column, datastore_key):
+        # The index entity is always a child of the instance, with a key name of OPERATOR
+        return [Key(self._generate_kind_name(model, column), self.OPERATOR, parent=datastore_key)]
+
     def _generate_permutations(self, value):
         return [value[i:] for i in range(len(value))]
 
@@ -619,12 +664,7 @@ class ContainsIndexer(StringIndexerMixin, Indexer):
         # prep_value_for_query returns a list PKs, so we return __key__ as the column
         return "__key__"
 
-    def prep_value_for_query(self, value, model, column, connection):
-        """
-            Return a list of IDs of the associated contains models, these should
-            match up with the IDs from the parent entities
-        """
-
+    def _prep_query_term(self, value):
         if hasattr(value, "isoformat"):
             value = value.isoformat()
         else:
@@ -636,6 +676,16 @@ class ContainsIndexer(StringIndexerMixin, Indexer):
             if value.startswith("%") and value.endswith("%"):
                 value = value[1:-1]
 
+        return value
+
+    def prep_value_for_query(self, value, model, column, connection):
+        """
+            Return a list of IDs of the associated contains models, these should
+            match up with the IDs from the parent entities
+        """
+
+        value = self._prep_query_term(value)
+
         namespace = connection.namespace
 
         qry = transaction._rpc(using=connection.alias).query(
@@ -664,6 +714,123 @@ class IContainsIndexer(ContainsIndexer):
         return super(IContainsIndexer, self).prep_value_for_query(value.lower(), model, column, connection)
 
 
+class TrigramContainsIndexer(ContainsIndexer):
+    """
+        An alternative to ContainsIndexer which stores the distinct substrings of up
+        to NGRAM_LENGTH characters (n-grams) of the value, rather than every suffix. The
+        size of the index grows linearly with the length of the value instead of
+        quadratically.
+
+        Queries filter on the n-grams of the search term (which Datastore intersects
+        for us) and each candidate is then checked against the original value, which is
+        stored unindexed on the index entity. Enable this with the
+        DJANGAE_USE_TRIGRAM_CONTAINS_LOGIC setting; existing instances must be re-saved
+        after switching indexers.
+
+        The matching instances are filtered on by key, so they can't be streamed into
+        the parent query. Instead a lookup which matches more than
+        DJANGAE_TRIGRAM_CONTAINS_MAX_RESULTS instances raises NotSupportedError.
+    """
+
+    NGRAM_LENGTH = 3
+
+    # Candidates are verified anyway, so we don't need to filter on every n-gram of a long term
+    MAX_QUERY_NGRAMS = 8
+
+    INDEXED_COLUMN_NAME = "ngrams"
+    VALUES_COLUMN_NAME = "values"
+
+    def _generate_kind_name(self, model, column):
+        return "{}_ngrams".format(super(TrigramContainsIndexer, self)._generate_kind_name(model, column))
+
+    def _prep_value(self, value):
+        return value
+
+    def _generate_ngrams(self, value):
+        ngrams = []
+        for length in range(1, self.NGRAM_LENGTH + 1):
+            ngrams.extend(value[i: i + length] for i in range(len(value) - length + 1))
+        return ngrams
+
+    def _query_ngrams(self, term):
+        if len(term) <= self.NGRAM_LENGTH:
+            return [term] if term else []
+
+        # De-duplicate, keeping the order
+        ngrams = list(OrderedDict.fromkeys(
+            term[i: i + self.NGRAM_LENGTH] for i in range(len(term) - self.NGRAM_LENGTH + 1)
+        ))
+
+        if len(ngrams) > self.MAX_QUERY_NGRAMS:
+            # Spread the filters across the whole term
+            ngrams = [ngrams[(i * len(ngrams)) // self.MAX_QUERY_NGRAMS] for i in range(self.MAX_QUERY_NGRAMS)]
+
+        return ngrams
+
+    def prep_value_for_database(self, value, index, model, column, connection):
+        if value is None:
+            raise IgnoreForIndexing([])
+
+        # If this a date or a datetime, or something that supports isoformat, then use that
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+
+        values = [self._prep_value(v) for v in (value if _is_iterable(value) else [value])]
+        ngrams = list(set(chain(*[self._generate_ngrams(v) for v in values])))
+
+        if not ngrams:
+            raise IgnoreForIndexing([])
+
+        key = transaction._rpc(using=connection.alias).key(
+            self._generate_kind_name(model, column), self.OPERATOR
+        )
+        entity = Entity(key, exclude_from_indexes=(self.VALUES_COLUMN_NAME,))
+        entity[self.INDEXED_COLUMN_NAME] = ngrams
+        entity[self.VALUES_COLUMN_NAME] = values
+        return [entity]
+
+    def prep_value_for_query(self, value, model, column, connection):
+        """
+            Return the keys of the parent entities which contain the value
+        """
+        term = self._prep_value(self._prep_query_term(value))
+
+        qry = transaction._rpc(using=connection.alias).query(
+            kind=self._generate_kind_name(model, column), namespace=connection.namespace
+        )
+
+        for ngram in self._query_ngrams(term):
+            qry.add_filter(self.INDEXED_COLUMN_NAME, "=", ngram)
+
+        # The candidates are checked as each page of results comes back, so we never
+        # hold onto more than a page of index entities, plus the (capped) matches
+        resulting_keys = []
+        for entity in qry.fetch():
+            if entity.key.name != self.OPERATOR:
+                continue
+
+            if any(term in x for x in entity.get(self.VALUES_COLUMN_NAME, [])):
+                if len(resulting_keys) == TRIGRAM_CONTAINS_MAX_RESULTS:
+                    raise NotSupportedError(
+                        "{}__{} matched more than {} instances. Narrow the query, or raise "
+                        "DJANGAE_TRIGRAM_CONTAINS_MAX_RESULTS".format(
+                            column, self.OPERATOR, TRIGRAM_CONTAINS_MAX_RESULTS
+                        )
+                    )
+
+                # Each instance has a single index entity per column, so there are no duplicates
+                resulting_keys.append(entity.key.parent)
+
+        return resulting_keys
+
+
+class TrigramIContainsIndexer(TrigramContainsIndexer):
+    OPERATOR = "icontains"
+
+    def _prep_value(self, value):
+        return value.lower()
+
+
 class LegacyContainsIndexer(StringIndexerMixin, Indexer):
     OPERATOR = "contains"
 
@@ -1004,11 +1171,35 @@ def indexers_for_model(model_class):
     return set(indexers)
 
 
+def cleanup_indexers_for_model(model_class):
+    """
+        Returns a list of (column, indexer) for the special indexes of the
+        model which need cleaning up when an instance is deleted
+    """
+    indexes = special_indexes_for_model(model_class)
+
+    def needs_cleanup(indexer):
+        indexer_class = type(indexer)
+        cleanup = getattr(indexer_class.cleanup, "__func__", indexer_class.cleanup)
+        return indexer_class.cleanup_keys is not Indexer.cleanup_keys or cleanup is not Indexer.cleanup.__func__
+
+    result = []
+    for field in model_class._meta.fields:
+        for operator in indexes.get(field.column, []):
+            indexer = get_indexer(field, operator)
+            if indexer and needs_cleanup(indexer):
+                result.append((field.column, indexer))
+    return result
+
+
 register_indexer(IExactIndexer)
 
 if getattr(settings, "DJANGAE_USE_LEGACY_CONTAINS_LOGIC", False):
     register_indexer(LegacyContainsIndexer)
     register_indexer(LegacyIContainsIndexer)
+elif getattr(settings, "DJANGAE_USE_TRIGRAM_CONTAINS_LOGIC", False):
+    register_indexer(TrigramContainsIndexer)
+    register_indexer(TrigramIContainsIndexer)
 else:
     register_indexer(ContainsIndexer)
     register_indexer(IContainsIndexer)
@@ -0,0 +1,298 @@
+"""
+    Instrumentation of every RPC made to the Datastore.
+
+    Each connection's client is instrumented below the google client API, so
+    every lookup, query page, commit, transaction and ID allocation is seen,
+    however the backend (or your code) made it. Listeners are told before and
+    after each RPC with an RPCEvent describing it.
+
+    Listeners can be added with add_listener(), or with the GCLOUDC_RPC_LISTENERS
+    setting (a list of dotted paths to listener classes, which are instantiated
+    with no arguments). LoggingListener, SignalListener and TracerListener
+    cover logging, Django signals and OpenTelemetry-style tracers.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+RPC_LISTENERS = getattr(settings, "GCLOUDC_RPC_LISTENERS", [])
+
+# Sent with the RPCEvent (as event=) by SignalListener
+rpc_started = Signal()
+rpc_finished = Signal()
+
+_listeners = None
+_listeners_lock = threading.Lock()
+
+
+class RPCEvent(object):
+    """
+        Describes a single RPC. The kinds and counts are known before the RPC
+        is made, the results, sizes, duration and exception afterwards.
+
+        The sizes are the serialized size of the request and response payloads
+        in bytes, or None when that isn't known (e.g. the in-memory Datastore).
+    """
+
+    def __init__(self, using, operation, kinds=(), count=0, request_size=None):
+        self.using = using
+        self.operation = operation  # e.g. "lookup", "run_query", "commit"
+        self.kinds = tuple(sorted(set(x for x in kinds if x)))
+        self.count = count  # The number of keys looked up, or mutations committed
+        self.request_size = request_size
+
+        self.results = 0  # The number of entities returned
+        self.response_size = None
+        self.start = time.time()
+        self.duration = None
+        self.exception = None
+
+        # Somewhere for listeners to keep state between before_rpc and after_rpc
+        self.data = {}
+
+    @property
+    def kind(self):
+        return ", ".join(self.kinds)
+
+    @property
+    def entities_read(self):
+        return self.results
+
+    @property
+    def entities_written(self):
+        return self.count if self.operation == "commit" else 0
+
+    def as_dict(self):
+        return {
+            "using": self.using,
+            "operation": self.operation,
+            "kinds": list(self.kinds),
+            "count": self.count,
+            "results": self.results,
+            "request_size": self.request_size,
+            "response_size": self.response_size,
+            "duration": self.duration,
+            "error": repr(self.exception) if self.exception else None,
+        }
+
+
+class RPCListener(object):
+    def before_rpc(self, event):
+        pass
+
+    def after_rpc(self, event):
+        pass
+
+
+class LoggingListener(RPCListener):
+    def __init__(self, logger_name="gcloudc.rpc", level=logging.DEBUG):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def after_rpc(self, event):
+        self.logger.log(
+            self.level,
+            "Datastore %s on %s (%s keys/mutations, %s results) took %.1fms",
+            event.operation, event.kind or "-", event.count, event.results, event.duration * 1000,
+            extra={"rpc": event.as_dict()},
+        )
+
+
+class SignalListener(RPCListener):
+    def before_rpc(self, event):
+        rpc_started.send(sender=RPCEvent, event=event)
+
+    def after_rpc(self, event):
+        rpc_finished.send(sender=RPCEvent, event=event)
+
+
+class TracerListener(RPCListener):
+    """
+        Creates a span for each RPC with a tracer which has the OpenTelemetry
+        start_span() API. The tracer is taken from the GCLOUDC_RPC_TRACER
+        setting (a dotted path) if it isn't passed in.
+    """
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            tracer = import_string(settings.GCLOUDC_RPC_TRACER)
+        self.tracer = tracer
+
+    def before_rpc(self, event):
+        event.data[self] = self.tracer.start_span("datastore.{}".format(event.operation))
+
+    def after_rpc(self, event):
+        span = event.data.pop(self)
+        for key, value in event.as_dict().items():
+            if value is not None:
+                span.set_attribute("datastore.{}".format(key), str(value) if isinstance(value, list) else value)
+        span.end()
+
+
+def get_listeners():
+    global _listeners
+
+    if _listeners is None:
+        with _listeners_lock:
+            if _listeners is None:
+                _listeners = [import_string(x)() for x in RPC_LISTENERS]
+    return _listeners
+
+
+def add_listener(listener):
+    global _listeners
+
+    # The list is replaced rather than changed, so RPCs in progress
+    # keep the listeners they started with
+    listeners = get_listeners()
+    with _listeners_lock:
+        _listeners = listeners + [listener]
+
+
+def remove_listener(listener):
+    global _listeners
+
+    listeners = get_listeners()
+    with _listeners_lock:
+        _listeners = [x for x in listeners if x is not listener]
+
+
+def _notify(listeners, method, event):
+    for listener in listeners:
+        try:
+            getattr(listener, method)(event)
+        except Exception:
+            # A broken listener mustn't break the RPC
+            logger.exception("Error in Datastore RPC listener %r", listener)
+
+
+class Instrumentation(object):
+    """
+        Instruments the RPCs of a single client. RPCs are recorded in the
+        connection's query log, if it has one, and in the stats being collected
+        for the thread which owns the connection, and passed to the listeners.
+    """
+
+    def __init__(self, using=None, query_log=None):
+        self.using = using
+        self.query_log = query_log
+
+        # Connections are per-thread, so this is the thread the RPCs are made for
+        self.thread_ident = threading.get_ident()
+
+    @contextmanager
+    def rpc(self, operation, kinds=(), count=0, request_size=None):
+        event = RPCEvent(self.using, operation, kinds, count, request_size)
+        listeners = get_listeners()
+
+        _notify(listeners, "before_rpc", event)
+        start = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event.exception = e
+            raise
+        finally:
+            event.duration = time.perf_counter() - start
+
+            if self.query_log is not None:
+                self.query_log.record(entities_read=event.entities_read, entities_written=event.entities_written)
+
+            stats.record_rpc(self.thread_ident, event)
+            _notify(listeners, "after_rpc", event)
+
+
+def _key_kind(key_pb):
+    return key_pb.path[-1].kind if key_pb.path else None
+
+
+def _mutation_kind(mutation_pb):
+    operation = mutation_pb.WhichOneof("operation")
+    if operation == "delete":
+        return _key_kind(mutation_pb.delete)
+    return _key_kind(getattr(mutation_pb, operation).key)
+
+
+def _size(pbs):
+    return sum(x.ByteSize() for x in pbs)
+
+
+class InstrumentedDatastoreAPI(object):
+    """
+        Wraps the API object that the google client makes its RPCs with
+        (client._datastore_api). The arguments are protobufs.
+    """
+
+    def __init__(self, api, instrumentation):
+        self._api = api
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    def lookup(self, project_id, keys, *args, **kwargs):
+        keys = list(keys)
+        with self._instrumentation.rpc("lookup", [_key_kind(x) for x in keys], len(keys), _size(keys)) as event:
+            response = self._api.lookup(project_id, keys, *args, **kwargs)
+            event.results = len(response.found)
+            event.response_size = response.ByteSize()
+            return response
+
+    def run_query(self, project_id, partition_id, *args, **kwargs):
+        query = kwargs.get("query") or (args[1] if len(args) > 1 else None)
+        kinds = [x.name for x in query.kind] if query is not None else []
+        size = query.ByteSize() if query is not None else None
+
+        with self._instrumentation.rpc("run_query", kinds, 1, size) as event:
+            response = self._api.run_query(project_id, partition_id, *args, **kwargs)
+            event.results = len(response.batch.entity_results)
+            event.response_size = response.ByteSize()
+            return response
+
+    def commit(self, project_id, mode, mutations, *args, **kwargs):
+        mutations = list(mutations)
+        with self._instrumentation.rpc(
+            "commit", [_mutation_kind(x) for x in mutations], len(mutations), _size(mutations)
+        ) as event:
+            response = self._api.commit(project_id, mode, mutations, *args, **kwargs)
+            event.response_size = response.ByteSize()
+            return response
+
+    def begin_transaction(self, project_id, *args, **kwargs):
+        with self._instrumentation.rpc("begin_transaction"):
+            return self._api.begin_transaction(project_id, *args, **kwargs)
+
+    def rollback(self, project_id, *args, **kwargs):
+        with self._instrumentation.rpc("rollback"):
+            return self._api.rollback(project_id, *args, **kwargs)
+
+    def allocate_ids(self, project_id, keys, *args, **kwargs):
+        keys = list(keys)
+        with self._instrumentation.rpc("allocate_ids", [_key_kind(x) for x in keys], len(keys), _size(keys)):
+            return self._api.allocate_ids(project_id, keys, *args, **kwargs)
+
+    def reserve_ids(self, project_id, keys, *args, **kwargs):
+        keys = list(keys)
+        with self._instrumentation.rpc("reserve_ids", [_key_kind(x) for x in keys], len(keys), _size(keys)):
+            return self._api.reserve_ids(project_id, keys, *args, **kwargs)
+
+
+def instrument_client(client, instrumentation):
+    """
+        Instruments a google (or in-memory) Datastore client
+    """
+    if hasattr(client, "instrumentation"):
+        # The in-memory client instruments itself
+        client.instrumentation = instrumentation
+    else:
+        client._datastore_api_internal = InstrumentedDatastoreAPI(client._datastore_api, instrumentation)
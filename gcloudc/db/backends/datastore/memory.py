@@ -0,0 +1,651 @@
+"""
+    A pure-Python, in-process stand in for the parts of google.cloud.datastore.Client
+    which the backend uses. It lets the test suite and benchmarks run without the
+    Cloud Datastore Emulator (and the JVM that comes with it).
+
+    Enable it by setting "IN_MEMORY": True in the DATABASES entry:
+
+        DATABASES = {
+            "default": {
+                "ENGINE": "gcloudc.db.backends.datastore",
+                "PROJECT": "test",
+                "IN_MEMORY": True,
+            }
+        }
+
+    Data is shared by every Client with the same project for the lifetime of the
+    process (Django creates one connection per thread) and can be cleared with
+    reset(). Queries behave like the emulator running with --consistency=1.0 but
+    indexes aren't required, and transactions never fail with contention.
+"""
+
+import base64
+import copy
+import datetime
+import itertools
+import threading
+
+from google.cloud.datastore.batch import Batch as DatastoreBatch
+from google.cloud.datastore.entity import Entity
+from google.cloud.datastore.helpers import GeoPoint
+from google.cloud.datastore.key import Key
+from google.cloud.datastore.query import Query as DatastoreQuery
+from google.cloud.datastore.transaction import Transaction as DatastoreTransaction
+
+from .instrumentation import Instrumentation
+
+# Allocated IDs start high so that they don't collide with explicit
+# IDs in tests (the real Datastore scatters allocated IDs)
+FIRST_ALLOCATED_ID = 1 << 32
+
+_CURSOR_PREFIX = b"memory:"
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(project):
+    with _stores_lock:
+        if project not in _stores:
+            _stores[project] = Store()
+        return _stores[project]
+
+
+def reset(project=None):
+    """
+        Removes all the entities for the given project, or for every
+        project if one isn't specified
+    """
+    with _stores_lock:
+        stores = list(_stores.values()) if project is None else [_stores.get(project)]
+
+    for store in stores:
+        if store:
+            store.clear()
+
+
+def _normalize_namespace(namespace):
+    return namespace or None
+
+
+def _normalize_value(value):
+    """
+        Converts a value into the form the Datastore would return it in
+    """
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(x) for x in value]
+    elif isinstance(value, str) and type(value) is not str:
+        # Subclasses (e.g. SafeText) come back as plain strings
+        return str(value)
+    elif isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.astimezone(datetime.timezone.utc)
+    elif isinstance(value, Entity):
+        return _copy_entity(value)
+    return value
+
+
+def _copy_entity(entity, key=None):
+    result = Entity(key=key or entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    for name, value in entity.items():
+        if isinstance(value, (list, tuple, str, datetime.datetime, Entity)):
+            value = _normalize_value(value)
+        elif isinstance(value, dict):
+            value = copy.deepcopy(value)
+        result[name] = value
+    return result
+
+
+def _path_value(key):
+    # IDs sort before names at each level of the path
+    return tuple(
+        (0, component) if isinstance(component, int) else (1, component)
+        for component in key.flat_path
+    )
+
+
+def _microseconds(value):
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _sort_value(value):
+    """
+        Returns a comparable tuple for a property value which follows the
+        Datastore's ordering of value types
+    """
+    if value is None:
+        return (0,)
+    elif isinstance(value, bool):
+        return (2, value)
+    elif isinstance(value, int):
+        return (1, value)
+    elif isinstance(value, datetime.datetime):
+        return (1, _microseconds(_normalize_value(value)))
+    elif isinstance(value, bytes):
+        return (3, value)
+    elif isinstance(value, str):
+        return (4, value)
+    elif isinstance(value, float):
+        return (5, value)
+    elif isinstance(value, GeoPoint):
+        return (6, value.latitude, value.longitude)
+    elif isinstance(value, Key):
+        return (7, _path_value(value))
+    # Embedded entities aren't comparable
+    return (8,)
+
+
+_OPERATORS = {
+    "=": lambda x, y: x == y,
+    "<": lambda x, y: x < y,
+    "<=": lambda x, y: x <= y,
+    ">": lambda x, y: x > y,
+    ">=": lambda x, y: x >= y,
+}
+
+
+def _indexed_values(entity, name):
+    """
+        Returns the index values of a property, or None if the property
+        isn't indexed (in which case queries on it never match the entity)
+    """
+    if name == "__key__":
+        return [entity.key]
+
+    if name not in entity or name in entity.exclude_from_indexes:
+        return None
+
+    value = entity[name]
+    if isinstance(value, list):
+        return value or None
+    return [value]
+
+
+def _encode_cursor(position):
+    return base64.urlsafe_b64encode(_CURSOR_PREFIX + str(position).encode("ascii"))
+
+
+def _decode_cursor(cursor):
+    if isinstance(cursor, str):
+        cursor = cursor.encode("ascii")
+
+    value = base64.urlsafe_b64decode(cursor)
+    if not value.startswith(_CURSOR_PREFIX):
+        raise ValueError("Invalid cursor")
+    return int(value[len(_CURSOR_PREFIX):])
+
+
+class Store(object):
+    """
+        The entities for a single project, keyed by namespace and kind
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.kinds = {}
+        self.next_id = FIRST_ALLOCATED_ID
+
+    def clear(self):
+        # We don't reset next_id as IDs may have been allocated but not used yet
+        with self.lock:
+            self.kinds = {}
+
+    def allocate_ids(self, count):
+        with self.lock:
+            first = self.next_id
+            self.next_id += count
+            return list(range(first, first + count))
+
+    def reserve_id(self, id_or_name):
+        if isinstance(id_or_name, int):
+            with self.lock:
+                self.next_id = max(self.next_id, id_or_name + 1)
+
+    def _entities(self, key):
+        return self.kinds.setdefault((_normalize_namespace(key.namespace), key.kind), {})
+
+    def get(self, key):
+        with self.lock:
+            entity = self.kinds.get((_normalize_namespace(key.namespace), key.kind), {}).get(key.flat_path)
+
+        return _copy_entity(entity) if entity is not None else None
+
+    def apply(self, puts, deletes):
+        """
+            Atomically applies a set of mutations
+        """
+        with self.lock:
+            for key in deletes:
+                self._entities(key).pop(key.flat_path, None)
+
+            for entity in puts:
+                self.reserve_id(entity.key.id_or_name)
+                self._entities(entity.key)[entity.key.flat_path] = entity
+
+    def run_query(self, query, limit=None, offset=None, start_cursor=None, end_cursor=None):
+        namespace = _normalize_namespace(query.namespace)
+
+        if query.kind == "__kind__":
+            with self.lock:
+                kinds = sorted(kind for (ns, kind), entities in self.kinds.items() if ns == namespace and entities)
+            results = [Entity(key=Key("__kind__", kind, project=query.project, namespace=namespace)) for kind in kinds]
+        elif query.kind == "__namespace__":
+            with self.lock:
+                namespaces = set(ns for (ns, kind), entities in self.kinds.items() if entities)
+            results = [
+                Entity(key=Key("__namespace__", ns or 1, project=query.project))
+                for ns in sorted(namespaces, key=lambda x: x or "")
+            ]
+        else:
+            results = self._matching_entities(query, namespace)
+
+        start = _decode_cursor(start_cursor) if start_cursor else 0
+        end = _decode_cursor(end_cursor) if end_cursor else len(results)
+
+        skipped = min(offset or 0, max(end - start, 0))
+        start += skipped
+
+        stop = end if limit is None else min(end, start + limit)
+        stop = max(stop, start)
+
+        return Iterator(
+            [_copy_entity(x) for x in results[start:stop]],
+            skipped_results=skipped,
+            more_results=stop < end,
+            next_page_token=_encode_cursor(stop),
+        )
+
+    def _matching_entities(self, query, namespace):
+        with self.lock:
+            if query.kind:
+                entities = list(self.kinds.get((namespace, query.kind), {}).values())
+            else:
+                entities = list(
+                    itertools.chain.from_iterable(
+                        values.values() for (ns, kind), values in self.kinds.items() if ns == namespace
+                    )
+                )
+
+        if query.ancestor:
+            ancestor_path = query.ancestor.flat_path
+            entities = [x for x in entities if x.key.flat_path[:len(ancestor_path)] == ancestor_path]
+
+        # Each equality filter can be matched by a different value of a list property, but
+        # the inequality filters on a property must all be matched by the same value
+        filters = []
+        inequalities = {}
+        for name, operator, value in query.filters:
+            if operator == "=":
+                filters.append((name, [(_OPERATORS[operator], _sort_value(value))]))
+            else:
+                if name not in inequalities:
+                    inequalities[name] = []
+                    filters.append((name, inequalities[name]))
+                inequalities[name].append((_OPERATORS[operator], _sort_value(value)))
+
+        orderings = [(x.lstrip("-"), x.startswith("-")) for x in query.order]
+        required = set(name for name, _ in filters) | set(name for name, _ in orderings) | set(query.projection)
+
+        matches = []
+        for entity in entities:
+            values = {}
+            for name in required:
+                values[name] = _indexed_values(entity, name)
+                if values[name] is None:
+                    break
+            else:
+                if all(
+                    any(all(compare(_sort_value(x), value) for compare, value in comparisons) for x in values[name])
+                    for name, comparisons in filters
+                ):
+                    matches.append((entity, values))
+
+        def sort_key(match):
+            entity, values = match
+            result = []
+            for name, descending in orderings:
+                # List properties are ordered by their smallest value when ascending
+                # and their largest value when descending
+                if descending:
+                    result.append(_Descending(max(_sort_value(x) for x in values[name])))
+                else:
+                    result.append(min(_sort_value(x) for x in values[name]))
+            result.append(_path_value(entity.key))
+            return tuple(result)
+
+        matches.sort(key=sort_key)
+
+        if query.projection and query.projection != ["__key__"]:
+            results = self._project(query, matches)
+        elif query.projection:
+            results = [Entity(key=entity.key) for entity, values in matches]
+        else:
+            results = [entity for entity, values in matches]
+
+        if query.distinct_on:
+            seen = set()
+            distinct = []
+            for entity in results:
+                value = tuple(_sort_value(entity.get(x)) for x in query.distinct_on)
+                if value not in seen:
+                    seen.add(value)
+                    distinct.append(entity)
+            results = distinct
+
+        return results
+
+    def _project(self, query, matches):
+        """
+            Projections return one result for each combination of the values
+            of projected list properties, and return index values (so datetimes
+            are returned as microseconds)
+        """
+        results = []
+        names = [x for x in query.projection if x != "__key__"]
+        for entity, values in matches:
+            for combination in itertools.product(*[values[x] for x in names]):
+                result = Entity(key=entity.key)
+                for name, value in zip(names, combination):
+                    if isinstance(value, datetime.datetime):
+                        value = _microseconds(_normalize_value(value))
+                    result[name] = value
+                results.append(result)
+        return results
+
+
+class _Descending(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class Iterator(object):
+    """
+        Mimics the attributes of google.cloud.datastore.query.Iterator
+        which the backend reads
+    """
+
+    def __init__(self, results, skipped_results, more_results, next_page_token):
+        self._results = results
+        self._skipped_results = skipped_results
+        self._more_results = more_results
+        self.next_page_token = next_page_token
+        self.num_results = 0
+
+    def __iter__(self):
+        for result in self._results:
+            self.num_results += 1
+            yield result
+
+
+class Query(DatastoreQuery):
+    def fetch(
+        self, limit=None, offset=0, start_cursor=None, end_cursor=None, client=None, eventual=False, **kwargs
+    ):
+        client = client or self._client
+        with client.instrumentation.rpc("run_query", [self.kind], 1) as event:
+            iterator = client._store.run_query(
+                self, limit=limit, offset=offset, start_cursor=start_cursor, end_cursor=end_cursor
+            )
+            event.results = len(iterator._results)
+            return iterator
+
+
+class _MutationMixin(object):
+    """
+        Buffers mutations in memory and applies them to the store
+        atomically on commit
+    """
+
+    def _begin_mutations(self):
+        self._puts = {}
+        self._deletes = {}
+        self._partial_entities = []
+
+    def begin(self):
+        if self._status != self._INITIAL:
+            raise ValueError("Batch already started previously.")
+        self._status = self._IN_PROGRESS
+        self._begin_mutations()
+
+    def put(self, entity):
+        if self._status != self._IN_PROGRESS:
+            raise ValueError("Batch must be in progress to put()")
+
+        if entity.key is None:
+            raise ValueError("Entity must have a key")
+
+        if self.project != entity.key.project:
+            raise ValueError("Key must be from same project as batch")
+
+        if entity.key.is_partial:
+            self._partial_entities.append((entity, _copy_entity(entity)))
+        else:
+            self._deletes.pop(entity.key, None)
+            self._puts[entity.key] = _copy_entity(entity)
+
+    def delete(self, key):
+        if self._status != self._IN_PROGRESS:
+            raise ValueError("Batch must be in progress to delete()")
+
+        if key.is_partial:
+            raise ValueError("Key must be complete")
+
+        if self.project != key.project:
+            raise ValueError("Key must be from same project as batch")
+
+        self._puts.pop(key, None)
+        self._deletes[key] = key
+
+    def commit(self, retry=None, timeout=None):
+        if self._status != self._IN_PROGRESS:
+            raise ValueError("Batch must be in progress to commit()")
+
+        store = self._client._store
+        for entity, pending in self._partial_entities:
+            # Like the real client, complete the keys of the entities passed to put()
+            entity.key = entity.key.completed_key(store.allocate_ids(1)[0])
+            self._puts[entity.key] = _copy_entity(pending, key=entity.key)
+
+        puts, deletes = list(self._puts.values()), list(self._deletes.values())
+        kinds = [x.key.kind for x in puts] + [x.kind for x in deletes]
+        try:
+            with self._client.instrumentation.rpc("commit", kinds, len(puts) + len(deletes)):
+                store.apply(puts, deletes)
+        finally:
+            self._status = self._FINISHED
+
+    def rollback(self, retry=None, timeout=None):
+        if self._status != self._IN_PROGRESS:
+            raise ValueError("Batch must be in progress to rollback()")
+
+        self._begin_mutations()
+        self._status = self._ABORTED
+
+
+class Batch(_MutationMixin, DatastoreBatch):
+    pass
+
+
+class Transaction(_MutationMixin, DatastoreTransaction):
+    _ids = itertools.count(1)
+
+    def begin(self, retry=None, timeout=None):
+        with self._client.instrumentation.rpc("begin_transaction"):
+            super().begin()
+            self._id = str(next(self._ids)).encode("ascii")
+
+    def commit(self, retry=None, timeout=None):
+        try:
+            super().commit()
+        finally:
+            self._id = None
+
+    def rollback(self, retry=None, timeout=None):
+        try:
+            with self._client.instrumentation.rpc("rollback"):
+                super().rollback()
+        finally:
+            self._id = None
+
+
+class Client(object):
+    """
+        An in-memory implementation of the google.cloud.datastore.Client
+        methods used by the backend
+    """
+
+    def __init__(self, project=None, namespace=None, **kwargs):
+        self.project = project
+        self.namespace = namespace
+        self._store = get_store(project)
+        # Replaced by the connection's instrumentation when used by the backend
+        self.instrumentation = Instrumentation()
+        # Like the google client, batches and transactions are per-thread
+        self._local = threading.local()
+
+    @property
+    def _batch_stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _push_batch(self, batch):
+        self._batch_stack.append(batch)
+
+    def _pop_batch(self):
+        return self._batch_stack.pop()
+
+    @property
+    def current_batch(self):
+        return self._batch_stack[-1] if self._batch_stack else None
+
+    @property
+    def current_transaction(self):
+        transaction = self.current_batch
+        if isinstance(transaction, DatastoreTransaction):
+            return transaction
+
+    def key(self, *path_args, **kwargs):
+        if "project" in kwargs:
+            raise TypeError("Cannot pass project")
+        kwargs["project"] = self.project
+        if "namespace" not in kwargs:
+            kwargs["namespace"] = self.namespace
+        return Key(*path_args, **kwargs)
+
+    def query(self, **kwargs):
+        if "client" in kwargs:
+            raise TypeError("Cannot pass client")
+        if "project" in kwargs:
+            raise TypeError("Cannot pass project")
+        kwargs["project"] = self.project
+        if "namespace" not in kwargs:
+            kwargs["namespace"] = self.namespace
+        return Query(self, **kwargs)
+
+    def batch(self):
+        return Batch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self, **kwargs)
+
+    def get(self, key, missing=None, deferred=None, transaction=None, eventual=False, **kwargs):
+        entities = self.get_multi([key], missing=missing, deferred=deferred)
+        return entities[0] if entities else None
+
+    def get_multi(self, keys, missing=None, deferred=None, transaction=None, eventual=False, **kwargs):
+        if not keys:
+            return []
+
+        if set(key.project for key in keys) != set([self.project]):
+            raise ValueError("Keys do not match project")
+
+        if missing is not None and missing != []:
+            raise ValueError("missing must be None or an empty list")
+
+        found = []
+        with self.instrumentation.rpc("lookup", [x.kind for x in keys], len(keys)) as event:
+            for key in keys:
+                entity = self._store.get(key)
+                if entity is not None:
+                    found.append(entity)
+                elif missing is not None:
+                    missing.append(Entity(key=key))
+            event.results = len(found)
+        return found
+
+    def put(self, entity, **kwargs):
+        self.put_multi([entity])
+
+    def put_multi(self, entities, **kwargs):
+        if isinstance(entities, Entity):
+            raise ValueError("Pass a sequence of entities")
+
+        if not entities:
+            return
+
+        current = self.current_batch
+        in_batch = current is not None
+        if not in_batch:
+            current = self.batch()
+            current.begin()
+
+        for entity in entities:
+            current.put(entity)
+
+        if not in_batch:
+            current.commit()
+
+    def delete(self, key, **kwargs):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys, **kwargs):
+        if not keys:
+            return
+
+        current = self.current_batch
+        in_batch = current is not None
+        if not in_batch:
+            current = self.batch()
+            current.begin()
+
+        for key in keys:
+            current.delete(key)
+
+        if not in_batch:
+            current.commit()
+
+    def allocate_ids(self, incomplete_key, num_ids, **kwargs):
+        if not incomplete_key.is_partial:
+            raise ValueError(("Key is not partial.", incomplete_key))
+
+        with self.instrumentation.rpc("allocate_ids", [incomplete_key.kind], num_ids):
+            return [incomplete_key.completed_key(x) for x in self._store.allocate_ids(num_ids)]
+
+    def reserve_ids(self, complete_key, num_ids, **kwargs):
+        if complete_key.is_partial:
+            raise ValueError(("Key is not Complete.", complete_key))
+
+        with self.instrumentation.rpc("reserve_ids", [complete_key.kind], num_ids):
+            self._store.reserve_id(complete_key.id_or_name)
+
+    def reserve_ids_multi(self, complete_keys, **kwargs):
+        for key in complete_keys:
+            if key.is_partial:
+                raise ValueError(("Key is not Complete.", key))
+
+        with self.instrumentation.rpc("reserve_ids", [x.kind for x in complete_keys], len(complete_keys)):
+            for key in complete_keys:
+                self._store.reserve_id(key.id_or_name)
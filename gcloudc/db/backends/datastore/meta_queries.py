@@ -1,14 +1,26 @@
 import copy
 import threading
-from functools import cmp_to_key, partial
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
 
 from django.conf import settings
 from google.cloud.datastore.key import Key
 
-from . import POLYMODEL_CLASS_ATTRIBUTE, caching
-from .query_utils import compare_keys, get_filter, is_keys_only
-from .utils import django_ordering_comparison, entity_matches_query
+from . import (
+    POLYMODEL_CLASS_ATTRIBUTE,
+    caching,
+    dataloader,
+    stats,
+)
+from .query_utils import (
+    get_filter,
+    is_keys_only,
+    key_sort_value,
+)
+from .utils import (
+    django_ordering_sort_key,
+    entity_matches_query,
+)
 
 
 class AsyncMultiQuery(object):
@@ -26,7 +38,7 @@ class AsyncMultiQuery(object):
     def __init__(self, queries, orderings):
         self._queries = [copy.copy(x) for x in queries]
         self._orderings = orderings
-        self._min_max_cache = {}
+        self._ordering_key = django_ordering_sort_key(orderings)
 
         # When set, this is called on the query before .Run() is called
         # Which allows you to manipulate the options. Recommend this is set/unset
@@ -90,6 +102,8 @@ class AsyncMultiQuery(object):
             Uses multiple threads to submit RPC calls
         """
 
+        stats.record_multi_query(len(self._queries))
+
         threads = []
 
         # We need to grab a set of results per query
@@ -117,59 +131,15 @@ class AsyncMultiQuery(object):
 
         return result_queues
 
-    def _compare_entities(self, lhs, rhs):
-        def cmp(a, b):
-            # Treat None as less than everything for the purpose
-            # of ordering
-            if a is None and b is None:
-                return 0
-            elif a is None:
-                return -1
-            elif b is None:
-                return 1
-
-            return (a > b) - (a < b)
-
-        if isinstance(lhs, Key) and isinstance(rhs, Key):
-            return compare_keys(lhs, rhs)
-
-        def get_extreme_if_list_property(entity_key, column, value, descending):
-            if not isinstance(value, list):
-                return value
-
-            if (entity_key, column) in self._min_max_cache:
-                return self._min_max_cache[(entity_key, column)]
-
-            if descending:
-                value = min(value)
-            else:
-                value = max(value)
-            self._min_max_cache[(entity_key, column)] = value
-
-        if not lhs:
-            return cmp(lhs, rhs)
-
-        for column in self._orderings:
-            descending = column.startswith("-")
-            column = column.lstrip("-")
-
-            lhs_value = lhs.key if column == "__key__" else lhs[column]
-            rhs_value = rhs.key if column == "__key__" else rhs[column]
-
-            lhs_value = get_extreme_if_list_property(lhs.key, column, lhs_value, descending)
-            rhs_value = get_extreme_if_list_property(lhs.key, column, rhs_value, descending)
-
-            if isinstance(lhs_value, Key) and isinstance(rhs_value, Key):
-                result = compare_keys(lhs_value, rhs_value)
-            else:
-                result = cmp(lhs_value, rhs_value)
-
-            if descending:
-                result = -result
-            if result:
-                return result
+    def _entity_sort_key(self, entity):
+        """
+            Returns a comparable tuple for the entity (or key) based on the
+            shared ordering, falling back to the key to give a stable order
+        """
+        if isinstance(entity, Key):
+            return (key_sort_value(entity),)
 
-        return compare_keys(lhs.key, rhs.key)
+        return self._ordering_key(entity) + (key_sort_value(entity.key),)
 
     def fetch(self, offset=None, limit=None):
         """
@@ -181,27 +151,32 @@ class AsyncMultiQuery(object):
             entry in each resultset, then iteratively picks the next entity and then
             fills the slot from the counterpart result set until all the slots are None.
         """
-        self._min_max_cache = []
-
         # We have to assume that one branch might return all the results and as
         # offsetting is done by skipping results we need to get offset + limit results
         # from each branch
         results = self._fetch_results(limit=(offset or 0) + limit if limit is not None else None)
 
         # Go through each outstanding result queue and store
-        # the next entry of each (None if the result queue is done)
+        # the next entry of each (None if the result queue is done) alongside
+        # its sort key, so that each entity's key is only built once
         next_entries = [None] * len(results)
-        for i, queue in enumerate(results):
+        next_sort_keys = [None] * len(results)
+
+        def advance(i):
             try:
                 next_entries[i] = next(results[i])
+                next_sort_keys[i] = self._entity_sort_key(next_entries[i])
             except StopIteration:
-                next_entries[i] = None
+                next_entries[i] = next_sort_keys[i] = None
+
+        for i in range(len(results)):
+            advance(i)
 
         returned_count = 0
         yielded_count = 0
 
         seen_keys = set()  # For de-duping results
-        while any(next_entries):
+        while any(x is not None for x in next_entries):
 
             def get_next():
                 idx, lowest = None, None
@@ -210,15 +185,12 @@ class AsyncMultiQuery(object):
                     if entry is None:
                         continue
 
-                    if lowest is None or self._compare_entities(entry, lowest) < 0:
+                    if lowest is None or next_sort_keys[i] < next_sort_keys[idx]:
                         idx, lowest = i, entry
 
                 # Move the queue along if we found the entry there
                 if lowest is not None:
-                    try:
-                        next_entries[idx] = next(results[idx])
-                    except StopIteration:
-                        next_entries[idx] = None
+                    advance(idx)
 
                 return lowest
 
@@ -266,6 +238,9 @@ def _convert_entity_based_on_query_options(entity, keys_only, projection):
 # will be cached
 DEFAULT_MAX_ENTITY_COUNT = 8
 
+# The max number of datastore Gets that QueryByKeys will run at the same time
+MAX_CONCURRENT_GETS = 8
+
 
 class QueryByKeys(object):
     """ Does the most efficient fetching possible for when we have the keys of the entities we want. """
@@ -281,15 +256,12 @@ class QueryByKeys(object):
             result = get_filter(query, ("__key__", "="))
             return result
 
-        def compare_queries(lhs, rhs):
-            return compare_keys(_get_key(lhs), _get_key(rhs))
-
         self.connection = connection
         self.model = model
         self.namespace = namespace
 
         # groupby requires that the iterable is sorted by the given key before grouping
-        self.queries = sorted(queries, key=cmp_to_key(compare_queries))
+        self.queries = sorted(queries, key=lambda query: key_sort_value(_get_key(query)))
         self.query_count = len(self.queries)
         self.queries_by_key = {a: list(b) for a, b in groupby(self.queries, _get_key)}
 
@@ -309,7 +281,7 @@ class QueryByKeys(object):
 
             1. Single key, hit memcache
             2. Multikey projection, async MultiQueries with ancestors chained
-            3. Full select, datastore get
+            3. Full select, hit memcache for whatever we can and datastore get the rest
         """
         from gcloudc.db.backends.datastore import transaction
         from gcloudc.db.backends.datastore.caching import MAX_CACHE_COUNT
@@ -322,9 +294,28 @@ class QueryByKeys(object):
         cache_results = True
         results = None
 
-        if key_count == 1:
-            # FIXME: Potentially could use get_multi in memcache and the make a query
-            # for whatever remains
+        # If anything of this kind has been queued up in a dataloader, fetch it
+        # all now, so that this lookup (and any that follow) hit the cache
+        dataloader.load_pending(self.kind, using=self.connection)
+
+        cached_results = []
+        keys_to_fetch = []
+
+        if not (base_query.projection and self.can_multi_query):
+            # Use anything we have in the context cache, and only fetch whatever remains
+            for key in self.queries_by_key:
+                assert(isinstance(key, Key))
+
+                result = caching.get_from_cache_by_key(key)
+                if result is None:
+                    keys_to_fetch.append(key)
+                else:
+                    cached_results.append(result)
+
+            if not keys_to_fetch:
+                results = cached_results
+                cache_results = False  # Don't update cache, we just got it from there
+        elif key_count == 1:
             key = next(iter(self.queries_by_key))
             assert(isinstance(key, Key))
 
@@ -373,23 +364,29 @@ class QueryByKeys(object):
                     results = AsyncMultiQuery(multi_query, orderings).fetch(limit=to_fetch)
             else:
                 # Can pass 1000 keys to a datastore.Get, so if there are more we need to do them
-                # in multiple gets
+                # in multiple gets, which we run concurrently
                 MAX_ALLOWED_GET = 1000
 
-                all_keys = list(self.queries_by_key.keys())
-                next_keys, remaining_keys = all_keys[:MAX_ALLOWED_GET], all_keys[MAX_ALLOWED_GET:]
+                chunks = [
+                    keys_to_fetch[i:i + MAX_ALLOWED_GET] for i in range(0, len(keys_to_fetch), MAX_ALLOWED_GET)
+                ]
 
-                results = []
-                while next_keys:
-                    results.extend(client.get(next_keys))
-                    next_keys, remaining_keys = remaining_keys[:MAX_ALLOWED_GET], remaining_keys[MAX_ALLOWED_GET:]
+                results = cached_results
+                if len(chunks) > 1:
+                    with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_CONCURRENT_GETS)) as executor:
+                        for chunk_results in executor.map(client.get, chunks):
+                            results.extend(chunk_results)
+                else:
+                    for chunk in chunks:
+                        results.extend(client.get(chunk))
 
         def iter_results(results):
             returned = 0
 
             # This is safe, because Django is fetching all results any way :(
-            sorted_results = sorted(results, key=cmp_to_key(partial(django_ordering_comparison, self.ordering)))
-            sorted_results = [result for result in sorted_results if result is not None]
+            sorted_results = [result for result in results if result is not None]
+            if self.ordering:
+                sorted_results.sort(key=django_ordering_sort_key(self.ordering))
 
             if cache_results and sorted_results:
                 caching.add_entities_to_cache(
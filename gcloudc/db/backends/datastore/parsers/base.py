@@ -86,7 +86,7 @@ class BaseParser(object):
         self.model = self.django_query.model
 
     def _determine_query_kind(self):
-        """ Basically returns SELECT or COUNT """
+        """ Basically returns SELECT, COUNT or AGGREGATE """
         query = self.django_query
 
         if query.annotations:
@@ -95,6 +95,11 @@ class BaseParser(object):
                 if isinstance(field, Star) or field.value == "*":
                     return "COUNT"
 
+            # aggregate() queries where every selected annotation is an aggregate
+            annotations = query.annotation_select.values()
+            if annotations and all(isinstance(x, Aggregate) and x.is_summary for x in annotations):
+                return "AGGREGATE"
+
         return "SELECT"
 
     def _prepare_for_transformation(self):
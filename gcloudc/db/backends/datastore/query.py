@@ -9,6 +9,10 @@ from django.db import (
     connections,
 )
 from django.db.models import AutoField
+from django.db.models.expressions import (
+    Col,
+    Star,
+)
 from django.db.models.sql.datastructures import EmptyResultSet
 from django.utils import six
 
@@ -27,7 +31,7 @@ from .utils import (
 logger = logging.getLogger(__name__)
 
 
-VALID_QUERY_KINDS = ("SELECT", "UPDATE", "INSERT", "DELETE", "COUNT", "AVERAGE")
+VALID_QUERY_KINDS = ("SELECT", "UPDATE", "INSERT", "DELETE", "COUNT", "AGGREGATE")
 
 VALID_ANNOTATIONS = {"MIN": min, "MAX": max, "SUM": sum, "COUNT": len, "AVG": lambda x: (sum(x) / len(x))}
 
@@ -203,6 +207,9 @@ class Query(object):
 
         self.annotations = []
         self.per_entity_annotations = []
+
+        # A list of (column, function, source column, distinct) for AGGREGATE queries
+        self.aggregates = []
         self.extra_selects = []
         self.polymodel_filter_added = False
 
@@ -281,7 +288,29 @@ class Query(object):
     def add_order_by(self, column):
         self.order_by.append(column)
 
+    def add_aggregate(self, column, aggregate):
+        function = aggregate.__class__.__name__.upper()
+        if function not in VALID_ANNOTATIONS:
+            raise NotSupportedError("Unsupported aggregate %s" % aggregate.__class__.__name__)
+
+        if getattr(aggregate, "filter", None) is not None:
+            raise NotSupportedError("Filtered aggregates are not supported on the Datastore")
+
+        source = aggregate.get_source_expressions()[0]
+        if isinstance(source, Star) or getattr(source, "value", None) == "*":
+            source_column = "__key__"
+        elif isinstance(source, Col):
+            source_column = "__key__" if source.target.primary_key else source.target.column
+        else:
+            raise NotSupportedError("Only columns can be aggregated on the Datastore")
+
+        self.aggregates.append((column, function, source_column, bool(aggregate.distinct)))
+
     def add_annotation(self, column, annotation):
+        if self.kind == "AGGREGATE":
+            self.add_aggregate(column, annotation)
+            return
+
         # The Trunc annotation class doesn't exist in Django 1.8, hence we compare by
         # strings, rather than importing the class to compare it
         name = annotation.__class__.__name__
@@ -545,10 +574,7 @@ class Query(object):
         if self.where:
             walk(self._where, False)
 
-    def _disable_projection_if_fields_used_in_equality_filter(self):
-        if not self._where or not self.columns:
-            return
-
+    def _equality_filter_columns(self):
         equality_columns = set()
 
         def walk(node):
@@ -558,7 +584,28 @@ class Query(object):
             elif node.operator == "=" or node.operator == "IN":
                 equality_columns.add(node.column)
 
-        walk(self._where)
+        if self._where:
+            walk(self._where)
+
+        return equality_columns
+
+    def can_project_column(self, column):
+        """
+            Returns True if a projection query on the column alone will return
+            the column's values (e.g. for aggregating them)
+        """
+        field = get_field_from_column(self.model, column)
+        if field is None or field.db_type(self.connection) in ("bytes", "text", "list", "set"):
+            return False
+
+        # The Datastore doesn't allow projecting a property used in an equality filter
+        return column not in self._equality_filter_columns()
+
+    def _disable_projection_if_fields_used_in_equality_filter(self):
+        if not self._where or not self.columns:
+            return
+
+        equality_columns = self._equality_filter_columns()
 
         if equality_columns and equality_columns.intersection(self.columns):
             self.columns = None
@@ -607,6 +654,12 @@ class Query(object):
 
             FIXME: This function is incomplete! Not all necessary members are serialized
         """
+        return json.dumps(self.serializable())
+
+    def serializable(self):
+        """
+            Returns the JSON-serializable dict which serialize() encodes
+        """
         if not self.is_normalized:
             raise ValueError("You cannot serialize queries unless they are normalized")
 
@@ -622,6 +675,7 @@ class Query(object):
         result["low_mark"] = self.low_mark
         result["high_mark"] = self.high_mark
         result["excluded_pks"] = list(map(str, self.excluded_pks))
+        result["aggregates"] = self.aggregates
 
         where = []
 
@@ -643,7 +697,7 @@ class Query(object):
 
         result["where"] = where
 
-        return json.dumps(result)
+        return result
 
 
 INVALID_ORDERING_FIELD_MESSAGE = (
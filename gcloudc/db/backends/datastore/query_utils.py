@@ -32,37 +32,18 @@ def is_keys_only(query):
     return query.projection == ["__key__"]
 
 
-def compare_keys(lhs, rhs):
+def key_sort_value(key):
     """
         The App Engine API used to provide a key comparison, but for
         some reason the Cloud Datastore API doesn't :(
-    """
-
-    def cmp(a, b):
-        if a is None and b is None:
-            return 0
-
-        if a is None:
-            return -1
-
-        if b is None:
-            return 1
 
-        return (a > b) - (a < b)
-
-    lhs_args = [lhs.project, lhs.namespace] + list(lhs.flat_path)
-    if lhs.is_partial:
-        # If the key is partial, then we need to add a blank placeholder
-        # for the id or name so we can compare correctly
-        lhs_args.extend("")
-
-    rhs_args = [rhs.project, rhs.namespace] + list(rhs.flat_path)
-    if rhs.is_partial:
-        rhs_args.extend("")
-
-    for lhs_component, rhs_component in zip(lhs_args, rhs_args):
-        comparison = cmp(lhs_component, rhs_component)
-        if comparison != 0:
-            return comparison
+        Returns a tuple which can be used as a sort key for Datastore keys. Keys
+        are ordered by project, namespace and then each component of the path.
+    """
 
-    return cmp(len(lhs_args), len(rhs_args))
+    # None (e.g. the default namespace) sorts before everything else, so we wrap each
+    # component in a tuple with a leading flag to avoid comparing None to a value
+    return tuple(
+        (0,) if component is None else (1, component)
+        for component in [key.project, key.namespace] + list(key.flat_path)
+    )
@@ -0,0 +1,144 @@
+"""
+    A log of the commands run on each connection, with how long they took and
+    how much work they did.
+
+    The log is a ring buffer, bounded both by the number of entries and by
+    the (approximate) size of their SQL, so it's safe to leave enabled in long
+    running processes. It's enabled when DEBUG is True, or when the
+    GCLOUDC_QUERY_LOG_ENABLED setting is True.
+"""
+
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .formatting import generate_sql_representation
+
+# None means the log follows the DEBUG setting
+QUERY_LOG_ENABLED = getattr(settings, "GCLOUDC_QUERY_LOG_ENABLED", None)
+QUERY_LOG_MAX_ENTRIES = getattr(settings, "GCLOUDC_QUERY_LOG_MAX_ENTRIES", 1000)
+QUERY_LOG_MAX_BYTES = getattr(settings, "GCLOUDC_QUERY_LOG_MAX_BYTES", 1024 * 1024)
+
+
+def query_log_enabled():
+    # DEBUG is checked each time a connection is made, as the test runner changes it
+    return settings.DEBUG if QUERY_LOG_ENABLED is None else QUERY_LOG_ENABLED
+
+
+class QueryLogEntry(object):
+    # A rough size for everything in an entry apart from its SQL
+    OVERHEAD_BYTES = 256
+
+    def __init__(self, command):
+        self.command_type = type(command).__name__
+        self.sql = command_representation(command)
+        self.start = time.time()
+        self.duration = 0.0
+        self.rpcs = 0
+        self.entities_read = 0
+        self.entities_written = 0
+        self.size = len(self.sql.encode("utf-8")) + self.OVERHEAD_BYTES
+
+    def as_dict(self):
+        return {
+            "type": self.command_type,
+            "sql": self.sql,
+            "start": self.start,
+            "duration": self.duration,
+            "rpcs": self.rpcs,
+            "entities_read": self.entities_read,
+            "entities_written": self.entities_written,
+        }
+
+    def __repr__(self):
+        return "<QueryLogEntry {} {:.1f}ms {}>".format(self.command_type, self.duration * 1000, self.sql)
+
+
+def command_representation(command):
+    from .commands import FlushCommand
+
+    if isinstance(command, FlushCommand):
+        return "FLUSH {}".format(", ".join(command.tables))
+
+    try:
+        return str(generate_sql_representation(command))
+    except Exception:
+        # The log must never break the query it's logging
+        return repr(type(command))
+
+
+class QueryLog(object):
+    """
+        The log for a single connection. The RPCs made while a command is being
+        recorded are attributed to it, including those made by other threads
+        on behalf of the connection.
+    """
+
+    def __init__(self, enabled=True, max_entries=QUERY_LOG_MAX_ENTRIES, max_bytes=QUERY_LOG_MAX_BYTES):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current = None
+
+        self._entries = collections.deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, command):
+        entry = QueryLogEntry(command)
+
+        with self._lock:
+            self._entries.append(entry)
+            self._bytes += entry.size
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._bytes -= self._entries.popleft().size
+
+        return entry
+
+    @contextmanager
+    def recording(self, entry):
+        """
+            Adds the time spent in the block to the entry, and attributes
+            any RPCs made to it. Selects are recorded again while their
+            results are fetched.
+        """
+        if self.current is entry:
+            yield
+            return
+
+        previous, self.current = self.current, entry
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry.duration += time.perf_counter() - start
+            self.current = previous
+
+    def record(self, rpcs=1, entities_read=0, entities_written=0):
+        entry = self.current
+        if entry is None:
+            return
+
+        with self._lock:
+            entry.rpcs += rpcs
+            entry.entities_read += entities_read
+            entry.entities_written += entities_written
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
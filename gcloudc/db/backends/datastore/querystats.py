@@ -0,0 +1,200 @@
+"""
+    Process-wide statistics about the shapes of the queries which are run.
+
+    A query's shape is its serialized form (see Query.serialize) with the filter
+    values, limits and excluded keys stripped out, so every execution of the
+    same queryset with different parameters is aggregated together. For each
+    shape we keep the number of executions, the total and 95th percentile
+    latency, the number of results, the number of branches it fans out to and
+    the meta-queries which ran it.
+
+    Recording the stats costs a little on every select, so they're only recorded
+    when DEBUG is True unless GCLOUDC_QUERY_STATS_ENABLED says otherwise.
+
+    Executions slower than GCLOUDC_SLOW_QUERY_THRESHOLD (in seconds) are logged
+    as warnings with their plan, whether or not the stats are being recorded.
+"""
+
+import collections
+import json
+import logging
+import math
+import threading
+
+from django.conf import settings
+
+from .formatting import generate_sql_representation
+
+logger = logging.getLogger(__name__)
+
+QUERY_STATS_ENABLED = getattr(settings, "GCLOUDC_QUERY_STATS_ENABLED", settings.DEBUG)
+
+# Once this many shapes are being tracked the shape with the least total time
+# is dropped to make room for a new one
+QUERY_STATS_MAX_SHAPES = getattr(settings, "GCLOUDC_QUERY_STATS_MAX_SHAPES", 1000)
+
+# The number of recent latencies kept for each shape to calculate the p95 from
+QUERY_STATS_LATENCY_SAMPLES = getattr(settings, "GCLOUDC_QUERY_STATS_LATENCY_SAMPLES", 200)
+
+# None disables the slow query log
+SLOW_QUERY_THRESHOLD = getattr(settings, "GCLOUDC_SLOW_QUERY_THRESHOLD", 1.0)
+
+# The members of a serialized query which are parameters rather than shape
+_PARAMETERS = ("low_mark", "high_mark", "excluded_pks")
+
+
+def query_shape(query):
+    """
+        Returns the shape of a normalized Query, as a string
+    """
+    shape = query.serializable()
+
+    for member in _PARAMETERS:
+        if shape[member]:
+            shape[member] = "?"
+
+    shape["where"] = [sorted(branch) for branch in shape["where"]]
+    return json.dumps(shape, sort_keys=True)
+
+
+def query_plan(command, sql=False):
+    """
+        Describes how a SelectCommand was run. Rendering the SQL is comparatively
+        slow, so it's only included if sql is True.
+    """
+    where = command.query.where
+    plan = {
+        "meta_query": type(command.gae_query).__name__,
+        "branches": len(where.children) if where else 1,
+    }
+    if sql:
+        plan["sql"] = str(generate_sql_representation(command))
+    return plan
+
+
+class QueryShapeStats(object):
+    def __init__(self, shape, table):
+        self.shape = shape
+        self.table = table
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.results = 0
+        self.branches = 0
+        self.max_branches = 0
+        self.meta_queries = collections.Counter()
+        self.latencies = collections.deque(maxlen=QUERY_STATS_LATENCY_SAMPLES)
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.count if self.count else 0.0
+
+    @property
+    def p95_time(self):
+        if not self.latencies:
+            return 0.0
+
+        latencies = sorted(self.latencies)
+        return latencies[int(math.ceil(len(latencies) * 0.95)) - 1]
+
+    def as_dict(self):
+        return {
+            "shape": self.shape,
+            "table": self.table,
+            "count": self.count,
+            "total_time": self.total_time,
+            "mean_time": self.mean_time,
+            "p95_time": self.p95_time,
+            "max_time": self.max_time,
+            "results": self.results,
+            "mean_branches": self.branches / self.count if self.count else 0.0,
+            "max_branches": self.max_branches,
+            "meta_queries": dict(self.meta_queries),
+        }
+
+
+class QueryStatsRegistry(object):
+    ORDERINGS = ("total_time", "count", "p95_time", "max_time", "mean_time", "results", "max_branches")
+
+    def __init__(self, max_shapes=QUERY_STATS_MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, shape, table, duration, results=0, branches=1, meta_query=None):
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                if len(self._shapes) >= self.max_shapes:
+                    least = min(self._shapes.values(), key=lambda x: x.total_time)
+                    del self._shapes[least.shape]
+
+                stats = self._shapes[shape] = QueryShapeStats(shape, table)
+
+            stats.count += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.latencies.append(duration)
+            stats.results += results
+            stats.branches += branches
+            stats.max_branches = max(stats.max_branches, branches)
+            if meta_query:
+                stats.meta_queries[meta_query] += 1
+
+        return stats
+
+    def top(self, limit=20, order_by="total_time"):
+        """
+            Returns the as_dict() of the worst shapes by order_by
+        """
+        if order_by not in self.ORDERINGS:
+            raise ValueError("Can't order query stats by {}".format(order_by))
+
+        with self._lock:
+            shapes = [x.as_dict() for x in self._shapes.values()]
+
+        shapes.sort(key=lambda x: x[order_by], reverse=True)
+        return shapes[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def __getitem__(self, shape):
+        return self._shapes[shape]
+
+
+registry = QueryStatsRegistry()
+
+
+def record_select(command, duration):
+    """
+        Records an execution of a SelectCommand, logging it if it was slow
+    """
+    slow = SLOW_QUERY_THRESHOLD is not None and duration > SLOW_QUERY_THRESHOLD
+    if not (QUERY_STATS_ENABLED or slow):
+        return
+
+    try:
+        shape = query_shape(command.query)
+        plan = query_plan(command, sql=slow)
+    except Exception:
+        # The stats must never break the query they're about
+        logger.debug("Unable to record stats for %r", command, exc_info=True)
+        return
+
+    if QUERY_STATS_ENABLED:
+        registry.record(
+            shape, command.query.model._meta.db_table, duration,
+            results=command.results_returned, branches=plan["branches"], meta_query=plan["meta_query"],
+        )
+
+    if slow:
+        logger.warning(
+            "Slow query (%.1fms, %s results, %s with %s branches): %s",
+            duration * 1000, command.results_returned, plan["meta_query"], plan["branches"], plan["sql"],
+            extra={"query": dict(plan, shape=shape, duration=duration, results=command.results_returned)},
+        )
@@ -0,0 +1,127 @@
+"""
+    Totals of the work the backend does while something (usually a request)
+    is being collected for, see gcloudc.db.middleware.
+
+    Stats are collected per thread. RPCs are attributed to the thread which
+    owns the connection they're made on, so the RPCs made by worker threads on
+    behalf of a request (e.g. the branches of a multi-query) are counted too.
+"""
+
+import collections
+import threading
+from contextlib import contextmanager
+
+# Maps thread idents to the RequestStats being collected for them
+_collectors = {}
+_collectors_lock = threading.Lock()
+
+
+class RequestStats(object):
+    def __init__(self):
+        self.rpcs = collections.Counter()  # By operation, e.g. "lookup", "run_query"
+        self.entities_read = 0
+        self.entities_written = 0
+        self.datastore_time = 0.0  # In seconds
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.multi_queries = 0
+        self.max_fan_out = 0  # The most branches run by a single multi-query
+        self.transactions = 0
+        self.failed_transactions = 0
+
+        self._lock = threading.Lock()
+
+    @property
+    def rpc_count(self):
+        return sum(self.rpcs.values())
+
+    def as_dict(self):
+        return {
+            "rpcs": self.rpc_count,
+            "rpcs_by_operation": dict(self.rpcs),
+            "entities_read": self.entities_read,
+            "entities_written": self.entities_written,
+            "datastore_time": self.datastore_time,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "multi_queries": self.multi_queries,
+            "max_fan_out": self.max_fan_out,
+            "transactions": self.transactions,
+            "failed_transactions": self.failed_transactions,
+        }
+
+
+@contextmanager
+def collect():
+    """
+        Collects stats for the current thread while in the block, yielding
+        the RequestStats they're collected in
+    """
+    ident = threading.get_ident()
+    stats = RequestStats()
+
+    with _collectors_lock:
+        previous = _collectors.get(ident)
+        _collectors[ident] = stats
+
+    try:
+        yield stats
+    finally:
+        with _collectors_lock:
+            if previous is None:
+                _collectors.pop(ident, None)
+            else:
+                _collectors[ident] = previous
+
+
+def get_stats(ident=None):
+    """
+        Returns the RequestStats being collected for the thread, or None
+    """
+    return _collectors.get(threading.get_ident() if ident is None else ident)
+
+
+def record_rpc(ident, event):
+    stats = get_stats(ident)
+    if stats is None:
+        return
+
+    with stats._lock:
+        stats.rpcs[event.operation] += 1
+        stats.entities_read += event.entities_read
+        stats.entities_written += event.entities_written
+        stats.datastore_time += event.duration
+
+
+def record_cache_lookup(hit):
+    stats = get_stats()
+    if stats is None:
+        return
+
+    with stats._lock:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def record_multi_query(branches):
+    stats = get_stats()
+    if stats is None:
+        return
+
+    with stats._lock:
+        stats.multi_queries += 1
+        stats.max_fan_out = max(stats.max_fan_out, branches)
+
+
+def record_transaction(failed=False):
+    stats = get_stats()
+    if stats is None:
+        return
+
+    with stats._lock:
+        if failed:
+            stats.failed_transactions += 1
+        else:
+            stats.transactions += 1
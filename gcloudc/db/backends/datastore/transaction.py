@@ -1,6 +1,6 @@
 import copy
 import threading
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from google.cloud import exceptions
 from google.cloud.datastore.transaction import \
@@ -8,7 +8,12 @@ from google.cloud.datastore.transaction import \
 
 from django.db import connections
 from gcloudc import context_decorator
-from gcloudc.db.backends.datastore import caching
+from gcloudc.db.backends.datastore import (
+    caching,
+    flushing,
+    stats,
+)
+from gcloudc.db.backends.datastore.allocation import get_id_allocator
 
 TRANSACTION_ENTITY_LIMIT = 500
 
@@ -32,19 +37,17 @@ class Transaction(object):
         self._datastore_transaction = datastore_transaction
         self._seen_keys = set()
 
-    def _generate_id(self):
+    def _generate_id(self, kind):
         """
             The Datastore API won't generate keys automatically until a
             transaction commits, that's too late!
 
-            This is a hack, it might be the only hack we can do :(
-
-            Note. Even though the Datastore can handle negative IDs (it's a signed
-            64 bit integer) the default allocate never does, and also, this breaks
-            Django URL regexes etc. So like the allocator we just do 32 bit ones.
+            So we hand out IDs which have been allocated (in blocks) by the
+            Datastore ahead of time, so they'll never clash with an ID it
+            generates itself.
         """
-        unsigned = uuid.uuid4().int & (1 << 32) - 1
-        return unsigned
+        client = self._connection.gclient
+        return get_id_allocator(client.project, kind, self._connection.namespace).next_id(client)
 
     def key(self, *args, **kwargs):
         """
@@ -86,6 +89,7 @@ class Transaction(object):
         putter(entity)
 
         assert entity.key
+        flushing.mark_written(self._connection, [entity.key.kind])
 
         self._seen_keys.add(entity.key)
 
@@ -227,6 +231,126 @@ class NoTransaction(Transaction):
         self._datastore_transaction = None
 
 
+class BatchTransaction(Transaction):
+    """
+        Buffers puts and deletes in memory, and then writes them in chunks
+        with put_multi/delete_multi when flush() is called. Gets of keys which
+        have been written in the batch return the buffered writes.
+
+        Queries don't see the buffered writes, so the unique values of the
+        entities put in the batch are tracked here (see perform_unique_checks).
+    """
+
+    def __init__(self, connection, parallel=False):
+        super().__init__(connection)
+        self._parallel = parallel
+        self._to_put = {}
+        self._to_delete = {}
+        self._unique_values = {}  # Unique values -> the key of the entity put with them
+        self._unique_values_by_key = {}
+
+    def _enter(self):
+        pass
+
+    def _exit(self):
+        self._to_put = {}
+        self._to_delete = {}
+        self._unique_values = {}
+        self._unique_values_by_key = {}
+
+    def is_buffered(self, key):
+        """
+            Returns True if the key has been written or deleted in the batch, so
+            what's stored for it is out of date
+        """
+        return key in self._to_put or key in self._to_delete
+
+    def conflicting_key(self, unique_values, key):
+        """
+            Returns the key of another entity put in the batch with the same
+            unique values, or None
+        """
+        other = self._unique_values.get(unique_values)
+        if other is not None and other != key and other in self._to_put:
+            return other
+        return None
+
+    def claim_unique_values(self, key, unique_values):
+        """
+            Records the unique values of the entity being put with key,
+            replacing any it was put with earlier in the batch
+        """
+        for values in self._unique_values_by_key.pop(key, []):
+            if self._unique_values.get(values) == key:
+                del self._unique_values[values]
+
+        for values in unique_values:
+            self._unique_values[values] = key
+        self._unique_values_by_key[key] = list(unique_values)
+
+    def get(self, key_or_keys, missing=None):
+        if not hasattr(key_or_keys, "__iter__") or isinstance(key_or_keys, str):
+            if key_or_keys in self._to_put:
+                return copy.deepcopy(self._to_put[key_or_keys])
+            elif key_or_keys in self._to_delete:
+                return None
+            return super().get(key_or_keys)
+
+        keys = list(key_or_keys)
+        to_fetch = [x for x in keys if x not in self._to_put and x not in self._to_delete]
+        fetched = {x.key: x for x in (super().get(to_fetch, missing=missing) if to_fetch else [])}
+
+        results = []
+        for key in keys:
+            if key in self._to_put:
+                results.append(copy.deepcopy(self._to_put[key]))
+            elif key in fetched:
+                results.append(fetched[key])
+        return results
+
+    def put(self, entity):
+        assert entity.key and not entity.key.is_partial
+
+        self._to_delete.pop(entity.key, None)
+        self._to_put[entity.key] = entity
+        flushing.mark_written(self._connection, [entity.key.kind])
+        self._seen_keys.add(entity.key)
+        return entity.key
+
+    def delete(self, key_or_keys):
+        keys = key_or_keys if hasattr(key_or_keys, "__iter__") else [key_or_keys]
+        for key in keys:
+            self._to_put.pop(key, None)
+            self._to_delete[key] = True
+
+    def flush(self):
+        """
+            Writes everything in the batch in chunks of TRANSACTION_ENTITY_LIMIT,
+            optionally in parallel
+        """
+        client = self._connection.gclient
+
+        def chunks(items):
+            return [items[i:i + TRANSACTION_ENTITY_LIMIT] for i in range(0, len(items), TRANSACTION_ENTITY_LIMIT)]
+
+        calls = [(client.put_multi, chunk) for chunk in chunks(list(self._to_put.values()))]
+        calls.extend((client.delete_multi, chunk) for chunk in chunks(list(self._to_delete)))
+
+        self._to_put = {}
+        self._to_delete = {}
+        self._unique_values = {}
+        self._unique_values_by_key = {}
+
+        if self._parallel and len(calls) > 1:
+            with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+                # Calling result() re-raises any exception from the RPC
+                for future in [executor.submit(func, chunk) for func, chunk in calls]:
+                    future.result()
+        else:
+            for func, chunk in calls:
+                func(chunk)
+
+
 _STORAGE = threading.local()
 
 
@@ -275,6 +399,10 @@ def current_transaction(using="default"):
         elif isinstance(txn, NormalTransaction):
             active_transaction = txn
             # Keep searching... there may be an independent or further transaction
+        elif isinstance(txn, BatchTransaction):
+            # Any transaction started inside the batch takes precedence
+            active_transaction = active_transaction or txn
+            break
         elif isinstance(txn, NoTransaction):
             # Bail immediately for non_atomic blocks. There is no transaction there.
             active_transaction = None
@@ -346,6 +474,9 @@ class AtomicDecorator(context_decorator.ContextDecorator):
             raise TransactionFailedError(
                 "You've specified that an outer transaction is mandatory, but one doesn't exist"
             )
+        elif isinstance(current_transaction(using), BatchTransaction):
+            # Writes are buffered by the batch, so there is no transaction to start
+            new_transaction = NestedTransaction(connection)
         else:
             new_transaction = NormalTransaction(connection)
 
@@ -354,6 +485,7 @@ class AtomicDecorator(context_decorator.ContextDecorator):
 
         if isinstance(new_transaction, (IndependentTransaction, NormalTransaction)):
             caching.get_context().stack.push()
+            stats.record_transaction()
 
         # We may have created a new transaction, we may not. current_transaction() returns
         # the actual active transaction (highest NormalTransaction or lowest IndependentTransaction)
@@ -381,6 +513,7 @@ class AtomicDecorator(context_decorator.ContextDecorator):
                                 connection.run_and_clear_commit_hooks()
 
                     except exceptions.GoogleCloudError:
+                        stats.record_transaction(failed=True)
                         raise TransactionFailedError()
         finally:
             if isinstance(transaction, (IndependentTransaction, NormalTransaction)):
@@ -422,8 +555,7 @@ class NonAtomicDecorator(AtomicDecorator):
         connection = connection.connection
         assert(connection)
 
-        # For non_atomic blocks we pass a Batch as the transaction
-        new_transaction = NoTransaction(connection.gclient.batch())
+        new_transaction = NoTransaction(connection)
 
         _STORAGE.transaction_stack.setdefault(using, []).append(new_transaction)
         _STORAGE.transaction_stack[using][-1].enter()
@@ -453,3 +585,77 @@ class NonAtomicDecorator(AtomicDecorator):
 
 
 non_atomic = NonAtomicDecorator
+
+
+class BatchDecorator(context_decorator.ContextDecorator):
+    """
+        Buffers the puts and deletes made inside the block, and writes them
+        in chunks when the block exits. If an exception is raised nothing is written.
+
+        atomic() blocks inside the batch don't start transactions (their writes
+        are buffered too) unless they are independent. A batch inside an atomic block
+        does nothing, as the transaction already batches the writes. Anything written in
+        the batch can be read back by key, but queries (including counts) only see what
+        was stored before the batch, so they won't return buffered writes and will
+        still return instances deleted in the batch until it has been written.
+
+        Unique constraints are checked against both what's stored and what has been
+        put in the batch.
+    """
+
+    VALID_ARGUMENTS = ("using", "parallel")
+
+    @classmethod
+    def _do_enter(cls, state, decorator_args):
+        _init_storage()
+
+        state.using = using = decorator_args.get("using") or "default"
+        parallel = bool(decorator_args.get("parallel"))
+
+        connection = connections[using]
+
+        # Connect if necessary (mainly in tests)
+        if not connection.connection:
+            connection.connect()
+
+        connection = connection.connection
+        assert(connection)
+
+        if current_transaction(using):
+            new_transaction = NestedTransaction(connection)
+        else:
+            new_transaction = BatchTransaction(connection, parallel=parallel)
+            caching.get_context().stack.push()
+
+        _STORAGE.transaction_stack.setdefault(using, []).append(new_transaction)
+        _STORAGE.transaction_stack[using][-1].enter()
+
+        return current_transaction(using)
+
+    @classmethod
+    def _do_exit(cls, state, decorator_args, exception):
+        _init_storage()
+
+        transaction = _STORAGE.transaction_stack[state.using].pop()
+
+        if not isinstance(transaction, BatchTransaction):
+            transaction.exit()
+            return
+
+        context = caching.get_context()
+        try:
+            if not exception:
+                transaction.flush()
+        except Exception:
+            exception = True
+            raise
+        finally:
+            if exception:
+                context.stack.pop(discard=True)
+            else:
+                context.stack.pop(apply_staged=True, clear_staged=True)
+
+            transaction.exit()
+
+
+batch = BatchDecorator
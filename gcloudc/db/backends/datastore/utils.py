@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from datetime import datetime
 from decimal import Decimal
 from itertools import chain
@@ -12,7 +13,10 @@ from google.cloud.datastore.key import Key
 
 from gcloudc.utils import memoized
 
-from .query_utils import get_filter
+from .query_utils import (
+    get_filter,
+    key_sort_value,
+)
 
 try:
     from django.db.models.expressions import BaseExpression
@@ -147,6 +151,11 @@ def has_concrete_parents(model):
     return get_concrete_parents(model) != [model]
 
 
+@memoized
+def has_concrete_children(model):
+    return any(model in get_concrete_parents(x, ignore_leaf=True) for x in apps.get_models())
+
+
 @memoized
 def get_field_from_column(model, column):
     for field in model._meta.fields:
@@ -155,129 +164,179 @@ def get_field_from_column(model, column):
     return None
 
 
-def django_instance_to_entities(connection, fields, raw, instance, check_null=True, model=None):
+class EntitySerializer(object):
     """
-        Converts a Django Model instance to an App Engine `Entity`
-
-        Arguments:
-            connection: Djangae appengine connection object
-            fields: A list of fields to populate in the Entity
-            raw: raw flag to pass to get_prepared_db_value
-            instance: The Django model instance to convert
-            check_null: Whether or not we should enforce NULL during conversion
-            (throws an error if None is set on a non-nullable field)
-            model: Model class to use instead of the instance one
-
-        Returns:
-            entity, [entity, entity, ...]
+        Converts instances of a model to entities for a fixed list of fields.
 
-       Where the first result in the tuple is the primary entity, and the
-       remaining entities are optionally descendents of the primary entity. This
-       is useful for special indexes (e.g. contains)
+        Everything which only depends on the model and the fields (the kind, which
+        fields form the key, the special indexers, the unindexed columns and the
+        polymodel classes) is worked out once on construction, so that converting each
+        instance only has to deal with the values. Use get_entity_serializer() rather
+        than instantiating this directly so that serializers are shared.
     """
 
-    from gcloudc.db.backends.datastore.indexing import special_indexes_for_column, get_indexer, IgnoreForIndexing
-    from gcloudc.db.backends.datastore import POLYMODEL_CLASS_ATTRIBUTE
+    def __init__(self, connection, model, fields):
+        from gcloudc.db.backends.datastore.indexing import special_indexes_for_model, get_indexer
+
+        self.model = model
+        self.inheritance_root = get_top_concrete_parent(model)
+        self.kind = get_datastore_kind(self.inheritance_root)
+
+        special_indexes = special_indexes_for_model(model)
+
+        def group_indexers(field):
+            # Indexes which share an indexer are prepared together, so the indexer
+            # can share any work between them
+            indexers = OrderedDict()
+            for index in special_indexes.get(field.column, []):
+                indexers.setdefault(get_indexer(field, index), []).append(index)
+            return tuple((indexer, tuple(indexes)) for indexer, indexes in indexers.items())
+
+        # A list of (field, is_primary_key, [(indexer, (index, ...)), ...])
+        self.columns = tuple(
+            (
+                field,
+                field.primary_key and field.model == self.inheritance_root,
+                group_indexers(field),
+            )
+            for field in fields
+        )
 
-    model = model or type(instance)
-    inheritance_root = get_top_concrete_parent(model)
+        self.exclude_from_indexes = tuple(
+            field.column for field in model._meta.fields
+            if field.db_type(connection) in ('text', 'bytes')
+        )
 
-    db_table = get_datastore_kind(inheritance_root)
+        classes = get_concrete_db_tables(model)
+        self.polymodel_classes = tuple(set(classes)) if len(classes) > 1 else ()
 
-    def value_from_instance(_instance, _field):
-        value = get_prepared_db_value(connection, _instance, _field, raw)
+    def to_entities(self, connection, raw, instance, check_null=True):
+        from gcloudc.db.backends.datastore import POLYMODEL_CLASS_ATTRIBUTE
 
-        # If value is None, but there is a default, and the field is not nullable then we should populate it
-        # Otherwise thing get hairy when you add new fields to models
-        if value is None and _field.has_default() and not _field.null:
-            # We need to pass the default through get_db_prep_save to properly do the conversion
-            # this is how
-            value = _field.get_db_prep_save(_field.get_default(), connection)
+        model = self.model
 
-        if check_null and (not _field.null and not _field.primary_key) and value is None:
-            raise IntegrityError("You can't set %s (a non-nullable field) to None!" % _field.name)
+        field_values = {}
+        primary_key = None
 
-        is_primary_key = False
-        if _field.primary_key and _field.model == inheritance_root:
-            is_primary_key = True
+        descendents = []
+        fields_to_unindex = set()
 
-        return value, is_primary_key
+        for field, is_primary_key, indexers in self.columns:
+            value = get_prepared_db_value(connection, instance, field, raw)
 
-    field_values = {}
-    primary_key = None
+            # If value is None, but there is a default, and the field is not nullable then we should populate it
+            # Otherwise thing get hairy when you add new fields to models
+            if value is None and field.has_default() and not field.null:
+                # We need to pass the default through get_db_prep_save to properly do the conversion
+                # this is how
+                value = field.get_db_prep_save(field.get_default(), connection)
 
-    descendents = []
-    fields_to_unindex = set()
+            if check_null and (not field.null and not field.primary_key) and value is None:
+                raise IntegrityError("You can't set %s (a non-nullable field) to None!" % field.name)
 
-    for field in fields:
-        value, is_primary_key = value_from_instance(instance, field)
-        if is_primary_key:
-            primary_key = value
-        else:
-            field_values[field.column] = value
-
-        # Add special indexed fields
-        for index in special_indexes_for_column(model, field.column):
-            indexer = get_indexer(field, index)
-
-            unindex = False
-            try:
-                values = indexer.prep_value_for_database(
-                    value, index, model=model, column=field.column, connection=connection
-                )
-            except IgnoreForIndexing as e:
-                # We mark this value as being wiped out for indexing
-                unindex = True
-                values = e.processed_value
-
-            if not hasattr(values, "__iter__") or isinstance(values, (bytes, str)):
-                values = [values]
-
-            # If the indexer returns additional entities (instead of indexing a special column)
-            # then just store those entities
-            if indexer.PREP_VALUE_RETURNS_ENTITIES:
-                descendents.extend(values)
+            if is_primary_key:
+                primary_key = value
             else:
-                for i, v in enumerate(values):
-                    column = indexer.indexed_column_name(field.column, v, index)
-
-                    if unindex:
-                        fields_to_unindex.add(column)
-                        continue
-
-                    # If the column already exists in the values, then we convert it to a
-                    # list and append the new value
-                    if column in field_values:
-                        if not isinstance(field_values[column], list):
-                            field_values[column] = [field_values[column], v]
-                        else:
-                            field_values[column].append(v)
+                field_values[field.column] = value
+
+            # Add special indexed fields, unindex is True if the value is being
+            # wiped out for indexing
+            for indexer, indexes in indexers:
+                for index, values, unindex in indexer.prep_values_for_database(
+                    value, indexes, model=model, column=field.column, connection=connection
+                ):
+                    if not hasattr(values, "__iter__") or isinstance(values, (bytes, str)):
+                        values = [values]
+
+                    # If the indexer returns additional entities (instead of indexing a special column)
+                    # then just store those entities
+                    if indexer.PREP_VALUE_RETURNS_ENTITIES:
+                        descendents.extend(values)
                     else:
-                        # Otherwise we just set the column to the value
-                        field_values[column] = v
+                        for i, v in enumerate(values):
+                            column = indexer.indexed_column_name(field.column, v, index)
+
+                            if unindex:
+                                fields_to_unindex.add(column)
+                                continue
+
+                            # If the column already exists in the values, then we convert it to a
+                            # list and append the new value
+                            if column in field_values:
+                                if not isinstance(field_values[column], list):
+                                    field_values[column] = [field_values[column], v]
+                                else:
+                                    field_values[column].append(v)
+                            else:
+                                # Otherwise we just set the column to the value
+                                field_values[column] = v
+
+        args = [self.kind]
+        if primary_key is not None:
+            args.append(primary_key)
+
+        key = Key(*args, namespace=connection.namespace, project=connection.gcloud_project)
+
+        entity = Entity(key, self.exclude_from_indexes)
+        entity.update(field_values)
+
+        if fields_to_unindex:
+            entity._properties_to_remove = fields_to_unindex
+
+        if self.polymodel_classes:
+            # Always a new list, as this is manipulated when deleting polymodels
+            entity[POLYMODEL_CLASS_ATTRIBUTE] = list(self.polymodel_classes)
+
+        return entity, descendents
+
+
+_entity_serializers = {}
+
+
+def get_entity_serializer(connection, model, fields):
+    """
+        Returns the (cached) EntitySerializer for the model and fields
+    """
+    cache_key = (connection.alias, model, tuple(fields))
+
+    serializer = _entity_serializers.get(cache_key)
+    if serializer is None:
+        serializer = _entity_serializers[cache_key] = EntitySerializer(connection, model, fields)
+    return serializer
+
 
-    args = [db_table]
-    if primary_key is not None:
-        args.append(primary_key)
+def clear_entity_serializers():
+    """
+        Serializers hold onto the special indexers for each field, so they must
+        be thrown away whenever the special indexes change
+    """
+    _entity_serializers.clear()
 
-    key = Key(*args, namespace=connection.namespace, project=connection.gcloud_project)
 
-    exclude_from_indexes = tuple(
-        field.column for field in model._meta.fields
-        if field.db_type(connection) in ('text', 'bytes')
-    )
+def django_instance_to_entities(connection, fields, raw, instance, check_null=True, model=None):
+    """
+        Converts a Django Model instance to an App Engine `Entity`
 
-    entity = Entity(key, exclude_from_indexes)
-    entity.update(field_values)
+        Arguments:
+            connection: Djangae appengine connection object
+            fields: A list of fields to populate in the Entity
+            raw: raw flag to pass to get_prepared_db_value
+            instance: The Django model instance to convert
+            check_null: Whether or not we should enforce NULL during conversion
+            (throws an error if None is set on a non-nullable field)
+            model: Model class to use instead of the instance one
 
-    if fields_to_unindex:
-        entity._properties_to_remove = fields_to_unindex
+        Returns:
+            entity, [entity, entity, ...]
 
-    classes = get_concrete_db_tables(model)
-    if len(classes) > 1:
-        entity[POLYMODEL_CLASS_ATTRIBUTE] = list(set(classes))
+       Where the first result in the tuple is the primary entity, and the
+       remaining entities are optionally descendents of the primary entity. This
+       is useful for special indexes (e.g. contains)
+    """
 
-    return entity, descendents
+    model = model or type(instance)
+    serializer = get_entity_serializer(connection, model, fields)
+    return serializer.to_entities(connection, raw, instance, check_null=check_null)
 
 
 def get_datastore_key(connection, model, pk):
@@ -364,33 +423,69 @@ def lte(x, y):
     return not gt(x, y)
 
 
-def django_ordering_comparison(ordering, lhs, rhs):
-    if not ordering:
-        return -1  # Really doesn't matter
+class _Descending(object):
+    """
+        Wraps a sort value so that it compares in reverse, this lets us
+        build a single sort key tuple for orderings with mixed directions
+    """
 
-    ASCENDING = 1
-    DESCENDING = 2
+    __slots__ = ("value",)
 
-    for order in ordering:
-        direction = DESCENDING if order.startswith("-") else ASCENDING
-        order = order.lstrip("-")
+    def __init__(self, value):
+        self.value = value
 
-        if lhs is not None:
-            lhs_value = lhs.key if order == "__key__" else lhs.get(order)
-        else:
-            lhs_value = None
+    def __eq__(self, other):
+        return self.value == other.value
 
-        if rhs is not None:
-            rhs_value = rhs.key if order == "__key__" else rhs.get(order)
-        else:
-            rhs_value = None
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _ordering_sort_value(value, descending):
+    """
+        Converts a property value into something which sorts in the same
+        way as the null-friendly lt/gt functions above
+    """
+    if isinstance(value, list):
+        # The Datastore orders list properties by the smallest value when ascending
+        # and the largest value when descending
+        value = [x for x in value if x is not None]
+        value = (max(value) if descending else min(value)) if value else None
+
+    if value is None:
+        return (0,)
+    elif isinstance(value, Key):
+        return (1, key_sort_value(value))
+    else:
+        return (1, value)
+
+
+def django_ordering_sort_key(ordering):
+    """
+        Returns a function suitable for passing as the key to sorted() which will
+        order entities by the given Django-style ordering (e.g. ["-field", "__key__"]).
+
+        The ordering is parsed once, and a comparable tuple is built once per entity
+        which is far cheaper than comparing the entities pairwise when sorting
+        large resultsets.
+    """
+
+    columns = tuple((order.lstrip("-"), order.startswith("-")) for order in ordering or [])
+
+    def sort_key(entity):
+        result = []
+        for column, descending in columns:
+            if entity is None:
+                value = None
+            else:
+                value = entity.key if column == "__key__" else entity.get(column)
+
+            value = _ordering_sort_value(value, descending)
+            result.append(_Descending(value) if descending else value)
 
-        if direction == ASCENDING and lhs_value != rhs_value:
-            return -1 if lt(lhs_value, rhs_value) else 1
-        elif direction == DESCENDING and lhs_value != rhs_value:
-            return 1 if lt(lhs_value, rhs_value) else -1
+        return tuple(result)
 
-    return 0
+    return sort_key
 
 
 def entity_matches_query(entity, query):
@@ -0,0 +1,92 @@
+"""
+    Middleware which summarises the Datastore work done by each request: the
+    RPCs made (by type), entities read and written, time spent waiting on the
+    Datastore, context cache hits and misses, multi-query fan-out and
+    transactions.
+
+    When DEBUG is True (or GCLOUDC_PERFORMANCE_HEADERS is True) the summary
+    is added to the response headers, otherwise it's logged with the summary
+    as structured data (extra={"datastore": ...}). Requests which go over any
+    of the GCLOUDC_PERFORMANCE_THRESHOLDS are logged as warnings, which makes
+    N+1 query patterns easy to spot.
+"""
+
+import logging
+
+from django.conf import settings
+
+from gcloudc.db.backends.datastore import stats
+
+logger = logging.getLogger(__name__)
+
+# None means the headers follow the DEBUG setting
+PERFORMANCE_HEADERS = getattr(settings, "GCLOUDC_PERFORMANCE_HEADERS", None)
+
+# Maps the names of stats (see RequestStats.as_dict) to the most a request
+# should use before it's flagged. datastore_time is in seconds.
+DEFAULT_PERFORMANCE_THRESHOLDS = {
+    "rpcs": 100,
+    "entities_read": 1000,
+    "entities_written": 500,
+    "datastore_time": 1.0,
+    "max_fan_out": 30,
+}
+PERFORMANCE_THRESHOLDS = getattr(settings, "GCLOUDC_PERFORMANCE_THRESHOLDS", DEFAULT_PERFORMANCE_THRESHOLDS)
+
+
+def flagged_stats(summary, thresholds=None):
+    """
+        Returns the names of the stats in the summary which are over their threshold
+    """
+    thresholds = PERFORMANCE_THRESHOLDS if thresholds is None else thresholds
+    return sorted(
+        name for name, threshold in thresholds.items()
+        if threshold is not None and summary.get(name, 0) > threshold
+    )
+
+
+def _header_value(summary):
+    return "; ".join(
+        "{}={}".format(name, round(value, 4) if isinstance(value, float) else value)
+        for name, value in summary.items() if name != "rpcs_by_operation"
+    )
+
+
+class DatastorePerformanceMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with stats.collect() as request_stats:
+            response = self.get_response(request)
+
+        summary = request_stats.as_dict()
+        flagged = flagged_stats(summary)
+
+        headers = settings.DEBUG if PERFORMANCE_HEADERS is None else PERFORMANCE_HEADERS
+        if headers:
+            response["X-Datastore-Stats"] = _header_value(summary)
+            response["X-Datastore-RPCs"] = ", ".join(
+                "{}={}".format(k, v) for k, v in sorted(summary["rpcs_by_operation"].items())
+            )
+            if flagged:
+                response["X-Datastore-Flagged"] = ", ".join(flagged)
+
+        extra = {"datastore": summary, "path": request.path, "method": request.method}
+        if flagged:
+            logger.warning(
+                "%s %s went over the Datastore thresholds for %s: %s RPCs, %s entities read, "
+                "%s entities written in %.1fms",
+                request.method, request.path, ", ".join(flagged), summary["rpcs"],
+                summary["entities_read"], summary["entities_written"], summary["datastore_time"] * 1000,
+                extra=dict(extra, flagged=flagged),
+            )
+        elif not headers:
+            logger.info(
+                "%s %s made %s Datastore RPCs, %s entities read, %s entities written in %.1fms",
+                request.method, request.path, summary["rpcs"],
+                summary["entities_read"], summary["entities_written"], summary["datastore_time"] * 1000,
+                extra=extra,
+            )
+
+        return response
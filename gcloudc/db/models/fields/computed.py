@@ -1,8 +1,15 @@
 # encoding: utf-8
+import hashlib
 import logging
+import marshal
 import os
+import sys
+import tempfile
+import threading
 import zipfile
+from functools import lru_cache
 
+from django.conf import settings
 from django.db import models
 
 from .charfields import CharField
@@ -12,6 +19,24 @@ from .charfields import CharField
 COLLATION_FILE = "allkeys-5.2.0.txt"
 COLLATION_ZIP_FILE = os.path.join(os.path.dirname(__file__), "allkeys-5.2.0.zip")
 
+# The parsed collation table. This isn't shipped (the marshal format is specific to the Python
+# version), build it as part of a deployment with the build_collation_cache management command.
+# Otherwise it's built on first use and written to the user's cache directory, as the filesystem
+# the package is installed on may be read-only.
+COLLATION_CACHE_FILE = getattr(
+    settings, "GCLOUDC_COLLATION_CACHE_FILE", os.path.join(os.path.dirname(__file__), "allkeys-5.2.0.marshal")
+)
+COLLATION_USER_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "gcloudc",
+    "allkeys-5.2.0.marshal",
+)
+
+# Bump this if the format of the cache file changes
+COLLATION_CACHE_VERSION = 2
+
+SORT_KEY_CACHE_SIZE = getattr(settings, "GCLOUDC_COLLATION_SORT_KEY_CACHE_SIZE", 1024)
+
 logger = logging.getLogger(__file__)
 
 
@@ -21,9 +46,12 @@ class ZipLoaderMixin(object):
         so it compresses easily. We ship the file zipped up and then decompress
         it on the fly here to save on storage, data transfer, memory etc.
         The use of generators on load should be efficient.
+
+        Parsing the file is slow though, so the parsed table is cached
+        in a (much faster to load) marshalled file after the first load.
     """
 
-    def __init__(self, zip_filename, text_filename):
+    def __init__(self, zip_filename, text_filename, cache_filenames=None):
         """
             The BaseCollator class __init__ takes a filename and calls
             load(filename). Here we pass up the text filename but store the
@@ -31,11 +59,17 @@ class ZipLoaderMixin(object):
             of a filesystem.
         """
         self.zip_filename = zip_filename
+        self.cache_filenames = cache_filenames or []
+        self._zip_hash = None
         super(ZipLoaderMixin, self).__init__(filename=text_filename)
 
-    def load(self, filename):
+    def parse(self, filename):
+        """
+            Returns the (char_list, coll_elements) entries of the collation table
+        """
         from pyuca.collator import COLL_ELEMENT_PATTERN, hexstrings2int  # pyuca is required for ComputedCollationField
 
+        entries = []
         with zipfile.ZipFile(self.zip_filename) as z:
             with z.open(filename) as f:
                 for line in f.readlines():
@@ -46,12 +80,130 @@ class ZipLoaderMixin(object):
                         continue
 
                     a, b = line.split(";", 1)
-                    char_list = hexstrings2int(a.split())
+                    char_list = tuple(hexstrings2int(a.split()))
                     coll_elements = []
                     for x in COLL_ELEMENT_PATTERN.finditer(b.strip()):
                         weights = x.groups()
-                        coll_elements.append(hexstrings2int(weights))
-                    self.table.add(char_list, coll_elements)
+                        coll_elements.append(tuple(hexstrings2int(weights)))
+                    entries.append((char_list, tuple(coll_elements)))
+        return tuple(entries)
+
+    @property
+    def zip_hash(self):
+        if self._zip_hash is None:
+            with open(self.zip_filename, "rb") as f:
+                self._zip_hash = hashlib.sha256(f.read()).hexdigest()
+        return self._zip_hash
+
+    def _cache_header(self, filename, data):
+        """
+            The first line of a cache file, which identifies the source it was parsed from,
+            the Python version it was marshalled by and the hash of the data which follows it
+        """
+        return "{} {}.{} {} {} {}\n".format(
+            COLLATION_CACHE_VERSION,
+            sys.version_info[0],
+            sys.version_info[1],
+            filename,
+            self.zip_hash,
+            hashlib.sha256(data).hexdigest(),
+        ).encode("utf-8")
+
+    def read_cache(self, filename):
+        for cache_filename in self.cache_filenames:
+            try:
+                with open(cache_filename, "rb") as f:
+                    header = f.readline()
+                    data = f.read()
+            except (IOError, OSError):
+                continue
+
+            # The data is only unmarshalled if it was parsed from this zip file, and it's intact
+            if header != self._cache_header(filename, data):
+                continue
+
+            try:
+                return marshal.loads(data)
+            except (EOFError, ValueError, TypeError):
+                continue
+
+    def write_cache(self, filename, entries, cache_filename):
+        # Write to a temporary file and move it into place, so that
+        # another process never reads a partially written cache
+        try:
+            directory = os.path.dirname(os.path.abspath(cache_filename))
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+            data = marshal.dumps(entries)
+            fd, temp_filename = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._cache_header(filename, data))
+                f.write(data)
+            os.replace(temp_filename, cache_filename)
+        except (IOError, OSError):
+            logger.warning("Unable to write the collation cache to %s", cache_filename)
+            return False
+        return True
+
+    def load(self, filename):
+        entries = self.read_cache(filename)
+        if entries is None:
+            entries = self.parse(filename)
+            if self.cache_filenames:
+                self.write_cache(filename, entries, self.cache_filenames[-1])
+
+        for char_list, coll_elements in entries:
+            self.table.add(char_list, coll_elements)
+
+
+def _collator_class():
+    from pyuca.collator import Collator_5_2_0
+
+    class Collator(ZipLoaderMixin, Collator_5_2_0):
+        pass
+
+    return Collator
+
+
+def build_collation_cache(cache_filename=COLLATION_CACHE_FILE):
+    """
+        Parses the collation table and writes it to cache_filename. Run this as part of a
+        deployment (see the build_collation_cache command) so that instances don't need to
+        parse the table at all. Returns False if the file couldn't be written.
+    """
+    collator = _collator_class()(COLLATION_ZIP_FILE, COLLATION_FILE)
+    return collator.write_cache(COLLATION_FILE, collator.parse(COLLATION_FILE), cache_filename)
+
+
+_collator_lock = threading.Lock()
+
+
+def get_collator():
+    """
+        Returns the shared Collator, loading the collation table on first use
+    """
+    if ComputedCollationField.collator is None:
+        with _collator_lock:
+            if ComputedCollationField.collator is None:
+                ComputedCollationField.collator = _collator_class()(
+                    COLLATION_ZIP_FILE,
+                    COLLATION_FILE,
+                    cache_filenames=[COLLATION_CACHE_FILE, COLLATION_USER_CACHE_FILE],
+                )
+    return ComputedCollationField.collator
+
+
+@lru_cache(maxsize=SORT_KEY_CACHE_SIZE)
+def collation_sort_key(value):
+    """
+        Returns the (truncated) sort key for the string, and whether it was truncated
+    """
+    sort_key = u"".join([chr(x) for x in get_collator().sort_key(value)])
+
+    # We ignore unrecognized chars as the truncation might
+    # have split a unicode char down the middle
+    truncated_key = sort_key.encode("utf-8")[:1500].decode("utf-8", "ignore")
+    return truncated_key, truncated_key != sort_key
 
 
 class ComputedFieldMixin:
@@ -125,30 +277,15 @@ class ComputedCollationField(ComputedFieldMixin, CharField):
 
     def __init__(self, source_field_name):
         import pyuca  # noqa: F401 Required dependency for ComputedCollationField
-        from pyuca.collator import Collator_5_2_0
-
-        # Instantiate Collator once only to save on memory / processing
-        if not ComputedCollationField.collator:
-
-            class Collator(ZipLoaderMixin, Collator_5_2_0):
-                pass
-
-            ComputedCollationField.collator = Collator(COLLATION_ZIP_FILE, COLLATION_FILE)
 
-        def truncate(unicode_str):
-            encoded = unicode_str.encode("utf-8")[:1500]
-            # We ignore unrecognized chars as the truncation might
-            # have split a unicode char down the middle
-            return encoded.decode("utf-8", "ignore")
+        # The Collator is shared, and isn't loaded until the first sort key is calculated
 
         def computer(instance):
             source_value = getattr(instance, source_field_name) or u""
             if not isinstance(source_value, str):
                 source_value = str(source_value, "utf-8")
-            sort_key = self.collator.sort_key(source_value)
-            sort_key = u"".join([chr(x) for x in sort_key])
-            truncated_key = truncate(sort_key)
-            if truncated_key != sort_key:
+            truncated_key, truncated = collation_sort_key(source_value)
+            if truncated:
                 logger.warn("Truncated sort key for '%s.%s'", instance._meta.db_table, source_field_name)
             return truncated_key
 
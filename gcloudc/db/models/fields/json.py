@@ -16,8 +16,10 @@ from __future__ import absolute_import
 
 import json
 from collections import OrderedDict
+from importlib import import_module
 
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
 from django.conf import settings
 from django.utils import six
 from django.core.serializers.json import DjangoJSONEncoder
@@ -32,7 +34,29 @@ def dumps(value):
     return DjangoJSONEncoder().encode(value)
 
 
+_codec = None
+
+
+def _get_codec():
+    """
+        Returns the module used to decode JSON when we don't need an object_pairs_hook,
+        this can be set to a faster drop-in replacement for the json module
+        (e.g. "ujson" or "orjson") with the GCLOUDC_JSONFIELD_CODEC setting
+    """
+    global _codec
+
+    if _codec is None:
+        codec = getattr(settings, "GCLOUDC_JSONFIELD_CODEC", None)
+        _codec = import_module(codec) if codec else json
+    return _codec
+
+
 def loads(txt, object_pairs_hook=None):
+    if object_pairs_hook is None:
+        codec = _get_codec()
+        if codec is not json:
+            return codec.loads(txt)
+
     value = json.loads(txt, encoding=settings.DEFAULT_CHARSET, object_pairs_hook=object_pairs_hook)
     return value
 
@@ -74,6 +98,40 @@ class JSONOrderedDict(OrderedDict):
         return dumps(self)
 
 
+class RawJSON(object):
+    """
+        The undecoded value of a lazy JSONField, as it was loaded from the database
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class LazyJSONDescriptor(DeferredAttribute):
+    """
+        Stores the raw JSON string loaded from the database on the instance, and only
+        decodes it when the attribute is first accessed
+    """
+
+    def __init__(self, field):
+        super(LazyJSONDescriptor, self).__init__(field.attname)
+        self.field = field
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+
+        value = super(LazyJSONDescriptor, self).__get__(instance, cls)
+        if isinstance(value, RawJSON):
+            value = instance.__dict__[self.field_name] = self.field.parse_json(value.value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field_name] = value
+
+
 class JSONKeyLookup(models.Lookup):
     lookup_name = "json_path"
     operator = "json_path"
@@ -96,7 +154,7 @@ class JSONField(models.TextField):
     """JSONField is a generic textfield that neatly serializes/unserializes
     JSON objects seamlessly.  Main thingy must be a dict object."""
 
-    def __init__(self, use_ordered_dict=False, *args, **kwargs):
+    def __init__(self, use_ordered_dict=False, lazy=False, *args, **kwargs):
         if "default" in kwargs:
             if not callable(kwargs["default"]):
                 raise TypeError("'default' must be a callable (e.g. 'dict' or 'list')")
@@ -106,8 +164,16 @@ class JSONField(models.TextField):
         # use `collections.OrderedDict` rather than built-in `dict`
         self.use_ordered_dict = use_ordered_dict
 
+        # only decode the value loaded from the database when the attribute is accessed
+        self.lazy = lazy
+
         models.TextField.__init__(self, *args, **kwargs)
 
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(JSONField, self).contribute_to_class(cls, name, *args, **kwargs)
+        if self.lazy:
+            setattr(cls, self.attname, LazyJSONDescriptor(self))
+
     def parse_json(self, value):
         """Convert our string value to JSON after we load it from the DB"""
         if value is None or value == "":
@@ -138,8 +204,28 @@ class JSONField(models.TextField):
         return self.parse_json(value)
 
     def from_db_value(self, value, expression, connection, context):
+        if self.lazy and isinstance(value, six.string_types):
+            return RawJSON(value)
         return self.parse_json(value)
 
+    def decode_raw_value(self, value, expression, connection):
+        """
+            Decodes a value left undecoded by from_db_value. This is added to the converters
+            of values() and values_list() queries, which don't create instances for the
+            LazyJSONDescriptor to decode the value on
+        """
+        if isinstance(value, RawJSON):
+            return self.parse_json(value.value)
+        return value
+
+    def pre_save(self, model_instance, add):
+        if self.lazy:
+            # Don't decode a value that has never been accessed just to encode it again
+            value = model_instance.__dict__.get(self.attname)
+            if isinstance(value, RawJSON):
+                return value
+        return super(JSONField, self).pre_save(model_instance, add)
+
     def value_to_string(self, obj):
         value = self.value_from_object(obj)
 
@@ -153,6 +239,11 @@ class JSONField(models.TextField):
         if value is None and self.null:
             return None
 
+        if isinstance(value, RawJSON):
+            # The value is unchanged since it was loaded, so there's nothing to encode (or
+            # decode, which TextField.get_prep_value would do by calling to_python)
+            return value.value
+
         return super(JSONField, self).get_db_prep_save(dumps(value), connection=connection)
 
     def south_field_triple(self):
@@ -169,6 +260,8 @@ class JSONField(models.TextField):
         name, path, args, kwargs = super(JSONField, self).deconstruct()
         if self.default == {}:
             del kwargs["default"]
+        if self.lazy:
+            kwargs["lazy"] = True
         return name, path, args, kwargs
 
     def formfield(self, **kwargs):
@@ -207,9 +300,88 @@ class JSONField(models.TextField):
         return LookupBuilder
 
 
+def _parse_json_path(index):
+    """
+        Returns the path of sections to look up for a json_path index, and whether
+        the index is an isnull lookup
+    """
+    index_part = index.split("__", 1)[1]
+    path = index_part.split("__")
+
+    is_isnull = False
+    # Ignore isnull on the end of a path, it's not a value lookup
+    if len(path) > 1 and path[-1] == "isnull":
+        is_isnull = True
+        path.pop()
+
+    sections = []
+    for section in path:
+        try:
+            section = int(section)
+        except (TypeError, ValueError):
+            pass
+        sections.append(section)
+
+    return sections, is_isnull
+
+
+class JSONPathTrie(object):
+    """
+        The json_path indexes of a field, arranged by their path sections so that
+        the values for all of them can be found in a single pass over the document
+    """
+
+    def __init__(self):
+        self.children = OrderedDict()
+
+        # The (index, is_isnull) of the indexes whose path ends here
+        self.indexes = []
+
+        # The indexes whose path ends here, or anywhere below here
+        self.all_indexes = []
+
+    @classmethod
+    def build(cls, indexes):
+        root = cls()
+        for index in indexes:
+            sections, is_isnull = _parse_json_path(index)
+
+            node = root
+            for section in sections:
+                node.all_indexes.append(index)
+                node = node.children.setdefault(section, cls())
+
+            node.all_indexes.append(index)
+            node.indexes.append((index, is_isnull))
+        return root
+
+    def resolve(self, value):
+        """
+            Yields (index, value, found) for every index in the trie, found is
+            False if the path doesn't exist in the document
+        """
+        for index, is_isnull in self.indexes:
+            yield index, (value is None) if is_isnull else value, True
+
+        for section, child in self.children.items():
+            try:
+                child_value = value[section]
+            except (KeyError, IndexError, TypeError):
+                for index in child.all_indexes:
+                    yield index, None, False
+                continue
+
+            for result in child.resolve(child_value):
+                yield result
+
+
 class JSONKeyLookupIndexer(Indexer):
     OPERATOR = "json_path"
 
+    def __init__(self):
+        # Tries for each of the combinations of indexes we've been asked to prepare
+        self._tries = {}
+
     def handles(self, field, operator):
         from gcloudc.db.models.fields.json import JSONField
 
@@ -226,37 +398,30 @@ class JSONKeyLookupIndexer(Indexer):
         return "exact"
 
     def prep_value_for_database(self, value, index, **kwargs):
+        for _, values, unindex in self.prep_values_for_database(value, (index,), **kwargs):
+            if unindex:
+                raise IgnoreForIndexing(values)
+            return values
+
+    def prep_values_for_database(self, value, indexes, **kwargs):
+        """
+            Decodes the document once, and looks up the values for all of the
+            indexes in a single pass over it
+        """
+        trie = self._tries.get(indexes)
+        if trie is None:
+            trie = self._tries[indexes] = JSONPathTrie.build(indexes)
+
         if isinstance(value, six.string_types):
             value = json.loads(value)
 
-        index_part = index.split("__", 1)[1]
-        path = index_part.split("__")
-
-        is_isnull = False
-        # Ignore isnull on the end of a path, it's not a value lookup
-        if len(path) > 1 and path[-1] == "isnull":
-            is_isnull = True
-            path.pop()
-
-        # Go through the path and look up the value from each
-        # dictionary/list if we fail to find a value we raise
-        # a IgnoreForIndexing exception which tells the special indexer
-        # to not save *anything*
-        for i, section in enumerate(path):
-            try:
-                section = int(section)
-            except (TypeError, ValueError):
-                pass
-
-            try:
-                value = value[section]
-            except (KeyError, IndexError, TypeError):
-                raise IgnoreForIndexing("")
-
-        if is_isnull:
-            return value is None
-
-        return value
+        # If we fail to find a value for the path we unindex it, which tells
+        # the special indexer to not save *anything*
+        for index, index_value, found in trie.resolve(value):
+            if found:
+                yield index, index_value, False
+            else:
+                yield index, "", True
 
     def indexed_column_name(self, field_column, value, index):
         return "_idx_json_path_{}_{}".format(field_column, index.split("__", 1)[-1])
@@ -6,6 +6,7 @@ import copy
 from django import forms
 from django.db import router, models
 from django.db.models.query import QuerySet
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE
 from django.db.models.fields.related import ForeignObject, ForeignObjectRel
 from django.utils.functional import cached_property
 from django.core.exceptions import ImproperlyConfigured, ValidationError
@@ -48,10 +49,10 @@ class RelatedIteratorRel(ForeignObjectRel):
 
 
 class OrderedQuerySet(QuerySet):
-    def _fetch_all(self):
+    def _fetch_window(self, pks):
         """
-            Fetch all uses the standard iterator but sorts the values on the
-            way out, this maintains the lazy evaluation of querysets
+            Fetches the results for the given window of ordered_pks, returned
+            in the same order as the pks
         """
 
         def locate_pk_column(query):
@@ -61,67 +62,116 @@ class OrderedQuerySet(QuerySet):
             elif pk_name in query.values_select:
                 return query.values_select.index(pk_name)
 
-        if self._result_cache is None:
-            # Making this work efficiently is tricky. We never want to fetch more than self.ordered_pks
-            # and the __getitem__ implementation sets this to a single item, so in that case we only want
-            # to fetch one. So we do a few things here:
-
-            # 1. We clone the Queryset as a normal Queryset, then we do a pk__in on the ordered_pks.
-            # 2. We add the primary key if this was a values_list query without it being specified, otherwise
-            #    we can't match up the ordering
-            # 3. We execute the clone, and then remove the additional PK column from the result set
-
-            # There are various combinations to handle depending on whether it's a "flat" values_list or
-            # whether or not we added the PK manually to the result set
-
-            clone = QuerySet(model=self.model, query=self.query, using=self._db)
-            clone._iterable_class = self._iterable_class
-            clone = clone.filter(pk__in=self.ordered_pks)
-
-            pk_col = 0
-            pk_added = False
-
-            values_select = clone.query.values_select
-
-            if values_select:
-                pk_col = locate_pk_column(clone.query)
-                if pk_col is None:
-                    # Manually add the PK to the result set
-                    clone = clone.values_list(*(["pk"] + list(values_select)))
-                    values_select = [x.field.name for x in clone.query.select]
-                    pk_col = 0
-                    pk_added = True
-
-            # Hit the database
-            results = list(clone)
-
-            ordered_results = []
-            pk_hash = {}
-
-            flat = self._iterable_class == FlatValuesListIterable
-
-            for x in results:
-                if isinstance(x, models.Model):
-                    # standard query case
-                    pk_hash[x.pk] = x
-                elif len(values_select) == 1:
-                    # Only PK case
-                    pk_hash[x if flat else x[pk_col]] = x
+        if not pks:
+            return []
+
+        # Making this work efficiently is tricky. We never want to fetch more than the window
+        # and the __getitem__ implementation sets this to a single item, so in that case we only want
+        # to fetch one. So we do a few things here:
+
+        # 1. We clone the Queryset as a normal Queryset, then we do a pk__in on the window. We
+        #    clear the ordering as we order by the pks afterwards, so this is just a Get by key
+        # 2. We add the primary key if this was a values_list query without it being specified, otherwise
+        #    we can't match up the ordering
+        # 3. We execute the clone, and then remove the additional PK column from the result set
+
+        # There are various combinations to handle depending on whether it's a "flat" values_list or
+        # whether or not we added the PK manually to the result set
+
+        clone = QuerySet(model=self.model, query=self.query, using=self._db)
+        clone._iterable_class = self._iterable_class
+        clone = clone.filter(pk__in=pks).order_by()
+
+        pk_col = 0
+        pk_added = False
+
+        values_select = clone.query.values_select
+
+        if values_select:
+            pk_col = locate_pk_column(clone.query)
+            if pk_col is None:
+                # Manually add the PK to the result set
+                clone = clone.values_list(*(["pk"] + list(values_select)))
+                values_select = [x.field.name for x in clone.query.select]
+                pk_col = 0
+                pk_added = True
+
+        # Hit the database
+        results = list(clone)
+
+        ordered_results = []
+        pk_hash = {}
+
+        flat = self._iterable_class == FlatValuesListIterable
+
+        for x in results:
+            if isinstance(x, models.Model):
+                # standard query case
+                pk_hash[x.pk] = x
+            elif len(values_select) == 1:
+                # Only PK case
+                pk_hash[x if flat else x[pk_col]] = x
+            else:
+                # Multiple columns (either passed in, or as a result of the PK being added)
+                if flat:
+                    pk_hash[x[pk_col]] = x[1] if pk_added else x
                 else:
-                    # Multiple columns (either passed in, or as a result of the PK being added)
-                    if flat:
-                        pk_hash[x[pk_col]] = x[1] if pk_added else x
-                    else:
-                        pk_hash[x[pk_col]] = x[1:] if pk_added else x
-
-            for pk in self.ordered_pks:
-                obj = pk_hash.get(pk)
-                if obj:
-                    ordered_results.append(obj)
-            self._result_cache = ordered_results
+                    pk_hash[x[pk_col]] = x[1:] if pk_added else x
+
+        for pk in pks:
+            obj = pk_hash.get(pk)
+            if obj:
+                ordered_results.append(obj)
+        return ordered_results
+
+    def _iter_windows(self, chunk_size):
+        """
+            Yields the results a window of chunk_size pks at a time, so that
+            we only fetch as much of a long list as is actually iterated
+        """
+        for i in range(0, len(self.ordered_pks), chunk_size):
+            for obj in self._fetch_window(self.ordered_pks[i:i + chunk_size]):
+                yield obj
+
+    def _fetch_all(self):
+        """
+            Fetch all uses the standard iterator but sorts the values on the
+            way out, this maintains the lazy evaluation of querysets
+        """
+        if self._result_cache is None:
+            self._result_cache = self._fetch_window(self.ordered_pks)
         if self._prefetch_related_lookups and not self._prefetch_done:
             self._prefetch_related_objects()
 
+    def __iter__(self):
+        """
+            Iterating a long list fetches it lazily in chunks, the result cache
+            is populated once the iteration has finished
+        """
+        if self._result_cache is not None or self._prefetch_related_lookups:
+            # Prefetching needs all the results up front
+            return super(OrderedQuerySet, self).__iter__()
+
+        def lazy_iterator():
+            if self._result_cache is not None:
+                # list() calls __len__ (which fetches everything) after calling __iter__
+                for obj in self._result_cache:
+                    yield obj
+                return
+
+            results = []
+            for obj in self._iter_windows(GET_ITERATOR_CHUNK_SIZE):
+                results.append(obj)
+                yield obj
+            self._result_cache = results
+
+        return lazy_iterator()
+
+    def iterator(self, chunk_size=2000):
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be strictly positive.")
+        return self._iter_windows(chunk_size)
+
     def _clone(self, *args, **kwargs):
         """
             We need to attach the ordered_pk list on the clone to it continues
@@ -184,30 +234,52 @@ class RelatedIteratorManagerBase(object):
         if not queryset:
             queryset = related_model.objects.all()
 
-        matchers = {}
+        # The related ids of each instance, in the order they're stored (which for
+        # a RelatedListField is the order the related objects should be returned in)
+        instance_related_ids = []
         related_ids = set()
         for instance in instances:
-            for related_id in getattr(instance, self.field.attname):
-                related_ids.add(related_id)
-                matchers.setdefault(related_id, []).append(instance.pk)
+            ids = getattr(instance, self.field.attname)
+            instance_related_ids.append((instance.pk, ids))
+            related_ids.update(ids)
 
+        # This is a single query by keys, which uses whatever is in the context cache
+        # and fetches the rest concurrently in batches
         queryset = queryset.filter(pk__in=related_ids)
 
         def duplicator(queryset):
             """
                 We have to duplicate the related objects for each source instance that
-                was passed in so we can convince Django to do the right thing when merging
+                was passed in so we can convince Django to do the right thing when merging.
+
+                They are returned grouped by instance, in the order of the instance's related ids,
+                so the prefetched results don't need sorting again afterwards.
             """
-            for related_thing in queryset:
-                for i, matcher in enumerate(matchers[related_thing.pk]):
-                    if i == 0:
-                        # Optimisation to prevent unnecessary extra copy
-                        ret = related_thing
-                    else:
-                        ret = copy.copy(related_thing)
-
-                    # Set an id so we can fetch things out in the lambdas below
-                    ret._prefetch_instance_id = matcher
+            related_things = {x.pk: x for x in queryset}
+            used = set()
+
+            for instance_pk, ids in instance_related_ids:
+                instance_things = {}
+
+                for related_id in ids:
+                    ret = instance_things.get(related_id)
+
+                    if ret is None:
+                        related_thing = related_things.get(related_id)
+                        if related_thing is None:
+                            continue
+
+                        if related_id not in used:
+                            # Optimisation to prevent unnecessary extra copy
+                            used.add(related_id)
+                            ret = related_thing
+                        else:
+                            ret = copy.copy(related_thing)
+
+                        # Set an id so we can fetch things out in the lambdas below
+                        ret._prefetch_instance_id = instance_pk
+                        instance_things[related_id] = ret
+
                     yield ret
 
         return (
@@ -227,20 +299,8 @@ class RelatedIteratorManagerBase(object):
             and self.field.name in self.instance._prefetched_objects_cache
         ):
 
-            qs = self.instance._prefetched_objects_cache[self.field.name]
-
-            if self.ordered:
-                lookup = {}
-                for item in qs._result_cache:
-                    lookup[item.pk] = item
-
-                # If this is a ListField make sure the result set retains the right order
-                qs._result_cache = []
-                for pk in getattr(self.instance, self.field.attname):
-                    qs._result_cache.append(lookup[pk])
-                return qs
-            else:
-                return qs
+            # get_prefetch_queryset returns these in the right order for a ListField
+            return self.instance._prefetched_objects_cache[self.field.name]
         elif self.ordered and not self.reverse:
             values = self.field.value_from_object(self.instance)
             qcls = OrderedQuerySet(self.model, using=db)
@@ -61,6 +61,29 @@ class NonAtomic(ContextDecorator):
 non_atomic = NonAtomic
 
 
+class Batch(ContextDecorator):
+    VALID_ARGUMENTS = datastore_transaction.BatchDecorator.VALID_ARGUMENTS[:]
+
+    @classmethod
+    def _do_enter(cls, state, decorator_args):
+        using = decorator_args.get("using", "default") or "default"
+
+        try:
+            connections[using]
+            state.decorator = datastore_transaction.BatchDecorator
+        except (KeyError, TypeError):
+            raise ValueError("Unable to get connection for %s" % using)
+
+        return state.decorator._do_enter(state, decorator_args)
+
+    @classmethod
+    def _do_exit(cls, state, decorator_args, exception):
+        state.decorator._do_exit(state, decorator_args, exception)
+
+
+batch = Batch
+
+
 def in_atomic_block(using="default"):
     try:
         connections[using]
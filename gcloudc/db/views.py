@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.http import (
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    JsonResponse,
+)
+
+from gcloudc.db.backends.datastore import querystats
+
+
+def query_stats(request):
+    """
+        Lists the query shapes which have cost this process the most, worst first.
+        Takes ?limit= and ?order_by= (one of QueryStatsRegistry.ORDERINGS).
+
+        The registry is per-process, so this has to be served by the process
+        you're interested in. Only staff can see it, unless DEBUG is True.
+    """
+    user = getattr(request, "user", None)
+    if not settings.DEBUG and not (user and user.is_active and user.is_staff):
+        return HttpResponseForbidden()
+
+    order_by = request.GET.get("order_by", "total_time")
+    if order_by not in querystats.QueryStatsRegistry.ORDERINGS:
+        return HttpResponseBadRequest("order_by must be one of {}".format(
+            ", ".join(querystats.QueryStatsRegistry.ORDERINGS)
+        ))
+
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        return HttpResponseBadRequest("limit must be an integer")
+
+    return JsonResponse({"queries": querystats.registry.top(limit, order_by)})
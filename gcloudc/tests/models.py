@@ -324,5 +324,11 @@ class NullableFieldModel(models.Model):
     nullable = models.IntegerField(null=True)
 
 
+class ListOrderingModel(models.Model):
+    name = models.CharField(max_length=32)
+    group = models.IntegerField(null=True)
+    values = ListField(models.IntegerField())
+
+
 class Thing(models.Model):
     num = models.IntegerField(default=0)
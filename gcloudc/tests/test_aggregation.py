@@ -0,0 +1,80 @@
+import sleuth
+from django.db import NotSupportedError
+from django.db.models import (
+    Avg,
+    Count,
+    F,
+    Max,
+    Min,
+    Q,
+    Sum,
+)
+
+from . import TestCase
+from .models import MultiQueryModel
+
+
+class AggregationTests(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        for i, value in enumerate([1, 2, 3, 4, None]):
+            MultiQueryModel.objects.create(field1=value, field2="ABCDE"[i])
+
+    def test_aggregates(self):
+        self.assertEqual(
+            {"total": 10, "average": 2.5, "lowest": 1, "highest": 4, "count": 4, "rows": 5},
+            MultiQueryModel.objects.aggregate(
+                total=Sum("field1"),
+                average=Avg("field1"),
+                lowest=Min("field1"),
+                highest=Max("field1"),
+                count=Count("field1"),
+                rows=Count("*"),
+            ),
+        )
+
+    def test_aggregates_of_no_rows(self):
+        self.assertEqual(
+            {"total": None, "count": 0},
+            MultiQueryModel.objects.filter(field2="Z").aggregate(total=Sum("field1"), count=Count("pk")),
+        )
+
+    def test_aggregates_only_fetch_the_aggregated_column(self):
+        with sleuth.watch("google.cloud.datastore.client.Client.query") as query:
+            self.assertEqual({"total": 10}, MultiQueryModel.objects.aggregate(total=Sum("field1")))
+
+            projections = [x.kwargs.get("projection") for x in query.calls]
+            self.assertIn(["field1"], [list(x or []) for x in projections])
+
+    def test_aggregates_of_the_primary_key(self):
+        pks = list(MultiQueryModel.objects.values_list("pk", flat=True))
+
+        self.assertEqual(
+            {"lowest": min(pks), "highest": max(pks), "total": sum(pks), "count": 5},
+            MultiQueryModel.objects.aggregate(lowest=Min("pk"), highest=Max("pk"), total=Sum("pk"), count=Count("pk")),
+        )
+
+    def test_filtered_aggregates(self):
+        self.assertEqual(
+            {"total": 5}, MultiQueryModel.objects.filter(field1__gt=1, field1__lt=4).aggregate(total=Sum("field1"))
+        )
+
+        # The aggregated column can't be projected when it's used in an equality filter
+        self.assertEqual({"total": 6}, MultiQueryModel.objects.filter(field1__in=[2, 4]).aggregate(total=Sum("field1")))
+
+    def test_or_branches_are_only_counted_once(self):
+        queryset = MultiQueryModel.objects.filter(Q(field2__in=["A", "B"]) | Q(field1__gte=2))
+        self.assertEqual({"total": 10, "count": 4}, queryset.aggregate(total=Sum("field1"), count=Count("*")))
+
+    def test_distinct_aggregates(self):
+        MultiQueryModel.objects.create(field1=4, field2="F")
+
+        self.assertEqual(
+            {"count": 4, "rows": 6},
+            MultiQueryModel.objects.aggregate(count=Count("field1", distinct=True), rows=Count("*")),
+        )
+
+    def test_aggregating_expressions_is_not_supported(self):
+        with self.assertRaises(NotSupportedError):
+            MultiQueryModel.objects.aggregate(total=Sum(F("field1") * 2))
@@ -5,6 +5,7 @@ from django.test import override_settings
 
 from . import TestCase
 from .models import (
+    ListOrderingModel,
     MultiQueryModel,
     NullableFieldModel,
 )
@@ -76,3 +77,27 @@ class AsyncMultiQueryTest(TestCase):
         ).order_by("nullable").values_list("pk", flat=True)
 
         self.assertCountEqual(results, [1, 5])
+
+    def test_ordered_by_nullable_field_descending(self):
+        NullableFieldModel.objects.create(pk=1)
+        NullableFieldModel.objects.create(pk=5, nullable=2)
+        NullableFieldModel.objects.create(pk=6, nullable=1)
+
+        results = NullableFieldModel.objects.filter(
+            Q(nullable=1) | Q(nullable=2) | Q(nullable__isnull=True)
+        ).order_by("-nullable").values_list("pk", flat=True)
+
+        self.assertEqual(list(results), [5, 6, 1])
+
+    def test_merge_ordered_by_list_property(self):
+        ListOrderingModel.objects.create(name="a", group=1, values=[5, 1])
+        ListOrderingModel.objects.create(name="b", group=1, values=[3])
+        ListOrderingModel.objects.create(name="c", group=0, values=[2, 4])
+        ListOrderingModel.objects.create(name="d", group=1, values=[7, 6])
+
+        qs = ListOrderingModel.objects.filter(name__in=["a", "b", "c", "d"])
+
+        self.assertEqual([x.name for x in qs.order_by("values")], ["a", "c", "b", "d"])
+        self.assertEqual([x.name for x in qs.order_by("-values")], ["d", "a", "c", "b"])
+        self.assertEqual([x.name for x in qs.order_by("-group", "values")], ["a", "b", "d", "c"])
+        self.assertEqual([x.name for x in qs.order_by("group", "-values")], ["c", "d", "a", "b"])
@@ -2,13 +2,20 @@
 import threading
 
 import sleuth
-from django.db import connection
-from gcloudc.db import transaction
+from django.db import (
+    IntegrityError,
+    connection,
+)
+from gcloudc.db import (
+    batch,
+    transaction,
+)
 
 from . import TestCase
 from .models import (
     TestFruit,
     TestUser,
+    UniqueModel,
 )
 
 
@@ -271,3 +278,75 @@ class TransactionStateTests(TestCase):
             txn.refresh_if_unread(apple)
 
             self.assertEqual(apple.color, "Pink")
+
+
+class BatchTests(TestCase):
+
+    def test_writes_are_flushed_on_exit(self):
+        with sleuth.watch("google.cloud.datastore.client.Client.put_multi") as put_multi:
+            with batch():
+                apple = TestFruit.objects.create(name="Apple", color="Red")
+                TestFruit.objects.create(name="Pear", color="Green")
+
+                self.assertFalse(put_multi.called)
+
+                # Reads by key see the writes in the batch
+                self.assertEqual(apple, TestFruit.objects.get(pk="Apple"))
+
+            self.assertEqual(1, put_multi.call_count)
+
+        self.assertEqual(2, TestFruit.objects.count())
+
+    def test_deletes_are_flushed_on_exit(self):
+        TestFruit.objects.create(name="Apple", color="Red")
+        TestFruit.objects.create(name="Pear", color="Green")
+
+        with batch(parallel=True):
+            TestFruit.objects.filter(name="Apple").delete()
+
+        self.assertEqual(["Pear"], [x.name for x in TestFruit.objects.all()])
+
+    def test_unique_constraints_are_checked_against_the_batch(self):
+        with batch():
+            UniqueModel.objects.create(unique_field="One", unique_combo_one=1)
+            with self.assertRaises(IntegrityError):
+                UniqueModel.objects.create(unique_field="One", unique_combo_one=2)
+
+        self.assertEqual(1, UniqueModel.objects.count())
+
+    def test_unique_values_freed_in_the_batch_can_be_reused(self):
+        stored = UniqueModel.objects.create(unique_field="One", unique_combo_one=1)
+
+        with batch():
+            with self.assertRaises(IntegrityError):
+                UniqueModel.objects.create(unique_field="One", unique_combo_one=2)
+
+            stored.unique_field = "Two"
+            stored.save()
+            replacement = UniqueModel.objects.create(unique_field="One", unique_combo_one=2)
+
+            replacement.delete()
+            UniqueModel.objects.create(unique_field="One", unique_combo_one=3)
+
+        self.assertEqual(
+            [(1, "Two"), (3, "One")],
+            sorted(UniqueModel.objects.values_list("unique_combo_one", "unique_field"))
+        )
+
+    def test_nothing_written_on_exception(self):
+        try:
+            with batch():
+                TestFruit.objects.create(name="Apple", color="Red")
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(0, TestFruit.objects.count())
+
+    def test_batch_inside_atomic_uses_the_transaction(self):
+        with transaction.atomic() as txn:
+            with batch() as batch_txn:
+                self.assertIs(txn, batch_txn)
+                TestFruit.objects.create(name="Apple", color="Red")
+
+        self.assertEqual(1, TestFruit.objects.count())
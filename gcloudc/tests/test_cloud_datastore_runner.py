@@ -1,9 +1,24 @@
 import json
+import os
+import tempfile
 from . import TestCase
 from unittest.mock import patch
 from gcloudc.commands.management.commands import _REQUIRED_COMPONENTS, CloudDatastoreRunner
 
 
+class BaseCommand:
+    def execute(self, *args, **kwargs):
+        pass
+
+
+class Command(CloudDatastoreRunner, BaseCommand):
+    pass
+
+
+class MockProcess:
+    stdout = json.dumps([{"id": cp, "current_version_string": "0.1"} for cp in _REQUIRED_COMPONENTS])
+
+
 class CloudDatastoreRunnerTest(TestCase):
     def test_check_gcloud_components(self):
         class MockProcess:
@@ -16,6 +31,59 @@ class CloudDatastoreRunnerTest(TestCase):
         ):
 
             with patch("gcloudc.commands.management.commands.subprocess.run", return_value=MockProcess()):
+                with patch("gcloudc.commands.management.commands.CloudDatastoreRunner._sdk_version", return_value=None):
+                    command = CloudDatastoreRunner()
+                    with patch.object(command, "_uses_emulator", return_value=True):
+                        with self.assertRaises(RuntimeError):
+                            command.execute()
+
+    def test_components_check_cached_by_sdk_version(self):
+        cache_file = os.path.join(tempfile.mkdtemp(), "components.json")
+
+        with patch("gcloudc.commands.management.commands._COMPONENTS_CACHE_FILE", cache_file):
+            with patch("gcloudc.commands.management.commands.subprocess.run", return_value=MockProcess()) as run:
                 command = CloudDatastoreRunner()
-                with self.assertRaises(RuntimeError):
-                    command.execute()
+
+                with patch.object(command, "_sdk_version", return_value="1.0:1"):
+                    command._check_gcloud_components()
+                    command._check_gcloud_components()
+                    self.assertEqual(1, run.call_count)
+
+                with patch.object(command, "_sdk_version", return_value="1.1:1"):
+                    command._check_gcloud_components()
+                    self.assertEqual(2, run.call_count)
+
+    @patch.dict(os.environ)
+    def test_attach_to_running_emulator(self):
+        command = Command()
+
+        with patch.object(command, "_uses_emulator", return_value=True):
+            with patch.object(command, "_datastore_is_running", return_value=True):
+                with patch.object(command, "_start_emulator") as start_emulator:
+                    with patch.object(command, "_check_gcloud_components") as check_gcloud_components:
+                        command.execute(attach=True, port=9999)
+
+        self.assertFalse(start_emulator.called)
+        self.assertFalse(check_gcloud_components.called)
+        self.assertEqual("127.0.0.1:9999", os.environ["DATASTORE_EMULATOR_HOST"])
+
+    def test_attach_starts_emulator_if_not_running(self):
+        command = Command()
+
+        with patch.object(command, "_uses_emulator", return_value=True):
+            with patch.object(command, "_datastore_is_running", return_value=False):
+                with patch.object(command, "_start_emulator") as start_emulator:
+                    with patch.object(command, "_check_gcloud_components"):
+                        command.execute(attach=True, port=9999)
+
+        self.assertTrue(start_emulator.called)
+
+    def test_readiness_is_polled_quickly(self):
+        command = CloudDatastoreRunner()
+
+        with patch.object(command, "_datastore_is_running", side_effect=[False, False, False, True]):
+            with patch("gcloudc.commands.management.commands.time.sleep") as sleep:
+                command._wait_for_datastore(port=9999)
+
+        self.assertEqual(3, sleep.call_count)
+        self.assertTrue(all(x[0][0] < 0.1 for x in sleep.call_args_list))
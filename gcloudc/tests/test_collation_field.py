@@ -1,3 +1,20 @@
+import io
+import os
+import shutil
+import stat
+import tempfile
+
+import sleuth
+
+from django.core.management import call_command
+from gcloudc.db.models.fields.computed import (
+    COLLATION_FILE,
+    COLLATION_ZIP_FILE,
+    build_collation_cache,
+    collation_sort_key,
+    get_collator,
+)
+
 from . import TestCase
 from .models import ModelWithComputedCollationField
 
@@ -8,3 +25,65 @@ class ComputedCollationFieldTests(TestCase):
     def test_model(self):
         """Tests for a model using a `ComputedCollationField`."""
         ModelWithComputedCollationField.objects.create(name="demo1")
+
+    def test_sort_keys_are_cached(self):
+        collation_sort_key.cache_clear()
+
+        with sleuth.watch("pyuca.collator.BaseCollator.sort_key") as sort_key:
+            first = ModelWithComputedCollationField.objects.create(name="Łukasz")
+            second = ModelWithComputedCollationField.objects.create(name="Łukasz")
+
+            self.assertEqual(1, sort_key.call_count)
+            self.assertEqual(first.name_order, second.name_order)
+
+    def test_collation_table_is_loaded_from_the_cache(self):
+        handle, cache_filename = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, cache_filename)
+
+        build_collation_cache(cache_filename)
+
+        collator_class = type(get_collator())
+        with sleuth.watch("gcloudc.db.models.fields.computed.ZipLoaderMixin.parse") as parse:
+            collator = collator_class(COLLATION_ZIP_FILE, COLLATION_FILE, cache_filenames=[cache_filename])
+            self.assertFalse(parse.called)
+
+        for value in ("Łukasz", "Zebra", "apple"):
+            self.assertEqual(get_collator().sort_key(value), collator.sort_key(value))
+
+    def _build_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        cache_filename = os.path.join(directory, "allkeys.marshal")
+        call_command("build_collation_cache", output=cache_filename, stdout=io.StringIO())
+        return cache_filename
+
+    def _cache_is_used(self, cache_filename):
+        collator_class = type(get_collator())
+        with sleuth.watch("gcloudc.db.models.fields.computed.ZipLoaderMixin.parse") as parse:
+            collator_class(COLLATION_ZIP_FILE, COLLATION_FILE, cache_filenames=[cache_filename])
+            return not parse.called
+
+    def test_cache_is_validated(self):
+        cache_filename = self._build_cache()
+        self.assertTrue(self._cache_is_used(cache_filename))
+
+        # A cache which has been modified is ignored (and replaced)
+        with open(cache_filename, "ab") as f:
+            f.write(b"\0")
+        self.assertFalse(self._cache_is_used(cache_filename))
+        self.assertTrue(self._cache_is_used(cache_filename))
+
+        # So is one parsed from a different zip file
+        with sleuth.switch("gcloudc.db.models.fields.computed.ZipLoaderMixin.zip_hash", lambda self: "0" * 64):
+            self.assertFalse(self._cache_is_used(cache_filename))
+
+    def test_cache_directory_is_private(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        cache_filename = os.path.join(directory, "gcloudc", "allkeys.marshal")
+        self.assertTrue(build_collation_cache(cache_filename))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(cache_filename)).st_mode))
+        self.assertTrue(self._cache_is_used(cache_filename))
@@ -1,5 +1,6 @@
 # encoding: utf-8
 
+import copy
 import datetime
 import decimal
 import logging
@@ -49,6 +50,8 @@ from gcloudc.db.backends.datastore import (
 from gcloudc.db.backends.datastore.commands import FlushCommand
 from gcloudc.db.backends.datastore.indexing import (
     IExactIndexer,
+    TrigramContainsIndexer,
+    TrigramIContainsIndexer,
     add_special_index,
     get_indexer,
 )
@@ -59,8 +62,10 @@ from gcloudc.db.backends.datastore.unique_utils import (
     unique_identifiers_from_entity,
 )
 from gcloudc.db.backends.datastore.utils import (
+    clear_entity_serializers,
     decimal_to_string,
     entity_matches_query,
+    get_entity_serializer,
     normalise_field_value,
 )
 from gcloudc.db.decorators import disable_cache
@@ -574,15 +579,16 @@ class BackendTests(TestCase):
         self.assertEqual(TestFruit.objects.count(), 4)
 
         # Sorted list. No exception should be raised
-        # (esp KeyError from django_ordering_comparison)
-        with sleuth.watch('gcloudc.db.backends.datastore.meta_queries.django_ordering_comparison') as compare:
+        # (esp KeyError when building the sort key for an entity without 'color')
+        with sleuth.watch('gcloudc.db.backends.datastore.utils._ordering_sort_value') as sort_value:
             all_names = ['a', 'b', 'c', 'd']
             fruits = list(
                 TestFruit.objects.filter(name__in=all_names).order_by('color', 'name')
             )
-            # Make sure troubled code got triggered
-            # ie. with all() it doesn't
-            self.assertTrue(compare.called)
+            # Make sure troubled code got triggered, a sort value is built for
+            # each ordering column of each entity (ie. with all() it doesn't)
+            self.assertGreaterEqual(len(sort_value.calls), len(all_names) * 2)
+            self.assertIn(None, [call.args[0] for call in sort_value.calls])
 
         # Test the ordering of the results.  The ones with a color of None should come back first,
         # and of the ones with color=None, they should be ordered by name
@@ -1019,6 +1025,93 @@ class ConstraintTests(TestCase):
         self.assertRaises(IntegrityError, duplicate.save)
 
 
+class FlushTests(TestCase):
+    def _sql_flush(self):
+        tables = default_connection.introspection.django_table_names(only_existing=True, include_views=False)
+        return default_connection.ops.sql_flush(None, tables, [])
+
+    def test_only_written_kinds_are_flushed(self):
+        with sleuth.switch("gcloudc.db.backends.datastore.flushing._written_kinds", {}):
+            ModelWithUniques.objects.create(name="One")
+
+            # The first flush has to find out what exists
+            with sleuth.watch("gcloudc.db.backends.datastore.base.DatabaseIntrospection.get_table_list") as kinds:
+                commands = self._sql_flush()
+                self.assertTrue(kinds.called)
+
+            self.assertEqual(1, len(commands))
+            self.assertIn(ModelWithUniques._meta.db_table, commands[0].tables)
+            commands[0].execute()
+            self.assertFalse(ModelWithUniques.objects.exists())
+
+            # Nothing has been written since, so there's nothing to flush
+            with sleuth.watch("google.cloud.datastore.query.Query.fetch") as fetch:
+                self.assertEqual([], self._sql_flush())
+                self.assertFalse(fetch.called)
+
+            UniqueModel.objects.create(unique_field="One")
+
+            commands = self._sql_flush()
+            self.assertEqual(1, len(commands))
+            self.assertEqual([UniqueModel._meta.db_table], commands[0].tables)
+            commands[0].execute()
+
+    def test_tables_are_flushed_concurrently(self):
+        ModelWithUniques.objects.create(name="One")
+        UniqueModel.objects.create(unique_field="One")
+
+        tables = [ModelWithUniques._meta.db_table, UniqueModel._meta.db_table]
+        with sleuth.watch("gcloudc.db.backends.datastore.commands.ThreadPoolExecutor.submit") as submit:
+            FlushCommand(tables, default_connection).execute()
+            self.assertEqual(2, submit.call_count)
+
+        self.assertFalse(ModelWithUniques.objects.exists())
+        self.assertFalse(UniqueModel.objects.exists())
+
+    def test_flush_with_reset(self):
+        with sleuth.fake("gcloudc.db.backends.datastore.flushing.can_reset", True):
+            with sleuth.fake("gcloudc.db.backends.datastore.flushing.reset", None) as reset:
+                ModelWithUniques.objects.create(name="One")
+
+                commands = self._sql_flush()
+                self.assertEqual(1, len(commands))
+                self.assertTrue(commands[0].reset)
+
+                commands[0].execute()
+                self.assertTrue(reset.called)
+
+
+class ParallelTestDatabaseTests(TestCase):
+    def _entities(self, namespace, model):
+        client = default_connection.connection.gclient
+        return list(client.query(kind=model._meta.db_table, namespace=namespace).fetch())
+
+    def test_clones_use_their_own_namespace(self):
+        creation = default_connection.creation
+        settings_dict = creation.get_test_db_clone_settings("1")
+        self.assertNotEqual(default_connection.namespace, settings_dict["NAMESPACE"])
+        self.assertNotEqual(settings_dict["NAMESPACE"], creation.get_test_db_clone_settings("2")["NAMESPACE"])
+
+    def test_clone_copies_the_test_database(self):
+        instance = ModelWithUniques.objects.create(name="One")
+        creation = default_connection.creation
+        settings_dict = creation.get_test_db_clone_settings("1")
+        namespace = settings_dict["NAMESPACE"]
+
+        creation._clone_test_db("1", verbosity=0)
+        try:
+            cloned = self._entities(namespace, ModelWithUniques)
+            self.assertEqual([instance.pk], [x.key.id_or_name for x in cloned])
+            self.assertEqual(namespace, cloned[0].key.namespace)
+            self.assertEqual("One", cloned[0]["name"])
+        finally:
+            creation._destroy_test_db(settings_dict["NAME"], verbosity=0)
+
+        self.assertEqual([], self._entities(namespace, ModelWithUniques))
+        # The original is untouched
+        self.assertEqual(1, ModelWithUniques.objects.count())
+
+
 class EdgeCaseTests(TestCase):
     def setUp(self):
         super(EdgeCaseTests, self).setUp()
@@ -1324,6 +1417,14 @@ class EdgeCaseTests(TestCase):
         results = TestUser.objects.all().extra(select={'truthy': True})
         self.assertEqual(all([x.truthy for x in results]), True)
 
+    def test_extra_select_arguments_parsed_once_per_query(self):
+        with sleuth.watch("gcloudc.db.backends.datastore.commands._parse_extra_select_arg") as parse_arg:
+            results = list(TestUser.objects.exclude(username='A').extra(select={'is_a': "username = 'A'"}))
+
+            self.assertEqual(4, len(results))
+            self.assertFalse(any(x.is_a for x in results))
+            self.assertEqual(2, len(parse_arg.calls))  # username and 'A'
+
     def test_counts(self):
         self.assertEqual(5, TestUser.objects.count())
         self.assertEqual(2, TestUser.objects.filter(email="test3@example.com").count())
@@ -1402,6 +1503,18 @@ class EdgeCaseTests(TestCase):
             self.assertTrue(keys_only.called)
             self.assertEqual(5, len(TestUser.objects.all().values_list('pk')))
 
+    def test_select_rows_are_tuples_and_ids_are_not_tracked(self):
+        with sleuth.watch("gcloudc.db.backends.datastore.base.Cursor._fetchone") as fetchone:
+            rows = list(TestUser.objects.order_by("username").values_list("username", "email"))
+            self.assertEqual(("A", "test@example.com"), rows[0])
+            self.assertEqual(5, len(rows))
+
+            self.assertTrue(all(isinstance(x, tuple) for x in fetchone.call_returns if x is not None))
+
+            # Only inserts need to remember the ids they return
+            cursor = fetchone.calls[0].args[0]
+            self.assertFalse(cursor.returned_ids)
+
     def test_iexact(self):
         user = TestUser.objects.get(username__iexact="a")
         self.assertEqual("A", user.username)
@@ -1593,6 +1706,7 @@ class EdgeCaseTests(TestCase):
             indexing._app_special_indexes = {
                 TestFruit._meta.db_table: {"name": ["iexact"]}
             }
+            clear_entity_serializers()
 
             t1 = TestFruit.objects.create(name="Kiwi", origin="New Zealand", color="Green")
             self.assertEqual(t1, TestFruit.objects.filter(name__iexact="kiwi").get())
@@ -1600,6 +1714,31 @@ class EdgeCaseTests(TestCase):
         finally:
             indexing._project_special_indexes = project
             indexing._app_special_indexes = additional
+            clear_entity_serializers()
+
+    def test_entity_serializer_reused_until_indexes_change(self):
+        fields = TestFruit._meta.fields
+        serializer = get_entity_serializer(default_connection, TestFruit, fields)
+        self.assertIs(serializer, get_entity_serializer(default_connection, TestFruit, fields))
+        self.assertFalse([x for x in serializer.columns if x[0].column == "origin" and x[2]])
+
+        project = copy.deepcopy(indexing._project_special_indexes)
+        try:
+            origin = TestFruit._meta.get_field("origin")
+
+            # Don't add the index to the project's djangaeidx.yaml
+            with sleuth.fake("gcloudc.db.backends.datastore.indexing.write_special_indexes", None):
+                add_special_index(default_connection, TestFruit, "origin", get_indexer(origin, "iexact"), "iexact")
+
+            new_serializer = get_entity_serializer(default_connection, TestFruit, fields)
+            self.assertIsNot(serializer, new_serializer)
+            self.assertTrue([x for x in new_serializer.columns if x[0].column == "origin" and x[2]])
+
+            t1 = TestFruit.objects.create(name="Kiwi", origin="New Zealand", color="Green")
+            self.assertEqual(t1, TestFruit.objects.get(origin__iexact="new zealand"))
+        finally:
+            indexing._project_special_indexes = project
+            clear_entity_serializers()
 
 
 class TestSpecialIndexers(TestCase):
@@ -1630,6 +1769,27 @@ class TestSpecialIndexers(TestCase):
             qry = self.qry.filter(name__iexact=name)
             self.assertEqual(len(qry), len([x for x in self.names if x.lower() == name.lower()]))
 
+    def test_contains_index_entities_deleted_without_querying(self):
+        instance = SpecialIndexesModel.objects.create(name="cleanup", nickname="Hello")
+
+        rpc = transaction._rpc(default_connection.alias)
+        key = rpc.key(SpecialIndexesModel._meta.db_table, instance.pk)
+
+        indexer = get_indexer(SpecialIndexesModel._meta.get_field("nickname"), "contains")
+        index_keys = indexer.cleanup_keys(SpecialIndexesModel, "nickname", key)
+        self.assertTrue(rpc.get(index_keys))
+
+        with sleuth.watch("google.cloud.datastore.query.Query.fetch") as fetch:
+            SpecialIndexesModel.objects.filter(pk=instance.pk).delete()
+
+            # The only query is the keys-only lookup of the instance itself, there are
+            # no kindless ancestor queries for the index entities
+            self.assertEqual(
+                [SpecialIndexesModel._meta.db_table] * fetch.call_count, [x.args[0].kind for x in fetch.calls]
+            )
+
+        self.assertFalse(rpc.get(index_keys))
+
     def test_contains_lookup_and_icontains_lookup(self):
         tests = self.names + ['o', 'O', 'la']
         for name in tests:
@@ -1716,6 +1876,46 @@ class TestSpecialIndexers(TestCase):
             qry = self.qry.filter(sample_list__item__iendswith=text)
             self.assertEqual(len(qry), 1)
 
+    def test_trigram_contains_indexer(self):
+        indexers = indexing._REGISTERED_INDEXERS
+        try:
+            indexing._REGISTERED_INDEXERS = [TrigramContainsIndexer(), TrigramIContainsIndexer()] + indexers
+            clear_entity_serializers()
+
+            SpecialIndexesModel.objects.create(name="trigram1", nickname="Hello World")
+            SpecialIndexesModel.objects.create(name="trigram2", nickname="World Hello")
+            SpecialIndexesModel.objects.create(name="trigram3", nickname="Help")
+            SpecialIndexesModel.objects.create(name="trigram4", nickname="abcXbcd")
+
+            def matches(term):
+                qs = SpecialIndexesModel.objects.filter(nickname__contains=term)
+                return sorted(qs.values_list("name", flat=True))
+
+            self.assertEqual(["trigram1", "trigram2", "trigram3"], matches("Hel"))
+            self.assertEqual(["trigram1", "trigram2"], matches("Hello"))
+            self.assertEqual(["trigram1"], matches("lo Wor"))
+            self.assertEqual(["trigram2"], matches("d H"))
+            self.assertEqual([], matches("hello"))  # Case-sensitive
+            self.assertEqual([], matches("abcd"))  # All the n-grams match, but the value doesn't
+
+            with sleuth.switch("gcloudc.db.backends.datastore.indexing.TRIGRAM_CONTAINS_MAX_RESULTS", 2):
+                self.assertEqual(["trigram1", "trigram2"], matches("Hello"))
+                self.assertRaises(NotSupportedError, matches, "Hel")
+        finally:
+            indexing._REGISTERED_INDEXERS = indexers
+            clear_entity_serializers()
+
+    def test_trigram_ngrams_are_bounded(self):
+        indexer = TrigramContainsIndexer()
+        value = "abcdefghij" * 10
+
+        # At most 3 n-grams per character rather than every suffix
+        self.assertTrue(len(set(indexer._generate_ngrams(value))) <= len(value) * indexer.NGRAM_LENGTH)
+        self.assertEqual(indexer.MAX_QUERY_NGRAMS, len(indexer._query_ngrams(value)))
+        self.assertEqual(["ab"], indexer._query_ngrams("ab"))
+        self.assertEqual(["abc", "bcd"], indexer._query_ngrams("abcd"))
+        self.assertEqual("abc", TrigramIContainsIndexer()._prep_value("ABC"))
+
 
 class SliceModel(models.Model):
     field1 = models.CharField(max_length=32)
@@ -0,0 +1,80 @@
+import sleuth
+
+from gcloudc.db.backends.datastore import (
+    caching,
+    stats,
+)
+from gcloudc.db.backends.datastore.dataloader import (
+    dataloader,
+    prime,
+)
+
+from . import TestCase
+from .models import (
+    ModelWithUniques,
+    ModelWithUniquesOnForeignKey,
+    TestUser,
+)
+
+
+class DataLoaderTest(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.users = [
+            TestUser.objects.create(username=str(i), first_name=str(i), email="{}@example.com".format(i))
+            for i in range(3)
+        ]
+
+        # Make sure we don't just hit the entities cached by the creation
+        caching.reset_context(keep_disabled_flags=True)
+
+    def test_primed_lookups_are_fetched_together(self):
+        with dataloader():
+            prime(TestUser, [x.pk for x in self.users])
+
+            with sleuth.watch("google.cloud.datastore.client.Client.get_multi") as get_multi:
+                for user in self.users:
+                    self.assertEqual(user, TestUser.objects.get(pk=user.pk))
+
+                self.assertEqual(1, get_multi.call_count)
+                self.assertEqual(3, len(get_multi.calls[0].args[1]))
+
+    def test_prime_does_nothing_outside_a_dataloader(self):
+        prime(TestUser, [x.pk for x in self.users])
+
+        with sleuth.watch("google.cloud.datastore.client.Client.get_multi") as get_multi:
+            for user in self.users:
+                self.assertEqual(user, TestUser.objects.get(pk=user.pk))
+
+            self.assertEqual(3, get_multi.call_count)
+
+
+class DataLoaderForeignKeyTest(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        for i in range(5):
+            ModelWithUniquesOnForeignKey.objects.create(
+                name=str(i), related_name=ModelWithUniques.objects.create(name=str(i))
+            )
+
+        caching.reset_context(keep_disabled_flags=True)
+
+    def test_foreign_keys_of_results_are_fetched_together(self):
+        with dataloader():
+            instances = list(ModelWithUniquesOnForeignKey.objects.all())
+
+            with stats.collect() as collected:
+                related = [x.related_name for x in instances]
+
+        self.assertEqual([x.name for x in instances], [x.name for x in related])
+        self.assertEqual(1, collected.rpcs["lookup"])
+
+    def test_foreign_keys_are_fetched_separately_outside_a_dataloader(self):
+        instances = list(ModelWithUniquesOnForeignKey.objects.all())
+
+        with stats.collect() as collected:
+            [x.related_name for x in instances]
+
+        self.assertEqual(5, collected.rpcs["lookup"])
@@ -1,5 +1,13 @@
+import sleuth
+
+from gcloudc.db.backends.datastore.utils import has_concrete_children
+
 from . import TestCase
-from .models import TestUser
+from .models import (
+    InheritedModel,
+    TestUser,
+    TransformTestModel,
+)
 
 
 class DeleteTestCase(TestCase):
@@ -33,3 +41,20 @@ class DeleteTestCase(TestCase):
 
         TestUser.objects.all().delete()
         self.assertEqual(TestUser.objects.count(), 0)
+
+    def test_delete_by_key_without_fetching(self):
+        """Models outside of a polymodel hierarchy are deleted by key, without a get()."""
+        TestUser.objects.create(username="One", first_name="A", second_name="B")
+        TestUser.objects.create(username="Two", first_name="B", second_name="B")
+
+        self.assertFalse(has_concrete_children(TestUser))
+        self.assertTrue(has_concrete_children(TransformTestModel))
+        self.assertFalse(has_concrete_children(InheritedModel))
+
+        with sleuth.watch("gcloudc.db.backends.datastore.commands._wipe_polymodel_from_entity") as wipe:
+            deleted, _ = TestUser.objects.filter(second_name="B").delete()
+
+            self.assertFalse(wipe.called)
+            self.assertEqual(2, deleted)
+
+        self.assertEqual(TestUser.objects.count(), 0)
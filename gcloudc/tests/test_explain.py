@@ -0,0 +1,66 @@
+import json
+
+import sleuth
+
+from . import TestCase
+from .models import TestFruit
+
+
+class ExplainTest(TestCase):
+    def _plan(self, queryset):
+        return json.loads(queryset.explain(format="json"))
+
+    def test_plain_query(self):
+        plan = self._plan(TestFruit.objects.filter(color="Red").order_by("-origin"))
+
+        self.assertEqual("Query", plan["path"])
+        self.assertEqual([["color = 'Red'"]], plan["branches"])
+        self.assertEqual(["-origin"], plan["ordering"])
+        self.assertEqual(1, plan["estimated_rpcs"])
+        self.assertFalse(plan["full_scan"])
+        self.assertFalse(plan["in_memory"])
+
+    def test_full_scan(self):
+        plan = self._plan(TestFruit.objects.all())
+        self.assertTrue(plan["full_scan"])
+        self.assertEqual([], plan["branches"])
+
+    def test_fan_out(self):
+        plan = self._plan(TestFruit.objects.filter(color__in=["Red", "Green", "Yellow"])[2:5])
+
+        self.assertEqual("AsyncMultiQuery", plan["path"])
+        self.assertEqual(3, len(plan["branches"]))
+        self.assertEqual(3, plan["estimated_rpcs"])
+        self.assertEqual(2, len(plan["in_memory"]))
+
+    def test_query_by_keys(self):
+        plan = self._plan(TestFruit.objects.filter(pk__in=["Apple", "Banana"], color="Red").order_by("color"))
+
+        self.assertEqual("QueryByKeys", plan["path"])
+        self.assertEqual(1, plan["estimated_rpcs"])
+        self.assertEqual(2, len(plan["in_memory"]))  # The filter on color, and the sort
+
+    def test_special_indexes_and_excluded_pks(self):
+        plan = self._plan(TestFruit.objects.filter(color__iexact="red").exclude(pk="Apple"))
+
+        self.assertEqual(["_idx_iexact_color"], plan["special_indexes"])
+        self.assertEqual(1, plan["excluded_pks"])
+        self.assertEqual(1, len(plan["in_memory"]))
+
+    def test_empty_query(self):
+        plan = self._plan(TestFruit.objects.filter(pk__in=[]))
+
+        self.assertEqual("NoOpQuery", plan["path"])
+        self.assertEqual(0, plan["estimated_rpcs"])
+
+    def test_text_format_and_nothing_is_run(self):
+        with sleuth.watch("gcloudc.db.backends.datastore.commands.SelectCommand.execute") as execute:
+            text = TestFruit.objects.filter(color__in=["Red", "Green"]).explain()
+
+        self.assertFalse(execute.called)
+        self.assertTrue(text.startswith("SELECT on tests_testfruit using AsyncMultiQuery"))
+        self.assertIn("Estimated RPCs: 2", text)
+
+    def test_unknown_formats_and_options(self):
+        self.assertRaises(ValueError, TestFruit.objects.all().explain, format="xml")
+        self.assertRaises(ValueError, TestFruit.objects.all().explain, verbose=True)
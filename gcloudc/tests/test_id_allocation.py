@@ -0,0 +1,80 @@
+import itertools
+from unittest import mock
+
+import sleuth
+from django.db import connection
+
+from gcloudc.db.backends.datastore.allocation import (
+    IdAllocator,
+    get_id_allocator,
+)
+
+from . import TestCase
+from .models import TestUser
+
+
+class IdAllocatorTest(TestCase):
+    def test_ids_are_allocated_in_blocks(self):
+        client = connection.connection.gclient
+        allocator = IdAllocator("tests_allocation", connection.namespace, block_size=10)
+
+        with sleuth.watch("google.cloud.datastore.client.Client.allocate_ids") as allocate_ids:
+            ids = [allocator.next_id(client) for i in range(5)]
+
+            self.assertEqual(1, allocate_ids.call_count)
+            self.assertEqual(5, len(set(ids)))
+            self.assertTrue(all(isinstance(x, int) and x > 0 for x in ids))
+
+    def test_next_block_is_allocated_in_the_background(self):
+        counter = itertools.count(1)
+
+        def allocate_ids(incomplete_key, count):
+            return [mock.Mock(id=next(counter)) for i in range(count)]
+
+        first_client, second_client = mock.Mock(), mock.Mock()
+        first_client.allocate_ids.side_effect = allocate_ids
+        second_client.allocate_ids.side_effect = allocate_ids
+
+        allocator = IdAllocator("tests_allocation", connection.namespace, block_size=8)
+
+        # The first ID has to wait for a block, then we use it until a quarter is left
+        ids = [allocator.next_id(first_client) for i in range(6)]
+        self.assertEqual(1, first_client.allocate_ids.call_count)
+        self.assertEqual(2, len(allocator._ids))
+
+        # This starts the refill, with the client of the connection which asked for the ID
+        ids.append(allocator.next_id(second_client))
+        thread = allocator._refill_thread
+        if thread:
+            thread.join()
+
+        self.assertEqual(1, first_client.allocate_ids.call_count)
+        self.assertEqual(1, second_client.allocate_ids.call_count)
+        self.assertEqual(9, len(allocator._ids))
+
+        ids.extend(allocator.next_id(first_client) for i in range(9))
+        self.assertEqual(list(range(1, 17)), ids)
+
+    def test_allocators_are_shared_per_kind(self):
+        project = connection.connection.gclient.project
+
+        allocator = get_id_allocator(project, "tests_testuser", connection.namespace)
+        self.assertIs(allocator, get_id_allocator(project, "tests_testuser", connection.namespace))
+        self.assertIsNot(allocator, get_id_allocator(project, "tests_testfruit", connection.namespace))
+
+    def test_new_instances_get_allocated_ids(self):
+        with sleuth.watch("gcloudc.db.backends.datastore.allocation.IdAllocator.next_id") as next_id:
+            user = TestUser.objects.create(username="A", email="a@example.com")
+
+            self.assertTrue(next_id.called)
+            self.assertEqual(next_id.call_returns[0], user.pk)
+
+    def test_explicit_ids_reserved_in_one_rpc(self):
+        with sleuth.watch("google.cloud.datastore.client.Client.reserve_ids_multi") as reserve_ids:
+            TestUser.objects.bulk_create([
+                TestUser(pk=1001, username="A", first_name="A", email="a@example.com"),
+                TestUser(pk=1002, username="B", first_name="B", email="b@example.com"),
+            ])
+
+            self.assertEqual(1, reserve_ids.call_count)
+            self.assertEqual(2, len(reserve_ids.calls[0].args[1]))
@@ -0,0 +1,160 @@
+from unittest import mock
+
+from django.db import connection
+from google.cloud.datastore.key import Key
+from google.cloud.datastore_v1.proto import datastore_pb2
+
+from gcloudc.db.backends.datastore import instrumentation
+from gcloudc.db.backends.datastore.instrumentation import (
+    Instrumentation,
+    InstrumentedDatastoreAPI,
+    RPCListener,
+    SignalListener,
+    TracerListener,
+)
+
+from . import TestCase
+from .models import TestFruit
+
+
+class RecordingListener(RPCListener):
+    def __init__(self):
+        self.before = []
+        self.after = []
+
+    def before_rpc(self, event):
+        self.before.append(event)
+
+    def after_rpc(self, event):
+        self.after.append(event)
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.listener = RecordingListener()
+        instrumentation.add_listener(self.listener)
+
+    def tearDown(self):
+        instrumentation.remove_listener(self.listener)
+        super().tearDown()
+
+    def test_backend_rpcs_are_instrumented(self):
+        TestFruit.objects.create(name="Apple", color="Red")
+        TestFruit.objects.get(pk="Apple")
+
+        self.assertEqual(self.listener.before, self.listener.after)
+
+        events = self.listener.after
+        commits = [x for x in events if x.operation == "commit" and TestFruit._meta.db_table in x.kinds]
+        self.assertTrue(commits)
+        self.assertTrue(commits[0].entities_written)
+
+        lookups = [x for x in events if x.operation == "lookup" and TestFruit._meta.db_table in x.kinds]
+        self.assertEqual(1, lookups[-1].results)
+
+        self.assertTrue(all(x.using == connection.alias for x in events))
+        self.assertTrue(all(x.duration is not None for x in events))
+
+    def test_listener_errors_dont_break_rpcs(self):
+        broken = RPCListener()
+        broken.after_rpc = mock.Mock(side_effect=ValueError())
+
+        instrumentation.add_listener(broken)
+        try:
+            TestFruit.objects.create(name="Apple", color="Red")
+        finally:
+            instrumentation.remove_listener(broken)
+
+        self.assertTrue(broken.after_rpc.called)
+        self.assertTrue(TestFruit.objects.filter(pk="Apple").exists())
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with Instrumentation("default").rpc("lookup"):
+                raise ValueError()
+
+        self.assertIsInstance(self.listener.after[-1].exception, ValueError)
+
+
+class InstrumentedDatastoreAPITest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.listener = RecordingListener()
+        instrumentation.add_listener(self.listener)
+
+        self.api = mock.Mock()
+        self.instrumented = InstrumentedDatastoreAPI(self.api, Instrumentation("default"))
+        self.key = Key("Fruit", 1, project="test").to_protobuf()
+
+    def tearDown(self):
+        instrumentation.remove_listener(self.listener)
+        super().tearDown()
+
+    def test_lookup(self):
+        response = datastore_pb2.LookupResponse()
+        response.found.add().entity.key.CopyFrom(self.key)
+        self.api.lookup.return_value = response
+
+        self.assertIs(response, self.instrumented.lookup("test", [self.key], read_options=None))
+
+        event = self.listener.after[-1]
+        self.assertEqual(("lookup", ("Fruit",), 1, 1), (event.operation, event.kinds, event.count, event.results))
+        self.assertEqual(self.key.ByteSize(), event.request_size)
+        self.assertEqual(response.ByteSize(), event.response_size)
+
+    def test_commit(self):
+        upsert = datastore_pb2.Mutation()
+        upsert.upsert.key.CopyFrom(self.key)
+        delete = datastore_pb2.Mutation()
+        delete.delete.CopyFrom(Key("Veg", 1, project="test").to_protobuf())
+        self.api.commit.return_value = datastore_pb2.CommitResponse()
+
+        self.instrumented.commit("test", 1, [upsert, delete], transaction=None)
+
+        event = self.listener.after[-1]
+        self.assertEqual(("commit", ("Fruit", "Veg"), 2), (event.operation, event.kinds, event.count))
+        self.assertEqual(2, event.entities_written)
+
+    def test_other_attributes_are_passed_through(self):
+        self.assertIs(self.api.something, self.instrumented.something)
+
+
+class ListenerTest(TestCase):
+    def _event(self):
+        instrumented = Instrumentation("default")
+        with instrumented.rpc("run_query", ["Fruit"], 1) as event:
+            event.results = 3
+        return event
+
+    def test_signal_listener(self):
+        received = []
+
+        def receiver(sender, event, **kwargs):
+            received.append(event.operation)
+
+        listener = SignalListener()
+        instrumentation.rpc_finished.connect(receiver)
+        instrumentation.add_listener(listener)
+        try:
+            self._event()
+        finally:
+            instrumentation.remove_listener(listener)
+            instrumentation.rpc_finished.disconnect(receiver)
+
+        self.assertEqual(["run_query"], received)
+
+    def test_tracer_listener(self):
+        tracer = mock.Mock()
+        listener = TracerListener(tracer)
+
+        instrumentation.add_listener(listener)
+        try:
+            self._event()
+        finally:
+            instrumentation.remove_listener(listener)
+
+        tracer.start_span.assert_called_once_with("datastore.run_query")
+        span = tracer.start_span.return_value
+        span.set_attribute.assert_any_call("datastore.results", 3)
+        self.assertTrue(span.end.called)
@@ -1,10 +1,16 @@
 from collections import OrderedDict
 
+import sleuth
 from django.db import (
     connection,
     models,
 )
-from gcloudc.db.models.fields.json import JSONField
+from gcloudc.db.backends.datastore import transaction
+from gcloudc.db.backends.datastore.indexing import IgnoreForIndexing
+from gcloudc.db.models.fields.json import (
+    JSONField,
+    JSONKeyLookupIndexer,
+)
 from google.cloud.datastore.entity import Entity
 
 from . import TestCase
@@ -18,6 +24,10 @@ class JSONFieldWithDefaultModel(models.Model):
     json_field = JSONField(use_ordered_dict=True)
 
 
+class LazyJSONFieldModel(models.Model):
+    json_field = JSONField(lazy=True)
+
+
 class JSONFieldModelTests(TestCase):
     def test_invalid_data_in_datastore_doesnt_throw_an_error(self):
         """
@@ -36,7 +46,8 @@ class JSONFieldModelTests(TestCase):
             client.key(JSONFieldModel._meta.db_table, 1, namespace=connection.settings_dict["NAMESPACE"])
         )
         entity["json_field"] = "bananas"
-        client.put(entity)
+        # Written through the backend so that the kind is flushed afterwards
+        transaction._rpc(connection.alias).put(entity)
 
         instance = JSONFieldModel.objects.get(pk=1)
         self.assertEqual(instance.json_field, "bananas")
@@ -102,3 +113,73 @@ class JSONFieldModelTests(TestCase):
         """
         thing = JSONFieldWithDefaultModel()
         self.assertEqual(thing.json_field, {})
+
+
+class LazyJSONFieldTests(TestCase):
+    def test_value_is_decoded_on_first_access(self):
+        LazyJSONFieldModel.objects.create(json_field={"a": [1, 2]})
+
+        with sleuth.watch("gcloudc.db.models.fields.json.JSONField.parse_json") as parse_json:
+            thing = LazyJSONFieldModel.objects.get()
+            self.assertFalse(parse_json.called)
+
+            self.assertEqual({"a": [1, 2]}, thing.json_field)
+            self.assertEqual({"a": [1, 2]}, thing.json_field)
+            self.assertEqual(1, parse_json.call_count)
+
+    def test_unaccessed_value_isnt_reencoded(self):
+        LazyJSONFieldModel.objects.create(json_field={"a": 0.1})
+
+        thing = LazyJSONFieldModel.objects.get()
+        with sleuth.watch("gcloudc.db.models.fields.json.dumps") as dumps:
+            thing.save()
+            self.assertFalse(dumps.called)
+
+        thing = LazyJSONFieldModel.objects.get()
+        self.assertEqual({"a": 0.1}, thing.json_field)
+
+    def test_modified_value_is_saved(self):
+        LazyJSONFieldModel.objects.create(json_field={"a": 1})
+
+        thing = LazyJSONFieldModel.objects.get()
+        thing.json_field["b"] = 2
+        thing.save()
+
+        thing = LazyJSONFieldModel.objects.get()
+        self.assertEqual({"a": 1, "b": 2}, thing.json_field)
+
+    def test_values_are_decoded(self):
+        LazyJSONFieldModel.objects.create(json_field={"a": 1})
+
+        self.assertEqual([{"a": 1}], [x["json_field"] for x in LazyJSONFieldModel.objects.values("json_field")])
+        self.assertEqual([{"a": 1}], list(LazyJSONFieldModel.objects.values_list("json_field", flat=True)))
+
+        thing = LazyJSONFieldModel.objects.values_list("pk", "json_field")[0]
+        self.assertEqual({"a": 1}, thing[1])
+
+
+class JSONKeyLookupIndexerTests(TestCase):
+    def test_indexes_share_a_single_parse(self):
+        document = '{"a": {"b": [1, {"c": null}], "d": 2}}'
+        indexes = (
+            "json_path__a__b__0",
+            "json_path__a__b__1__c__isnull",
+            "json_path__a__d",
+            "json_path__missing",
+        )
+
+        indexer = JSONKeyLookupIndexer()
+        with sleuth.watch("gcloudc.db.models.fields.json.json.loads") as loads:
+            results = {x[0]: x[1:] for x in indexer.prep_values_for_database(document, indexes)}
+            self.assertEqual(1, loads.call_count)
+
+        self.assertEqual({
+            "json_path__a__b__0": (1, False),
+            "json_path__a__b__1__c__isnull": (True, False),
+            "json_path__a__d": (2, False),
+            "json_path__missing": ("", True),
+        }, results)
+
+        # Preparing a single index gives the same results
+        self.assertEqual(2, indexer.prep_value_for_database(document, "json_path__a__d"))
+        self.assertRaises(IgnoreForIndexing, indexer.prep_value_for_database, document, "json_path__missing")
@@ -0,0 +1,194 @@
+import datetime
+import threading
+
+from django.test import override_settings
+from google.cloud.datastore.entity import Entity
+
+from gcloudc.commands.management.commands import CloudDatastoreRunner
+from gcloudc.db.backends.datastore import memory
+
+from . import TestCase
+
+
+class MemoryClientTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        memory.reset("memory-test")
+        self.client = memory.Client(project="memory-test", namespace="ns1")
+
+    def tearDown(self):
+        memory.reset("memory-test")
+        super().tearDown()
+
+    def _put(self, name, **values):
+        entity = Entity(self.client.key("Person", name))
+        entity.update(values)
+        self.client.put(entity)
+        return entity
+
+    def test_put_get_and_delete(self):
+        self._put("a", age=10)
+
+        entity = self.client.get(self.client.key("Person", "a"))
+        self.assertEqual(10, entity["age"])
+
+        # Entities are copied in and out of the store
+        entity["age"] = 11
+        self.assertEqual(10, self.client.get(self.client.key("Person", "a"))["age"])
+
+        missing = []
+        keys = [self.client.key("Person", "a"), self.client.key("Person", "b")]
+        self.assertEqual(1, len(self.client.get_multi(keys, missing=missing)))
+        self.assertEqual([keys[1]], [x.key for x in missing])
+
+        self.client.delete_multi(keys)
+        self.assertIsNone(self.client.get(keys[0]))
+
+    def test_namespaces_are_isolated(self):
+        self._put("a", age=10)
+
+        other = memory.Client(project="memory-test", namespace="ns2")
+        self.assertIsNone(other.get(other.key("Person", "a")))
+        self.assertEqual([], list(other.query(kind="Person").fetch()))
+
+    def test_partial_keys_are_completed(self):
+        entity = Entity(self.client.key("Person"))
+        self.client.put(entity)
+
+        self.assertFalse(entity.key.is_partial)
+        self.assertIsNotNone(self.client.get(entity.key))
+
+    def test_id_allocation_and_reservation(self):
+        self.client.reserve_ids_multi([self.client.key("Person", memory.FIRST_ALLOCATED_ID + 10)])
+
+        keys = self.client.allocate_ids(self.client.key("Person"), 3)
+        self.assertEqual(3, len(set(x.id for x in keys)))
+        self.assertTrue(all(x.id > memory.FIRST_ALLOCATED_ID + 10 for x in keys))
+
+    def test_filters_and_ordering(self):
+        self._put("a", age=30, tags=["x", "y"])
+        self._put("b", age=10, tags=["z"])
+        self._put("c", age=20)
+        self._put("d", age=None)
+
+        query = self.client.query(kind="Person")
+        query.add_filter("age", ">", 10)
+        query.order = ["-age"]
+        self.assertEqual(["a", "c"], [x.key.name for x in query.fetch()])
+
+        # List properties match if any of their values match
+        query = self.client.query(kind="Person")
+        query.add_filter("tags", "=", "y")
+        self.assertEqual(["a"], [x.key.name for x in query.fetch()])
+
+        # Entities without the property are excluded when ordering, and None comes first
+        query = self.client.query(kind="Person", order=["age"])
+        self.assertEqual(["d", "b", "c", "a"], [x.key.name for x in query.fetch()])
+
+        query = self.client.query(kind="Person")
+        query.add_filter("__key__", ">=", self.client.key("Person", "c"))
+        self.assertEqual(["c", "d"], [x.key.name for x in query.fetch()])
+
+    def test_unindexed_properties_are_not_queryable(self):
+        entity = Entity(self.client.key("Person", "a"), exclude_from_indexes=("age",))
+        entity["age"] = 10
+        self.client.put(entity)
+
+        query = self.client.query(kind="Person")
+        query.add_filter("age", "=", 10)
+        self.assertEqual([], list(query.fetch()))
+
+    def test_ancestor_queries(self):
+        parent = self.client.key("Person", "a")
+        child = Entity(self.client.key("Pet", "rex", parent=parent))
+        self.client.put(child)
+        self.client.put(Entity(self.client.key("Pet", "tom")))
+
+        query = self.client.query(kind="Pet", ancestor=parent)
+        self.assertEqual([child.key], [x.key for x in query.fetch()])
+
+    def test_projection_returns_one_result_per_list_value(self):
+        when = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self._put("a", tags=["x", "y"], created=when)
+
+        query = self.client.query(kind="Person", projection=["tags"])
+        self.assertEqual(["x", "y"], sorted(x["tags"] for x in query.fetch()))
+
+        # Like the Datastore, projected datetimes are returned as microseconds
+        query = self.client.query(kind="Person", projection=["created"])
+        self.assertEqual([int(when.timestamp()) * 1000000], [x["created"] for x in query.fetch()])
+
+        query = self.client.query(kind="Person", projection=["tags"], distinct_on=["tags"])
+        query.add_filter("tags", ">=", "x")
+        self.assertEqual(2, len(list(query.fetch())))
+
+    def test_offset_limit_and_cursors(self):
+        for name in "abcde":
+            self._put(name)
+
+        query = self.client.query(kind="Person")
+        query.keys_only()
+
+        iterator = query.fetch(limit=2, offset=1)
+        self.assertEqual(["b", "c"], [x.key.name for x in iterator])
+        self.assertEqual(1, iterator._skipped_results)
+        self.assertTrue(iterator._more_results)
+
+        iterator = query.fetch(start_cursor=iterator.next_page_token)
+        self.assertEqual(["d", "e"], [x.key.name for x in iterator])
+        self.assertFalse(iterator._more_results)
+
+    def test_transactions_are_atomic(self):
+        self._put("a", age=10)
+
+        with self.client.transaction():
+            self._put("b", age=20)
+            self.client.delete(self.client.key("Person", "a"))
+
+            # Nothing is visible until the transaction commits
+            self.assertIsNone(self.client.get(self.client.key("Person", "b")))
+            self.assertIsNotNone(self.client.get(self.client.key("Person", "a")))
+
+        self.assertIsNotNone(self.client.get(self.client.key("Person", "b")))
+        self.assertIsNone(self.client.get(self.client.key("Person", "a")))
+
+        with self.assertRaises(ValueError):
+            with self.client.transaction():
+                self._put("c")
+                raise ValueError()
+
+        self.assertIsNone(self.client.get(self.client.key("Person", "c")))
+
+    def test_batches(self):
+        with self.client.batch():
+            self._put("a")
+            self._put("b")
+            self.assertIsNone(self.client.get(self.client.key("Person", "a")))
+
+        self.assertEqual(2, len(list(self.client.query(kind="Person").fetch())))
+
+    def test_batches_are_per_thread(self):
+        with self.client.transaction():
+            # A put from another thread isn't part of this thread's transaction
+            thread = threading.Thread(target=self._put, args=("a",))
+            thread.start()
+            thread.join()
+
+            self.assertIsNotNone(self.client.get(self.client.key("Person", "a")))
+
+    def test_kind_queries(self):
+        self._put("a")
+
+        query = self.client.query(kind="__kind__")
+        query.keys_only()
+        self.assertEqual(["Person"], [x.key.id_or_name for x in query.fetch()])
+
+
+class InMemoryRunnerTest(TestCase):
+    @override_settings(DATABASES={"default": {"ENGINE": "gcloudc.db.backends.datastore"}})
+    def test_emulator_used_by_default(self):
+        self.assertTrue(CloudDatastoreRunner()._uses_emulator())
+
+    @override_settings(DATABASES={"default": {"ENGINE": "gcloudc.db.backends.datastore", "IN_MEMORY": True}})
+    def test_emulator_not_used_when_in_memory(self):
+        self.assertFalse(CloudDatastoreRunner()._uses_emulator())
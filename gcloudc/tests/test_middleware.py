@@ -0,0 +1,92 @@
+import sleuth
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from gcloudc.db import (
+    middleware,
+    transaction,
+)
+from gcloudc.db.backends.datastore import stats
+from gcloudc.db.middleware import DatastorePerformanceMiddleware
+
+from . import TestCase
+from .models import (
+    TestFruit,
+    TestUser,
+)
+
+
+def view(request):
+    TestFruit.objects.create(name="Apple", color="Red")
+    TestFruit.objects.get(pk="Apple")
+    return HttpResponse()
+
+
+class RequestStatsTest(TestCase):
+    def test_rpcs_are_counted(self):
+        with stats.collect() as request_stats:
+            TestFruit.objects.create(name="Apple", color="Red")
+            list(TestFruit.objects.all())
+
+        self.assertTrue(request_stats.rpcs["commit"])
+        self.assertTrue(request_stats.rpcs["run_query"])
+        self.assertEqual(1, request_stats.entities_read)
+        self.assertTrue(request_stats.entities_written)
+        self.assertGreater(request_stats.datastore_time, 0)
+
+        # Nothing is collected outside the block
+        self.assertIsNone(stats.get_stats())
+
+    def test_multi_query_fan_out(self):
+        with stats.collect() as request_stats:
+            list(TestFruit.objects.filter(color__in=["Red", "Green", "Yellow"]))
+
+        self.assertEqual(1, request_stats.multi_queries)
+        self.assertEqual(3, request_stats.max_fan_out)
+
+    def test_cache_and_transactions(self):
+        user = TestUser.objects.create(username="existing", first_name="one", second_name="one")
+
+        with stats.collect() as request_stats:
+            with transaction.atomic():
+                TestFruit.objects.create(name="Apple", color="Red")
+
+                with transaction.non_atomic():
+                    TestUser.objects.get(pk=user.pk)
+                    self.assertFalse(TestFruit.objects.filter(pk="Banana"))
+
+        self.assertEqual(1, request_stats.transactions)
+        self.assertEqual((1, 1), (request_stats.cache_hits, request_stats.cache_misses))
+
+
+class DatastorePerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.middleware = DatastorePerformanceMiddleware(view)
+        self.request = RequestFactory().get("/fruit/")
+
+    def test_headers(self):
+        with sleuth.switch("gcloudc.db.middleware.PERFORMANCE_HEADERS", True):
+            response = self.middleware(self.request)
+
+        self.assertIn("rpcs=", response["X-Datastore-Stats"])
+        self.assertIn("commit=", response["X-Datastore-RPCs"])
+        self.assertNotIn("X-Datastore-Flagged", response)
+
+    def test_summary_is_logged_without_headers(self):
+        with sleuth.switch("gcloudc.db.middleware.PERFORMANCE_HEADERS", False):
+            with self.assertLogs(middleware.logger, "INFO") as logs:
+                response = self.middleware(self.request)
+
+        self.assertNotIn("X-Datastore-Stats", response)
+        self.assertEqual(1, logs.records[0].datastore["entities_read"])
+        self.assertEqual("/fruit/", logs.records[0].path)
+
+    def test_requests_over_thresholds_are_flagged(self):
+        with sleuth.switch("gcloudc.db.middleware.PERFORMANCE_HEADERS", True):
+            with sleuth.switch("gcloudc.db.middleware.PERFORMANCE_THRESHOLDS", {"rpcs": 1, "entities_read": 10}):
+                with self.assertLogs(middleware.logger, "WARNING") as logs:
+                    response = self.middleware(self.request)
+
+        self.assertEqual("rpcs", response["X-Datastore-Flagged"])
+        self.assertEqual(["rpcs"], logs.records[0].flagged)
@@ -1,7 +1,11 @@
 import google
+from google.cloud.datastore.entity import Entity
+from google.cloud.datastore.key import Key
+
+from gcloudc.db.backends.datastore.utils import django_ordering_sort_key
 
 from . import TestCase
-from .models import NullableFieldModel, StringPkModel
+from .models import ListOrderingModel, NullableFieldModel, StringPkModel
 
 
 class QueryByKeysTest(TestCase):
@@ -78,3 +82,119 @@ class QueryByKeysTest(TestCase):
 
         qs = qs.filter(pk__gte=str(3))
         self.assertEqual(qs.count(), 6)
+
+    def test_list_property_ordering(self):
+        """
+            List properties are ordered by their smallest value when ascending
+            and their largest value when descending, as the Datastore does
+        """
+        a = ListOrderingModel.objects.create(name="a", group=1, values=[5, 1])
+        b = ListOrderingModel.objects.create(name="b", group=1, values=[3])
+        c = ListOrderingModel.objects.create(name="c", group=0, values=[2, 4])
+        d = ListOrderingModel.objects.create(name="d", group=1, values=[7, 6])
+
+        qs = ListOrderingModel.objects.filter(pk__in=[a.pk, b.pk, c.pk, d.pk])
+
+        self.assertEqual(
+            [x.name for x in qs.order_by("values")], ["a", "c", "b", "d"]
+        )
+
+        self.assertEqual(
+            [x.name for x in qs.order_by("-values")], ["d", "a", "c", "b"]
+        )
+
+        # Mixed directions
+        self.assertEqual(
+            [x.name for x in qs.order_by("-group", "values")], ["a", "b", "d", "c"]
+        )
+
+        self.assertEqual(
+            [x.name for x in qs.order_by("group", "-values")], ["c", "d", "a", "b"]
+        )
+
+    def test_none_sorts_last_when_descending(self):
+        NullableFieldModel.objects.create(pk=1)
+        NullableFieldModel.objects.create(pk=2, nullable=2)
+        NullableFieldModel.objects.create(pk=3, nullable=1)
+        NullableFieldModel.objects.create(pk=4)
+
+        qs = NullableFieldModel.objects.filter(pk__in=[1, 2, 3, 4])
+
+        self.assertEqual(
+            list(qs.order_by("nullable", "pk").values_list("pk", flat=True)), [1, 4, 3, 2]
+        )
+
+        self.assertEqual(
+            list(qs.order_by("-nullable", "-pk").values_list("pk", flat=True)), [2, 3, 4, 1]
+        )
+
+    def test_descending_key_ordering(self):
+        for using in ("default", "nonamespace"):
+            for i in range(1, 4):
+                NullableFieldModel.objects.using(using).create(pk=i)
+
+            results = NullableFieldModel.objects.using(using).filter(
+                pk__in=[1, 2, 3]
+            ).order_by("-pk").values_list("pk", flat=True)
+
+            self.assertEqual(list(results), [3, 2, 1])
+
+
+class OrderingSortKeyTest(TestCase):
+    def _entity(self, namespace, id_or_name, **values):
+        entity = Entity(Key("test_kind", id_or_name, project="test", namespace=namespace))
+        entity.update(values)
+        return entity
+
+    def test_key_ordering_across_namespaces(self):
+        """
+            Keys are ordered by namespace, then by path. The default namespace
+            (None) sorts before any named namespace.
+        """
+        entities = [
+            self._entity("ns1", 1),
+            self._entity(None, 2),
+            self._entity("ns2", 1),
+            self._entity(None, 1),
+        ]
+
+        def as_tuples(results):
+            return [(x.key.namespace, x.key.id_or_name) for x in results]
+
+        self.assertEqual(
+            as_tuples(sorted(entities, key=django_ordering_sort_key(["__key__"]))),
+            [(None, 1), (None, 2), ("ns1", 1), ("ns2", 1)],
+        )
+
+        self.assertEqual(
+            as_tuples(sorted(entities, key=django_ordering_sort_key(["-__key__"]))),
+            [("ns2", 1), ("ns1", 1), (None, 2), (None, 1)],
+        )
+
+    def test_mixed_directions_with_none(self):
+        entities = [
+            self._entity(None, 1, group=1, name="b"),
+            self._entity(None, 2, group=None, name="a"),
+            self._entity(None, 3, group=2, name="a"),
+            self._entity(None, 4, group=1, name="a"),
+            self._entity(None, 5, name="c"),  # Missing property
+        ]
+
+        results = sorted(entities, key=django_ordering_sort_key(["-group", "name"]))
+        self.assertEqual([x.key.id for x in results], [3, 4, 1, 2, 5])
+
+        results = sorted(entities, key=django_ordering_sort_key(["group", "-name"]))
+        self.assertEqual([x.key.id for x in results], [5, 2, 1, 4, 3])
+
+    def test_list_values(self):
+        entities = [
+            self._entity(None, 1, values=[5, 1]),
+            self._entity(None, 2, values=[3]),
+            self._entity(None, 3, values=[]),
+        ]
+
+        results = sorted(entities, key=django_ordering_sort_key(["values"]))
+        self.assertEqual([x.key.id for x in results], [3, 1, 2])
+
+        results = sorted(entities, key=django_ordering_sort_key(["-values"]))
+        self.assertEqual([x.key.id for x in results], [1, 2, 3])
@@ -0,0 +1,70 @@
+from django.db import connection
+
+from gcloudc.db.backends.datastore.commands import FlushCommand
+from gcloudc.db.backends.datastore.querylog import QueryLog
+
+from . import TestCase
+from .models import TestFruit
+
+
+class QueryLogTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        connection.ensure_connection()
+        self.log = connection.connection.queries
+        self.enabled = self.log.enabled
+        self.log.enabled = True
+        self.log.clear()
+
+    def tearDown(self):
+        self.log.enabled = self.enabled
+        self.log.clear()
+        super().tearDown()
+
+    def _command(self, table):
+        return FlushCommand(table, connection)
+
+    def test_log_is_bounded_by_entries(self):
+        log = QueryLog(max_entries=2)
+        for table in ("a", "b", "c"):
+            log.add(self._command(table))
+
+        self.assertEqual(["FLUSH b", "FLUSH c"], [x.sql for x in log])
+
+    def test_log_is_bounded_by_bytes(self):
+        log = QueryLog(max_bytes=QueryLog().add(self._command("a" * 100)).size * 2)
+        for table in ("a", "b", "c"):
+            log.add(self._command(table * 100))
+
+        self.assertEqual(2, len(log))
+        self.assertEqual("FLUSH " + "c" * 100, log[-1].sql)
+
+    def test_commands_are_logged(self):
+        TestFruit.objects.create(name="Apple", color="Red")
+        self.assertEqual("Apple", TestFruit.objects.get(pk="Apple").name)
+        TestFruit.objects.filter(pk="Apple").delete()
+
+        entries = list(self.log)
+        self.assertEqual(
+            ["InsertCommand", "SelectCommand", "DeleteCommand"],
+            [x.command_type for x in entries if x.command_type != "SelectCommand" or x.entities_read],
+        )
+
+        insert = entries[0]
+        self.assertIn("INSERT INTO", insert.sql)
+        self.assertTrue(insert.rpcs)
+        self.assertTrue(insert.entities_written)
+        self.assertGreater(insert.duration, 0)
+
+        select = [x for x in entries if x.command_type == "SelectCommand"][0]
+        self.assertEqual(1, select.entities_read)
+
+        self.assertEqual(
+            ["type", "sql", "start", "duration", "rpcs", "entities_read", "entities_written"],
+            list(insert.as_dict()),
+        )
+
+    def test_nothing_is_logged_when_disabled(self):
+        self.log.enabled = False
+        TestFruit.objects.create(name="Apple", color="Red")
+        self.assertEqual(0, len(self.log))
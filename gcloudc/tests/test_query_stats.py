@@ -0,0 +1,125 @@
+import json
+
+import sleuth
+from django.test import (
+    RequestFactory,
+    override_settings,
+)
+
+from gcloudc.db import views
+from gcloudc.db.backends.datastore import querystats
+from gcloudc.db.backends.datastore.querystats import QueryStatsRegistry
+
+from . import TestCase
+from .models import TestFruit
+
+
+class QueryStatsTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        querystats.registry.clear()
+
+        enabled = sleuth.switch("gcloudc.db.backends.datastore.querystats.QUERY_STATS_ENABLED", True)
+        enabled.__enter__()
+        self.addCleanup(enabled.__exit__)
+
+        TestFruit.objects.create(name="Apple", color="Red")
+        TestFruit.objects.create(name="Banana", color="Yellow")
+
+    def tearDown(self):
+        querystats.registry.clear()
+        super().tearDown()
+
+    def _stats_for_table(self):
+        return [x for x in querystats.registry.top(100) if x["table"] == TestFruit._meta.db_table]
+
+    def test_parameters_are_stripped_from_shapes(self):
+        list(TestFruit.objects.filter(color="Red")[:5])
+        list(TestFruit.objects.filter(color="Yellow")[:10])
+        list(TestFruit.objects.filter(origin="Unknown"))
+
+        stats = self._stats_for_table()
+        self.assertEqual(2, len(stats))
+
+        by_color = [x for x in stats if "color=" in x["shape"]][0]
+        self.assertEqual(2, by_color["count"])
+        self.assertEqual(2, by_color["results"])
+        self.assertNotIn("Red", by_color["shape"])
+        self.assertGreaterEqual(by_color["p95_time"], by_color["mean_time"] / 2)
+
+    def test_fan_out_and_meta_queries_are_recorded(self):
+        list(TestFruit.objects.filter(color__in=["Red", "Yellow"]))
+        TestFruit.objects.get(pk="Apple")
+
+        stats = {x["max_branches"]: x for x in self._stats_for_table()}
+        self.assertEqual({"AsyncMultiQuery": 1}, stats[2]["meta_queries"])
+        self.assertEqual({"QueryByKeys": 1}, stats[1]["meta_queries"])
+
+    def test_slow_queries_are_logged(self):
+        with sleuth.switch("gcloudc.db.backends.datastore.querystats.SLOW_QUERY_THRESHOLD", 0):
+            with self.assertLogs(querystats.logger, "WARNING") as logs:
+                list(TestFruit.objects.filter(color="Red"))
+
+        plan = logs.records[-1].query
+        self.assertEqual(1, plan["results"])
+        self.assertIn("color", plan["sql"])
+
+    def test_sql_is_only_rendered_for_slow_queries(self):
+        with sleuth.watch("gcloudc.db.backends.datastore.querystats.generate_sql_representation") as render:
+            list(TestFruit.objects.filter(color="Red"))
+
+        self.assertFalse(render.called)
+        self.assertEqual(1, len(self._stats_for_table()))
+
+    def test_nothing_is_recorded_when_disabled(self):
+        with sleuth.switch("gcloudc.db.backends.datastore.querystats.QUERY_STATS_ENABLED", False):
+            list(TestFruit.objects.filter(color="Red"))
+
+            # Slow queries are still logged
+            with sleuth.switch("gcloudc.db.backends.datastore.querystats.SLOW_QUERY_THRESHOLD", 0):
+                with self.assertLogs(querystats.logger, "WARNING"):
+                    list(TestFruit.objects.filter(color="Red"))
+
+        self.assertFalse(self._stats_for_table())
+
+
+class QueryStatsRegistryTest(TestCase):
+    def test_top_offenders(self):
+        registry = QueryStatsRegistry()
+        for duration in (0.1, 0.2, 0.3):
+            registry.record("a", "Fruit", duration)
+        registry.record("b", "Fruit", 1.0)
+
+        self.assertEqual(["b", "a"], [x["shape"] for x in registry.top()])
+        self.assertEqual(["a", "b"], [x["shape"] for x in registry.top(order_by="count")])
+        self.assertEqual(0.3, registry["a"].p95_time)
+        self.assertRaises(ValueError, registry.top, order_by="shape")
+
+    def test_cheapest_shape_is_dropped_when_full(self):
+        registry = QueryStatsRegistry(max_shapes=2)
+        registry.record("a", "Fruit", 0.2)
+        registry.record("b", "Fruit", 0.1)
+        registry.record("c", "Fruit", 0.3)
+
+        self.assertEqual(["c", "a"], [x["shape"] for x in registry.top()])
+
+
+class QueryStatsViewTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    @override_settings(DEBUG=True)
+    def test_view(self):
+        TestFruit.objects.create(name="Apple", color="Red")
+        with sleuth.switch("gcloudc.db.backends.datastore.querystats.QUERY_STATS_ENABLED", True):
+            list(TestFruit.objects.filter(color="Red"))
+
+        response = views.query_stats(self.factory.get("/", {"limit": 1, "order_by": "count"}))
+        self.assertEqual(1, len(json.loads(response.content.decode("utf-8"))["queries"]))
+
+        response = views.query_stats(self.factory.get("/", {"order_by": "shape"}))
+        self.assertEqual(400, response.status_code)
+
+    def test_only_staff_can_see_stats(self):
+        self.assertEqual(403, views.query_stats(self.factory.get("/")).status_code)
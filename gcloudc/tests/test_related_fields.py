@@ -6,6 +6,7 @@ from django.core.exceptions import (
     ValidationError,
 )
 from django.db.utils import IntegrityError
+from gcloudc.db.backends.datastore import caching
 from gcloudc.db.models.fields.related import (
     RelatedListField,
     RelatedSetField,
@@ -217,6 +218,30 @@ class RelatedListFieldModelTests(TestCase):
             self.assertEqual(1, get.call_count)
             self.assertEqual(1, len(get.calls[0].args[3]))
 
+    def test_slicing_only_fetches_the_window(self):
+        others = [ISOther.objects.create() for i in range(5)]
+        thing = ISModel.objects.create(related_list=list(reversed(others)))
+
+        with sleuth.watch("gcloudc.db.backends.datastore.meta_queries.QueryByKeys.__init__") as get:
+            results = list(thing.related_list.all()[1:3])
+
+            self.assertEqual(1, get.call_count)
+            self.assertEqual(2, len(get.calls[0].args[3]))
+
+        self.assertEqual([others[3], others[2]], results)
+
+    def test_iterator_fetches_lazily_in_chunks(self):
+        others = [ISOther.objects.create() for i in range(5)]
+        thing = ISModel.objects.create(related_list=list(reversed(others)))
+
+        with sleuth.watch("gcloudc.db.backends.datastore.meta_queries.QueryByKeys.__init__") as get:
+            iterator = thing.related_list.all().iterator(chunk_size=2)
+            self.assertEqual(others[4], next(iterator))
+            self.assertEqual(1, get.call_count)
+
+            self.assertEqual(list(reversed(others[:4])), list(iterator))
+            self.assertEqual(3, get.call_count)
+
     def test_can_update_related_field_from_form(self):
         related = ISOther.objects.create()
         thing = ISModel.objects.create(related_list=[related])
@@ -344,6 +369,25 @@ class InstanceListFieldTests(TestCase):
         self.assertEqual(posts[0].ordered_tags.all()[1].name, "2")
         self.assertEqual(posts[0].ordered_tags.all()[2].name, "3")
 
+    def test_prefetch_related_keeps_order_and_duplicates(self):
+        tags = [Tag.objects.create(name="1"), Tag.objects.create(name="2"), Tag.objects.create(name="3")]
+
+        Post.objects.create(content="Bananas", ordered_tags=[tags[2], tags[0], tags[2]])
+        Post.objects.create(content="Bananas", ordered_tags=[tags[1], tags[0]])
+
+        # Make sure we don't just hit the entities cached by the creation
+        caching.reset_context(keep_disabled_flags=True)
+
+        with sleuth.watch("google.cloud.datastore.client.Client.get_multi") as get_multi:
+            posts = list(Post.objects.prefetch_related("ordered_tags").order_by("pk"))
+
+            # All of the tags are fetched together
+            self.assertEqual(1, get_multi.call_count)
+            self.assertEqual(3, len(get_multi.calls[0].args[1]))
+
+        self.assertEqual(["3", "1", "3"], [x.name for x in posts[0].ordered_tags.all()])
+        self.assertEqual(["2", "1"], [x.name for x in posts[1].ordered_tags.all()])
+
     def test_default_on_delete_does_nothing(self):
         child = ISOther.objects.create(pk=1)
         parent = ISModel.objects.create(related_list=[child])